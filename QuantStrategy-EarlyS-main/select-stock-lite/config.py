@@ -1,4 +1,5 @@
 
+import os
 from pathlib import Path
 
 start_date = "2009-01-01"
@@ -11,7 +12,7 @@ end_date = None
 # 策略明细
 strategy = {
     "name": "均值回归策略",
-    "hold_period": "W",
+    "hold_period": "W",  # 持仓周期，W 代表周，M 代表月，5D 代表每5个交易日，同时回测所有偏移并合并资金曲线
     "select_num": 20,
     "factor_list": [
         ("ZScore20", False, None, 1),
@@ -26,6 +27,7 @@ strategy = {
 # - 修改select_num之后，只需要再执行step3选股即可，不需要准备数据和计算因子
 # - 修改factor_list之后，需要执行step2因子计算，不需要再次准备数据
 # - 修改filter_list之后，需要执行step2因子计算，不需要再次准备数据
+# - 开启 use_pipeline_cache 之后，回测主程序会自动判断需要重新运行哪些步骤
 
 # 资金曲线再择时
 equity_timing = {"name": "移动平均线", "params": [20]}
@@ -47,6 +49,30 @@ c_rate = 1.2 / 10000
 t_rate = 1 / 1000
 # 上市至今交易天数
 days_listed = 250
+# 并行计算的进程数，设置为1表示串行（方便debug），默认使用CPU核心数-1
+n_jobs = max(1, os.cpu_count() - 1)
+
+# 增量更新数据：只处理有新数据的股票，适合每天收盘后更新数据。首次运行或数据配置变化时会自动全量处理
+incremental_update = False
+
+# 全市场面板模式预处理数据：一次性对全部股票做向量化预处理，速度更快，但需要更多内存
+panel_preprocess = False
+
+# 股票日线CSV的读取方式：'pandas' 为默认方式；'pyarrow' 使用固定的数据类型读取，速度更快，需要安装pyarrow
+csv_reader = 'pandas'
+
+# 数据类型策略：'default' 保持原始类型；'compact' 使用更紧凑的类型（float32因子、int8标记、category代码和名称），减少内存和缓存大小，需要时再开启
+dtype_policy = 'default'
+
+# 内存预算（MB），每个步骤结束时会打印内存报告，峰值内存超过预算时给出提示，None表示不检查
+memory_budget_mb = None
+
+# 流水线缓存：回测主程序根据数据、配置和代码的变化，自动跳过不需要重新运行的步骤
+use_pipeline_cache = True
+
+# 交易日历只用本地的指数数据和节假日表（data/节假日.csv）离线生成，临近过期时在后台联网更新节假日表，不会等待网络
+calendar_online_refresh = True  # 是否允许后台联网更新节假日表，离线环境可以设置为False
+calendar_timeout = 5  # 联网更新节假日表的超时时间（秒）
 
 # =====参数预检查=====
 if Path(stock_data_path).exists() is False:
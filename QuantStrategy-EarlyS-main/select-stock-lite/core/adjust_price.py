@@ -0,0 +1,129 @@
+"""
+复权价格
+
+预处理数据只保存复权因子（收盘价 / 前收盘价 的累乘），不再保存复权价格列。
+需要复权价格时通过 AdjustedPrices 按需计算，支持前复权、后复权，并且可以锚定任意日期。
+单只股票的数据是一维数组，全市场面板是 日期 x 股票 的二维数组，都沿着第0维（日期）计算。
+"""
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+# 复权价格列 -> 对应的原始价格列
+FQ_PRICE_COLS = {'开盘价_复权': '开盘价', '最高价_复权': '最高价', '最低价_复权': '最低价', '收盘价_复权': '收盘价'}
+
+# 计算复权价格需要的数据列
+FQ_BASE_COLS = ['复权因子', '开盘价', '最高价', '最低价', '收盘价']
+
+# 支持的复权类型
+FUQUAN_TYPES = ('后复权', '前复权')
+
+
+def cal_fq_factor(close, preclose) -> np.ndarray:
+    """
+    沿着日期方向一次性累乘计算复权因子，一维（单只股票）和二维（日期 x 股票）数组都适用。
+    空值不参与累乘，对应位置的复权因子仍为空值，和 pd.Series.cumprod 一致
+    :param close: 收盘价
+    :param preclose: 前收盘价
+    :return: 复权因子
+    """
+    ratio = np.asarray(close, dtype=np.float64) / np.asarray(preclose, dtype=np.float64)
+    is_nan = np.isnan(ratio)
+    fq_factor = np.cumprod(np.where(is_nan, 1.0, ratio), axis=0)
+    fq_factor[is_nan] = np.nan
+    return fq_factor
+
+
+class AdjustedPrices(Mapping):
+    """
+    复权价格视图：读取某个复权价格列时才计算，可以直接当作 复权价格列 -> 数组 的字典使用。
+    复权价格 = 原始价格 / 收盘价 * 复权因子 * (锚定日收盘价 / 锚定日复权因子)，锚定日的复权收盘价等于原始收盘价
+    """
+
+    def __init__(self, prices: Mapping, fuquan_type='后复权', anchor=None, dates=None):
+        """
+        :param prices: 原始数据，需要包含 收盘价，以及 复权因子 或者 前收盘价，可以是DataFrame或者 列名 -> 数组 的字典
+        :param fuquan_type: 复权类型，'后复权' 默认锚定第一个有效交易日，'前复权' 默认锚定最后一个有效交易日
+        :param anchor: 锚定日期，非交易日锚定之前最近的交易日，None表示使用复权类型的默认锚定日
+        :param dates: 交易日期，指定锚定日期时需要提供，DataFrame中有交易日期列时可以省略
+        """
+        if fuquan_type not in FUQUAN_TYPES:
+            raise ValueError(f'计算复权价时，出现未知的复权类型：{fuquan_type}')
+        self.prices = prices
+        self.fuquan_type = fuquan_type
+        self.close = np.asarray(prices['收盘价'], dtype=np.float64)
+        if '复权因子' in prices:
+            self.fq_factor = np.asarray(prices['复权因子'], dtype=np.float64)
+        else:
+            self.fq_factor = cal_fq_factor(self.close, prices['前收盘价'])
+        if anchor is not None and dates is None:
+            dates = prices['交易日期']
+        self.anchor_row = self._get_anchor_row(anchor, dates)
+        self._scale = None
+        self._cache = {}
+
+    def _get_anchor_row(self, anchor, dates):
+        """
+        获取锚定日所在的行，二维数据每只股票单独计算。
+        指定锚定日期时，每只股票锚定在锚定日当天或者之前最近的有效交易日，锚定日停牌的股票不会整列变成空值；
+        锚定日之前没有有效数据的股票，行号为-1，复权价格为空值
+        """
+        valid = ~np.isnan(self.fq_factor)
+        if anchor is not None:
+            row = pd.DatetimeIndex(dates).searchsorted(pd.to_datetime(anchor), side='right') - 1
+            if row < 0:
+                raise ValueError(f'复权锚定日期早于数据的开始日期：{anchor}')
+            valid = valid[:row + 1]
+            return np.where(valid.any(axis=0), row - np.argmax(valid[::-1], axis=0), -1)
+
+        if self.fuquan_type == '后复权':
+            return np.argmax(valid, axis=0)
+        return len(valid) - 1 - np.argmax(valid[::-1], axis=0)
+
+    @property
+    def scale(self):
+        """
+        锚定日收盘价 / 锚定日复权因子
+        """
+        if self._scale is None:
+            rows = np.expand_dims(np.maximum(self.anchor_row, 0), 0)
+            close = np.take_along_axis(self.close, rows, axis=0)[0]
+            fq_factor = np.take_along_axis(self.fq_factor, rows, axis=0)[0]
+            self._scale = np.where(self.anchor_row >= 0, close / fq_factor, np.nan)
+        return self._scale
+
+    def __getitem__(self, col) -> np.ndarray:
+        if col not in self._cache:
+            if col not in self:
+                raise KeyError(col)
+            fq_close = self._cache.get('收盘价_复权')
+            if fq_close is None:
+                fq_close = self._cache['收盘价_复权'] = self.fq_factor * self.scale
+            if col != '收盘价_复权':
+                price = np.asarray(self.prices[FQ_PRICE_COLS[col]], dtype=np.float64)
+                self._cache[col] = price / self.close * fq_close
+        return self._cache[col]
+
+    def __contains__(self, col):
+        return col in FQ_PRICE_COLS and FQ_PRICE_COLS[col] in self.prices
+
+    def __iter__(self):
+        return iter([col for col in FQ_PRICE_COLS if col in self])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+def add_adjusted_prices(df: pd.DataFrame, cols=None, fuquan_type='后复权', anchor=None) -> pd.DataFrame:
+    """
+    根据复权因子，给K线数据添加复权价格列
+    :param df: K线数据，需要包含 复权因子、交易日期 以及对应的原始价格列
+    :param cols: 需要添加的复权价格列，None表示添加全部复权价格列
+    :param fuquan_type: 复权类型，'后复权' 或 '前复权'
+    :param anchor: 锚定日期，None表示使用复权类型的默认锚定日
+    :return: 添加复权价格列之后的数据
+    """
+    fq_prices = AdjustedPrices(df, fuquan_type=fuquan_type, anchor=anchor)
+    cols = list(fq_prices) if cols is None else cols
+    return df.assign(**{col: fq_prices[col] for col in cols})
@@ -0,0 +1,362 @@
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.adjust_price import FQ_BASE_COLS, FQ_PRICE_COLS, add_adjusted_prices
+from core.dtype_policy import apply_dtype_policy
+from core.name_status import NAME_HISTORY_COLS, build_name_history
+from core.utils.path_kit import get_folder_path
+
+# 列式存储的文件后缀，使用Feather(Arrow IPC)格式，支持按列读取和内存映射
+STORE_SUFFIX = '.arrow'
+
+# 股票列表文件，记录当前缓存中有效的股票代码（有序）
+SYMBOL_LIST_FILE = '股票列表.pkl'
+
+# 股票名称变化区间表文件，参考 core.name_status
+NAME_HISTORY_FILE = '股票名称历史.pkl'
+
+# 进程内的名称变化区间表缓存：(文件修改时间, 文件大小) -> 区间表
+_name_history_cache = {}
+
+# 行情面板的价格字段，每个字段保存为一个 日期 x 股票 的float64矩阵
+PANEL_FIELDS = ('open', 'close', 'preclose')
+
+# 财务数据清单文件，记录每只股票的原始财务文件（文件名、修改时间、大小）以及合并后的数据列
+FIN_MANIFEST_FILE = '财务数据清单.pkl'
+
+# 财务数据的主键列，读取时总是包含
+FIN_KEY_COLS = ['stock_code', 'report_date', 'publish_date']
+
+# 记录每条财报来自哪个原始文件，财务指标需要按文件分别计算
+FIN_FILE_COL = '文件名'
+
+# 进程内的财务数据清单缓存：(文件修改时间, 文件大小) -> 清单
+_fin_manifest_cache = {}
+
+
+# region 股票预处理数据
+def get_candle_store_folder() -> Path:
+    """
+    获取股票预处理数据的存储目录，每只股票对应一个列式存储文件
+    """
+    return get_folder_path('data', '运行缓存', '股票预处理数据')
+
+
+def save_candle_data(candle_data_dict: Dict[str, pd.DataFrame], symbols: Optional[List[str]] = None,
+                     dtype_policy: str = 'default'):
+    """
+    将股票的预处理数据保存为列式存储，每只股票一个文件
+    :param candle_data_dict: 股票代码 -> 预处理后的K线数据
+    :param symbols: 缓存中全部有效的股票代码，None表示就是candle_data_dict中的股票。
+                    增量更新时只需要传入有变化的股票数据，其余股票的文件保持不变
+    :param dtype_policy: 保存时使用的数据类型策略，参考 core.dtype_policy
+    """
+    folder = get_candle_store_folder()
+    symbols = list(candle_data_dict.keys()) if symbols is None else symbols
+    history_list = []
+    for stock_code, df in candle_data_dict.items():
+        save_candle_df(stock_code, apply_dtype_policy(df, dtype_policy))
+        history_list.append(build_name_history(df['股票代码'], df['交易日期'], df['股票名称']))
+    save_name_history(history_list, set(candle_data_dict.keys()), symbols)
+
+    # 清理已经不在股票列表中的旧文件，避免缓存目录无限膨胀
+    symbol_set = set(symbols)
+    for file_path in folder.glob(f'*{STORE_SUFFIX}'):
+        if file_path.stem not in symbol_set:
+            file_path.unlink()
+
+    pd.to_pickle(symbols, folder / SYMBOL_LIST_FILE)
+
+
+def save_candle_df(stock_code: str, df: pd.DataFrame):
+    """
+    保存单只股票的预处理数据
+    :param stock_code: 股票代码
+    :param df: 预处理后的K线数据
+    """
+    df.reset_index(drop=True).to_feather(get_candle_store_folder() / f'{stock_code}{STORE_SUFFIX}')
+
+
+def save_name_history(history_list: List[pd.DataFrame], updated_symbols: set, symbols: List[str]):
+    """
+    更新股票名称变化区间表：有变化的股票使用新的区间，其余有效股票保留原来的区间
+    :param history_list: 有变化的股票的名称变化区间表
+    :param updated_symbols: 有变化的股票代码
+    :param symbols: 缓存中全部有效的股票代码
+    """
+    history_path = get_candle_store_folder() / NAME_HISTORY_FILE
+    symbol_set = set(symbols)
+    if history_path.exists() and not symbol_set.issubset(updated_symbols):
+        old_history = pd.read_pickle(history_path)
+        old_symbols = old_history['股票代码'].astype(str)
+        history_list = [old_history[old_symbols.isin(symbol_set - updated_symbols)], *history_list]
+
+    history_list = [history.astype({'股票代码': str}) for history in history_list if not history.empty]
+    if history_list:
+        name_history = pd.concat(history_list, ignore_index=True)
+    else:
+        name_history = pd.DataFrame({col: [] for col in NAME_HISTORY_COLS})
+    name_history = name_history.sort_values(['股票代码', '开始日期']).reset_index(drop=True)
+    name_history['股票代码'] = name_history['股票代码'].astype('category')
+    name_history.to_pickle(history_path)
+
+
+def load_name_history() -> pd.DataFrame:
+    """
+    读取股票名称变化区间表，文件没有变化时复用进程内的缓存
+    """
+    history_path = get_candle_store_folder() / NAME_HISTORY_FILE
+    if not history_path.exists():
+        raise FileNotFoundError(f'未找到股票名称历史：{history_path}，请先运行step1整理数据')
+    stat = history_path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if key not in _name_history_cache:
+        _name_history_cache.clear()
+        _name_history_cache[key] = pd.read_pickle(history_path)
+    return _name_history_cache[key]
+
+
+def get_candle_symbols() -> List[str]:
+    """
+    获取缓存中所有股票的代码
+    """
+    symbol_list_path = get_candle_store_folder() / SYMBOL_LIST_FILE
+    if not symbol_list_path.exists():
+        raise FileNotFoundError(f'未找到股票预处理数据：{symbol_list_path}，请先运行step1整理数据')
+    return pd.read_pickle(symbol_list_path)
+
+
+def read_candle_df(stock_code: str, columns: Optional[Iterable[str]] = None,
+                   fuquan_type: str = '后复权', anchor=None) -> pd.DataFrame:
+    """
+    读取单只股票的预处理数据。复权价格列（收盘价_复权 等）不在缓存中保存，指定读取时根据复权因子按需计算
+    :param stock_code: 股票代码
+    :param columns: 需要读取的列，None表示读取缓存中的全部列
+    :param fuquan_type: 复权价格的复权类型，'后复权' 或 '前复权'
+    :param anchor: 复权价格的锚定日期，None表示使用复权类型的默认锚定日
+    """
+    file_path = get_candle_store_folder() / f'{stock_code}{STORE_SUFFIX}'
+    if columns is None:
+        return pd.read_feather(file_path)
+
+    columns = list(dict.fromkeys(columns))
+    fq_cols = [col for col in columns if col in FQ_PRICE_COLS]
+    if not fq_cols:
+        return pd.read_feather(file_path, columns=columns)
+
+    read_cols = [col for col in columns if col not in FQ_PRICE_COLS]
+    df = pd.read_feather(file_path, columns=list(dict.fromkeys([*read_cols, *FQ_BASE_COLS, '交易日期'])))
+    return add_adjusted_prices(df, fq_cols, fuquan_type=fuquan_type, anchor=anchor)[columns]
+
+
+def load_candle_data(symbols: Optional[Iterable[str]] = None,
+                     columns: Optional[Iterable[str]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    批量读取股票的预处理数据，支持按列读取和指定股票范围
+    :param symbols: 需要读取的股票代码，None表示读取缓存中的全部股票
+    :param columns: 需要读取的列，None表示读取全部列
+    :return: 股票代码 -> K线数据
+    """
+    all_symbols = get_candle_symbols()
+    if symbols is not None:
+        symbols = set(symbols)
+        all_symbols = [symbol for symbol in all_symbols if symbol in symbols]
+    return {symbol: read_candle_df(symbol, columns) for symbol in all_symbols}
+# endregion
+
+
+# region 行情面板
+def get_market_panel_folder() -> Path:
+    """
+    获取行情面板的存储目录，包含日期索引、股票索引以及每个价格字段的 .npy 矩阵
+    """
+    return get_folder_path('data', '运行缓存', '行情面板')
+
+
+def _save_npy(file_path: Path, arr: np.ndarray):
+    """
+    先写入临时文件再替换，避免正在通过内存映射读取的回测进程读到不完整的数据
+    """
+    tmp_path = file_path.with_name(f'{file_path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp_path, file_path)
+
+
+def save_market_panel(market_pivot_dict: Dict[str, pd.DataFrame]):
+    """
+    将开盘价、收盘价、前收盘价透视表保存为连续存储的 .npy 矩阵，日期和股票索引单独保存
+    :param market_pivot_dict: 字段 -> 透视表（index为交易日期，columns为股票代码）
+    """
+    folder = get_market_panel_folder()
+    dates = market_pivot_dict['open'].index
+    symbols = market_pivot_dict['open'].columns
+    for field in PANEL_FIELDS:
+        values = market_pivot_dict[field].reindex(index=dates, columns=symbols).to_numpy(dtype=np.float64)
+        _save_npy(folder / f'{field}.npy', np.ascontiguousarray(values))
+    _save_npy(folder / 'symbols.npy', symbols.to_numpy(dtype=str))
+    # 索引最后写入，读取时以索引为准
+    _save_npy(folder / 'dates.npy', dates.to_numpy(dtype='datetime64[ns]'))
+
+
+def load_market_panel() -> dict:
+    """
+    以内存映射的方式读取行情面板，不会把数据整体读入内存，多个回测进程可以共享系统的页缓存。
+    使用写时复制模式（'c'）打开，切片可以直接传给numba，修改也不会写回文件。
+    :return: dict，包含 dates(DatetimeIndex)、symbols(Index)，以及每个价格字段的二维数组
+    """
+    folder = get_market_panel_folder()
+    if not (folder / 'dates.npy').exists():
+        raise FileNotFoundError(f'未找到行情面板数据：{folder}，请先运行step1整理数据')
+    panel = {
+        'dates': pd.DatetimeIndex(np.load(folder / 'dates.npy')),
+        'symbols': pd.Index(np.load(folder / 'symbols.npy')),
+    }
+    for field in PANEL_FIELDS:
+        panel[field] = np.load(folder / f'{field}.npy', mmap_mode='c').view(np.ndarray)
+    return panel
+
+
+def load_market_pivot() -> Dict[str, pd.DataFrame]:
+    """
+    读取行情面板，并转换为透视表格式（会复制数据），用于增量更新等需要修改数据的场景
+    """
+    panel = load_market_panel()
+    return {field: pd.DataFrame(np.array(panel[field]), index=panel['dates'], columns=panel['symbols'])
+            for field in PANEL_FIELDS}
+# endregion
+
+
+# region 财务数据
+def get_fin_store_folder() -> Path:
+    """
+    获取财务数据的存储目录，每只股票的全部原始财务文件合并为一个列式存储文件
+    """
+    return get_folder_path('data', '运行缓存', '财务数据')
+
+
+def load_fin_manifest() -> dict:
+    """
+    读取财务数据清单：股票代码 -> {'files': 原始文件签名, 'columns': 数据列}，文件没有变化时复用进程内的缓存
+    """
+    manifest_path = get_fin_store_folder() / FIN_MANIFEST_FILE
+    if not manifest_path.exists():
+        return {}
+    stat = manifest_path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    if key not in _fin_manifest_cache:
+        _fin_manifest_cache.clear()
+        _fin_manifest_cache[key] = pd.read_pickle(manifest_path)
+    return _fin_manifest_cache[key]
+
+
+def get_fin_files_signature(stock_fin_folder: Path) -> tuple:
+    """
+    根据文件名、修改时间和大小计算单只股票原始财务文件的签名，不需要读取文件内容
+    """
+    signature = []
+    for file_path in stock_fin_folder.iterdir():
+        if file_path.is_file():
+            stat = file_path.stat()
+            signature.append((file_path.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def read_fin_source_df(stock_fin_folder: Path) -> pd.DataFrame:
+    """
+    读取单只股票的全部原始财务文件并合并，保持文件的遍历顺序，通过 文件名 列区分来源
+    :param stock_fin_folder: 单只股票的原始财务数据目录
+    """
+    finance_dfs = []
+    for file_path in stock_fin_folder.iterdir():
+        if not file_path.is_file():
+            continue
+        finance_df = pd.read_csv(file_path, parse_dates=['publish_date'], skiprows=1, encoding='gbk')
+        finance_df[FIN_FILE_COL] = file_path.name
+        finance_dfs.append(finance_df)
+    return pd.concat(finance_dfs, ignore_index=True)
+
+
+def sync_fin_store(fin_data_path: Path, symbols: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    将原始财务数据目录整理为按股票划分的列式存储。只有原始文件发生变化（新增财报、文件更新）的股票需要重新整理，
+    其余股票直接复用已有的存储文件
+    :param fin_data_path: 原始财务数据目录，每只股票一个子目录
+    :param symbols: 需要整理的股票代码，None表示整理目录中的全部股票
+    :return: 本次重新整理的股票代码
+    """
+    folder = get_fin_store_folder()
+    manifest = dict(load_fin_manifest())
+    symbol_set = None if symbols is None else set(symbols)
+
+    updated_symbols = []
+    existing_symbols = set()
+    for stock_fin_folder in sorted(Path(fin_data_path).iterdir()):
+        stock_code = stock_fin_folder.name
+        if not stock_fin_folder.is_dir() or (symbol_set is not None and stock_code not in symbol_set):
+            continue
+        signature = get_fin_files_signature(stock_fin_folder)
+        if not signature:
+            continue
+        existing_symbols.add(stock_code)
+        file_path = folder / f'{stock_code}{STORE_SUFFIX}'
+        if manifest.get(stock_code, {}).get('files') == signature and file_path.exists():
+            continue
+
+        fin_df = read_fin_source_df(stock_fin_folder)
+        tmp_path = file_path.with_name(f'{file_path.name}.tmp')
+        fin_df.to_feather(tmp_path)
+        os.replace(tmp_path, file_path)
+        manifest[stock_code] = {'files': signature, 'columns': fin_df.columns.tolist()}
+        updated_symbols.append(stock_code)
+
+    # 清理原始目录中已经不存在的股票
+    removed_symbols = [code for code in manifest if code not in existing_symbols and
+                       (symbol_set is None or code in symbol_set)]
+    for stock_code in removed_symbols:
+        del manifest[stock_code]
+        (folder / f'{stock_code}{STORE_SUFFIX}').unlink(missing_ok=True)
+
+    if updated_symbols or removed_symbols:
+        pd.to_pickle(manifest, folder / FIN_MANIFEST_FILE)
+    return updated_symbols
+
+
+def read_fin_df(stock_code: str, columns: Optional[Iterable[str]] = None) -> Optional[pd.DataFrame]:
+    """
+    读取单只股票的财务数据，只读取需要的列。原始文件中没有的列补充为空值
+    :param stock_code: 股票代码
+    :param columns: 需要读取的财务数据列，主键列和 文件名 列总是会读取，None表示读取全部列
+    :return: 财务数据，没有财务数据时返回None
+    """
+    manifest = load_fin_manifest()
+    if stock_code not in manifest:
+        return None
+    stored_cols = manifest[stock_code]['columns']
+    if columns is None:
+        columns = stored_cols
+    columns = list(dict.fromkeys([*FIN_KEY_COLS, FIN_FILE_COL, *columns]))
+    fin_df = pd.read_feather(get_fin_store_folder() / f'{stock_code}{STORE_SUFFIX}',
+                             columns=[col for col in columns if col in stored_cols])
+    return fin_df.reindex(columns=columns)
+
+
+def load_fin_data(symbols: Iterable[str], columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    批量读取多只股票的财务数据
+    :param symbols: 需要读取的股票代码
+    :param columns: 需要读取的财务数据列，None表示读取全部列
+    :return: 合并后的财务数据，通过 stock_code 列区分股票，没有财务数据的股票不包含在结果中
+    """
+    manifest = load_fin_manifest()
+    fin_dfs = [read_fin_df(symbol, columns) for symbol in symbols if symbol in manifest]
+    if not fin_dfs:
+        columns = [] if columns is None else columns
+        return pd.DataFrame(columns=list(dict.fromkeys([*FIN_KEY_COLS, FIN_FILE_COL, *columns])))
+    return pd.concat(fin_dfs, ignore_index=True)
+# endregion
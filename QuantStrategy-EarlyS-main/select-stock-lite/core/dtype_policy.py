@@ -0,0 +1,124 @@
+
+import sys
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# 支持的数据类型策略：default 保持原始类型；compact 使用更紧凑的类型，减少内存和缓存文件大小
+DTYPE_POLICIES = ('default', 'compact')
+
+# 使用类别类型的列
+CATEGORY_COLS = ['股票代码', '股票名称']
+
+# 使用int32的日序号列
+ORDINAL_COLS = ['上市至今交易天数']
+
+# 除了 是否*、下日_* 之外的标记列，板块代码也按照标记列转换为int8
+FLAG_COLS = ['一字涨停', '一字跌停', '开盘涨停', '开盘跌停', '周频终止日', '月频终止日', '板块']
+
+
+# region 数据类型策略
+def is_flag_col(col: str) -> bool:
+    return col.startswith(('是否', '下日_')) or col in FLAG_COLS
+
+
+def is_float32_safe(values: np.ndarray) -> bool:
+    """
+    判断浮点数列转换为float32之后是否安全：不会溢出，并且不同的数值转换后仍然不同，因子排名不会改变
+    :param values: float64数组
+    """
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return True
+    if np.abs(finite).max() >= np.finfo(np.float32).max:
+        return False
+    unique_values = np.unique(finite)
+    return len(np.unique(unique_values.astype(np.float32))) == len(unique_values)
+
+
+def apply_dtype_policy(df: pd.DataFrame, policy: str = 'default', factor_cols: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    按照数据类型策略转换列的类型：
+    - 是否*、下日_* 等标记列：没有空值时转换为int8（布尔列保持bool），有空值时转换为float32
+    - 股票代码、股票名称：转换为category
+    - 上市至今交易天数：转换为int32
+    - 因子列：转换为float32之后，不同的数值仍然不同时才转换
+    :param df: 需要转换的数据
+    :param policy: 数据类型策略，参考 DTYPE_POLICIES
+    :param factor_cols: 因子列
+    :return: 转换后的数据
+    """
+    if policy == 'default':
+        return df
+    if policy != 'compact':
+        raise ValueError(f'不支持的数据类型策略：{policy}，可选：{DTYPE_POLICIES}')
+
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if is_flag_col(col):
+            has_nan = df[col].isna().any()
+            if dtype == bool or (dtype == object and not has_nan):
+                dtypes[col] = bool
+            elif dtype.kind in 'iuf':
+                dtypes[col] = np.float32 if has_nan else np.int8
+        elif col in CATEGORY_COLS and not isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = 'category'
+        elif col in ORDINAL_COLS and dtype.kind in 'iuf' and not df[col].isna().any():
+            dtypes[col] = np.int32
+
+    for col in factor_cols:
+        if col in df.columns and df[col].dtype == np.float64 and is_float32_safe(df[col].to_numpy()):
+            dtypes[col] = np.float32
+
+    dtypes = {col: dtype for col, dtype in dtypes.items() if df[col].dtype != dtype}
+    return df.astype(dtypes) if dtypes else df
+# endregion
+
+
+# region 内存报告
+def get_memory_usage() -> dict:
+    """
+    获取当前进程的内存占用（MB），优先使用psutil，没有安装时使用resource模块
+    :return: dict，包含 当前内存、峰值内存、子进程峰值内存，无法获取的项为None
+    """
+    usage = {'当前内存': None, '峰值内存': None, '子进程峰值内存': None}
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        usage['当前内存'] = info.rss / 1024 / 1024
+        if hasattr(info, 'peak_wset'):  # Windows
+            usage['峰值内存'] = info.peak_wset / 1024 / 1024
+    except ImportError:
+        pass
+
+    try:
+        import resource
+        # Linux下ru_maxrss的单位是KB，macOS下是字节
+        unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        if usage['峰值内存'] is None:
+            usage['峰值内存'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+        usage['子进程峰值内存'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit or None
+    except ImportError:
+        pass
+    return usage
+
+
+def print_memory_report(step_name: str, memory_budget_mb: float = None, **frames: pd.DataFrame):
+    """
+    打印步骤的内存报告，峰值内存超过预算时给出提示
+    :param step_name: 步骤名称
+    :param memory_budget_mb: 内存预算（MB），None表示不检查
+    :param frames: 需要统计内存占用的数据
+    """
+    usage = get_memory_usage()
+    items = [f'{name}：{value:,.1f} MB' for name, value in usage.items() if value is not None]
+    for name, df in frames.items():
+        items.append(f'{name}：{df.memory_usage(deep=True).sum() / 1024 / 1024:,.1f} MB')
+    print(f'📊 [{step_name}] 内存报告：' + '，'.join(items))
+
+    peak = max(value for value in (usage['峰值内存'], usage['子进程峰值内存'], 0) if value is not None)
+    if memory_budget_mb and peak > memory_budget_mb:
+        print(f'⚠️ [{step_name}] 峰值内存 {peak:,.1f} MB 超过预算 {memory_budget_mb:,.1f} MB，'
+              f'可以使用 compact 数据类型策略，或者减少并行的进程数')
+# endregion
@@ -12,6 +12,7 @@ from core.model.backtest_config import BacktestConfig
 from core.model.type_def import BSE_MAIN, SimuParams, StockMarketData, get_symbol_type
 from core.rebalance import RebAlways
 from core.simulator import Simulator
+from core.trading_calendar import load_trading_calendar
 from core.utils.path_kit import get_file_path
 
 pd.set_option("display.max_rows", 1000)
@@ -19,63 +20,83 @@ pd.set_option("expand_frame_repr", False)  # 当列太多时不换行
 
 
 def read_trading_dates(first_date, last_date):
-    calendar = pd.read_csv(get_file_path("data", "交易日历.csv"), encoding="utf-8", parse_dates=["交易日期"])
-    trading_dates = calendar["交易日期"]
+    calendar = load_trading_calendar(get_file_path("data", "交易日历.csv"))
 
-    trading_dates = trading_dates[(trading_dates >= first_date) & (trading_dates <= last_date)]
+    # 交易日历是有序的，通过二分查找截取区间，index为交易日序号
+    start = calendar.dates.searchsorted(pd.to_datetime(first_date), side="left")
+    end = calendar.dates.searchsorted(pd.to_datetime(last_date), side="right")
+    trading_dates = pd.Series(calendar.dates[start:end], index=calendar.ordinals[start:end], name="交易日期")
     return trading_dates
 
 
-def get_stock_market(pivot_dict_stock, trading_dates, symbols, symbol_types) -> StockMarketData:
-    df_open: pd.DataFrame = pivot_dict_stock["open"].loc[trading_dates, symbols]
-    df_close: pd.DataFrame = pivot_dict_stock["close"].loc[trading_dates, symbols]
-    df_preclose: pd.DataFrame = pivot_dict_stock["preclose"].loc[trading_dates, symbols]
-    # Not sure if necessary
-    should_copy = True
+def get_stock_market(market_panel, trading_dates) -> StockMarketData:
+    """
+    从行情面板中截取回测区间的行情，交易日连续时直接使用行切片，不复制数据
+    :param market_panel: 行情面板，参考 core.data_store.load_market_panel
+    :param trading_dates: 回测区间的交易日
+    """
+    row_indexer = market_panel["dates"].get_indexer(trading_dates)
+    if np.any(row_indexer < 0):
+        raise KeyError(f"行情数据中缺少交易日：{trading_dates[row_indexer < 0].tolist()}")
+    if len(row_indexer) > 0 and np.array_equal(row_indexer, np.arange(row_indexer[0], row_indexer[0] + len(row_indexer))):
+        row_indexer = slice(row_indexer[0], row_indexer[0] + len(row_indexer))
 
     data = StockMarketData(
-        candle_begin_ts=(trading_dates.astype(np.int64) // 1000000000).to_numpy(copy=should_copy),
-        op=df_open.to_numpy(copy=should_copy),
-        cl=df_close.to_numpy(copy=should_copy),
-        pre_cl=df_preclose.to_numpy(copy=should_copy),
-        types=np.array(symbol_types, dtype=np.int16),
+        candle_begin_ts=(trading_dates.astype(np.int64) // 1000000000).to_numpy(),
+        op=market_panel["open"][row_indexer],
+        cl=market_panel["close"][row_indexer],
+        pre_cl=market_panel["preclose"][row_indexer],
+        types=np.array([get_symbol_type(sym) for sym in market_panel["symbols"]], dtype=np.int16),
     )
 
     return data
 
 
-def calc_equity(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ratio: pd.DataFrame):
+def calc_equity(conf: BacktestConfig, market_panel: dict, df_stock_ratio: pd.DataFrame):
     """
     计算资金曲线
     :param conf: 回测配置
-    :param pivot_dict_stock: 股票行情
+    :param market_panel: 股票行情面板
     :param df_stock_ratio: 股票目标资金占比
     """
-    symbols = sorted(df_stock_ratio.columns)
-    symbol_types = [get_symbol_type(sym) for sym in symbols]
-    if any(x == BSE_MAIN for x in symbol_types):
+    if any(get_symbol_type(sym) == BSE_MAIN for sym in df_stock_ratio.columns):
         raise ValueError(f"BSE not supported")  # No Beijing stocks
+    # 行情面板包含全部股票，资金占比对齐到面板的股票顺序，未选中的股票占比为0
+    symbols = market_panel["symbols"]
+    missing_symbols = df_stock_ratio.columns.difference(symbols)
+    if len(missing_symbols) > 0:
+        raise KeyError(f"行情数据中缺少股票：{missing_symbols.tolist()}")
 
     # 确定回测区间
-    start_date = max(df_stock_ratio.index.min(), pd.to_datetime(conf.start_date))
+    start_date = max(df_stock_ratio.index.get_level_values(-1).min(), pd.to_datetime(conf.start_date))
     trading_dates = read_trading_dates(start_date, conf.end_date)
 
     # 读取行情
-    market = get_stock_market(pivot_dict_stock, trading_dates, symbols, symbol_types)
+    market = get_stock_market(market_panel, trading_dates)
+
+    # nD持仓周期的资金占比包含周期偏移，资金平均分配到每个偏移，分别模拟之后合并为一条资金曲线
+    if isinstance(df_stock_ratio.index, pd.MultiIndex):
+        offset_ratio_list = [ratio.droplevel(0) for _, ratio in df_stock_ratio.groupby(level=0)]
+    else:
+        offset_ratio_list = [df_stock_ratio]
 
     # 开始回测
-    df_stock_ratio = df_stock_ratio.loc[start_date : conf.end_date, symbols]
     params = SimuParams(
-        init_cash=conf.initial_cash,  # 初始资金
+        init_cash=conf.initial_cash / len(offset_ratio_list),  # 初始资金
         stamp_tax_rate=conf.t_rate,  # 印花税率
         commission_rate=conf.c_rate,  # 券商佣金费率
     )
-    adj_dts = df_stock_ratio.index.to_numpy().astype(np.int64) // 1000000000
-    ratios = df_stock_ratio.to_numpy()
     pos_calc = RebAlways(market.types)
 
     s_time = time.perf_counter()
-    cashes, pos_values, stamp_taxes, commissions = start_simulation(market, params, adj_dts, ratios, pos_calc)
+    offset_results = []
+    for offset_ratio in offset_ratio_list:
+        offset_ratio = offset_ratio.loc[start_date : conf.end_date].reindex(columns=symbols, fill_value=0)
+        adj_dts = offset_ratio.index.to_numpy().astype(np.int64) // 1000000000
+        ratios = offset_ratio.to_numpy()
+        offset_results.append(start_simulation(market, params, adj_dts, ratios, pos_calc))
+    # 每个偏移的账户相加，得到整体账户
+    cashes, pos_values, stamp_taxes, commissions = [np.sum(values, axis=0) for values in zip(*offset_results)]
 
     print(f"✅ 完成模拟交易，花费时间: {time.perf_counter() - s_time:.3f}秒\n")
 
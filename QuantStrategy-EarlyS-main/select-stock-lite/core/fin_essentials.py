@@ -1,37 +1,99 @@
 
+from typing import TYPE_CHECKING
+
 import numpy as np
 import pandas as pd
 
-from core.model.backtest_config import BacktestConfig
+from core.data_store import FIN_FILE_COL, load_fin_data, read_fin_df
+
+if TYPE_CHECKING:
+    # 只用于类型标注，导入回测配置会读取 config 并检查数据路径
+    from core.model.backtest_config import BacktestConfig
 
 pd.set_option('expand_frame_repr', False)  # 当列太多时不换行
 
+# 空日期（NaT）对应的整数
+NAT_VALUE = np.iinfo(np.int64).min
+
+# 历史区间 -> 历史数据列名的后缀，顺序和 get_last_quarter_and_year_index 的返回值一致
+HIS_SPAN_LABELS = {'q': '上季度', '4q': '去年同期', 'y': '去年年报', 'y_q': '去年一季度', 'y_2q': '去年二季度',
+                   'y_3q': '去年三季度'}
+
 
 # region  财务数据处理
 def mark_old_report(date_list):
     """
     标记当前研报期是否为废弃研报。
     例如，已经发布1季度报，又更新了去年的年报，则去年的年报就是废弃报告
+    之前的财报日期的累计最大值比当前财报日期更新时，当前财报就是废弃报告
     :param date_list:
-    :return:1表示为旧研报，nan表示非旧研报
+    :return:1表示为旧研报，0表示非旧研报
     """
-    # 使用 list 相比 TSeries 在性能上要好很多，使用上保持一致
-    date_list = date_list.tolist()
-    res = []
-    for index, date in enumerate(date_list):
-        flag = 0  # 初始化返回结果，0表示为非废弃报告
-        for i in sorted(range(index), reverse=True):
-            # 如果之前已经有比now更加新的财报了，将now标记为1
-            if date_list[i] > date:
-                flag = 1
-                break
-        res.append(flag)
-    return res
+    values = pd.DatetimeIndex(date_list).values.astype('datetime64[ns]').view(np.int64)
+    is_nat = values == NAT_VALUE  # 空的日期和任何日期比较都不成立
+    # 之前所有财报日期的最大值，空的日期是最小的整数，不会影响最大值
+    prev_max = np.maximum.accumulate(np.r_[NAT_VALUE, values[:-1]])
+    return ((prev_max > values) & ~is_nat).astype(int).tolist()
 
 
 def get_last_quarter_and_year_index(date_list):
     """
     获取上季度、上年度、以及上一次年报的索引
+    财报日期都是季度末时，使用 (年份, 季度) 编号和二分查找一次性计算；否则逐行查找
+    :param date_list: 财报日期数据
+    :return: 上季度、上年度、以及上一次年报的索引
+    """
+    dates = pd.DatetimeIndex(date_list)
+    if len(dates) > 0 and not dates.hasnans and dates.is_quarter_end.all():
+        return get_last_quarter_and_year_index_by_key(dates)
+    return get_last_quarter_and_year_index_by_loop(date_list)
+
+
+def find_last_index(keys, targets, no_meaning_index):
+    """
+    对每一行，查找之前的行中编号等于目标编号的最近一行
+    :param keys: 每一行的编号
+    :param targets: 每一行需要查找的目标编号
+    :param no_meaning_index: 找不到时使用的索引
+    :return: 索引的list
+    """
+    n = len(keys)
+    row_index = np.arange(n, dtype=np.int64)
+    # 编号和行号组合成一个整数，按编号排序，编号相同时按行号排序
+    sorted_keys = np.sort(keys * n + row_index)
+    # 在当前行之前、编号等于目标编号的行中，最后一行就是最近的一行
+    pos = np.searchsorted(sorted_keys, targets * n + row_index, side='left') - 1
+    found = pos >= 0
+    candidates = sorted_keys[np.maximum(pos, 0)]
+    found &= (candidates // n == targets)
+    return np.where(found, candidates % n, no_meaning_index).tolist()
+
+
+def get_last_quarter_and_year_index_by_key(dates: pd.DatetimeIndex):
+    """
+    财报日期都是季度末时，和 get_last_quarter_and_year_index_by_loop 的结果完全一致：
+    相差3个月就是上一个季度编号，相差12个月就是4个季度之前的编号，去年各季度直接按 (年份, 月份) 查找
+    :param dates: 财报日期，都是季度末
+    :return: 上季度、上年度、以及上一次年报的索引
+    """
+    no_meaning_index = len(dates) - 1  # 无意义的索引值，（最后一行的索引）
+    years = dates.year.to_numpy(dtype=np.int64)
+    months = dates.month.to_numpy(dtype=np.int64)
+    quarter_keys = years * 4 + (months - 1) // 3
+    month_keys = years * 12 + months
+
+    last_q_index = find_last_index(quarter_keys, quarter_keys - 1, no_meaning_index)  # 上个季度的index
+    last_4q_index = find_last_index(quarter_keys, quarter_keys - 4, no_meaning_index)  # 去年同期的index
+    last_y_index = find_last_index(month_keys, (years - 1) * 12 + 12, no_meaning_index)  # 去年年报的index
+    last_y_q_index = find_last_index(month_keys, (years - 1) * 12 + 3, no_meaning_index)  # 去年一季度的index
+    last_y_2q_index = find_last_index(month_keys, (years - 1) * 12 + 6, no_meaning_index)  # 去年二季度的index
+    last_y_3q_index = find_last_index(month_keys, (years - 1) * 12 + 9, no_meaning_index)  # 去年三季度的index
+    return last_q_index, last_4q_index, last_y_index, last_y_q_index, last_y_2q_index, last_y_3q_index
+
+
+def get_last_quarter_and_year_index_by_loop(date_list):
+    """
+    逐行向前查找上季度、上年度、以及上一次年报的索引，财报日期不是季度末时使用
     :param date_list: 财报日期数据
     :return: 上季度、上年度、以及上一次年报的索引
     """
@@ -236,42 +298,38 @@ def cal_fin_data(data, flow_fin_list=(), cross_fin_list=(), discard=True):
     return data
 
 
-def get_his_data(fin_df, data_cols, span='q'):
+def get_his_index_dict(date_list):
+    """
+    一次性获取全部历史区间的索引，同一份财务数据获取多个历史区间时可以复用
+    :param date_list: 财报日期数据
+    :return: 区间 -> 索引的list，区间参考 HIS_SPAN_LABELS
+    """
+    return dict(zip(HIS_SPAN_LABELS.keys(), get_last_quarter_and_year_index(date_list)))
+
+
+def get_his_data(fin_df, data_cols, span='q', his_index_dict=None):
     """
     获取财务数据的历史数据值
     :param fin_df: 财务数据的dataframe
     :param data_cols:需要获取的列名
-    :param span:事件间隔
+    :param span:事件间隔，参考 HIS_SPAN_LABELS，默认使用上季度
+    :param his_index_dict: 已经计算好的历史区间索引，None表示重新计算
     :return:
     """
-    data = fin_df.copy()
     # 获取上一季度、年度的索引、上年报索引
-    last_q_index, last_4q_index, last_y_index, last_y_q_index, last_y_2q_index, last_y_3q_index = \
-        get_last_quarter_and_year_index(data['report_date'])
-    if span == '4q':  # 去年同期
-        last_index = last_4q_index
-        label = '去年同期'
-    elif span == 'y':  # 去年年报
-        last_index = last_y_index
-        label = '去年年报'
-    elif span == 'y_q':
-        last_index = last_y_q_index
-        label = '去年一季度'
-    elif span == 'y_2q':
-        last_index = last_y_2q_index
-        label = '去年二季度'
-    elif span == 'y_3q':
-        last_index = last_y_3q_index
-        label = '去年三季度'
-    else:  # 默认使用上季度
-        last_index = last_q_index
-        label = '上季度'
+    if his_index_dict is None:
+        his_index_dict = get_his_index_dict(fin_df['report_date'])
+    if span not in HIS_SPAN_LABELS:  # 默认使用上季度
+        span = 'q'
+    last_index = his_index_dict[span]
+    label = HIS_SPAN_LABELS[span]
 
     # 获取历史数据
-    last_df = get_index_data(data, last_index, data_cols)
+    last_df = get_index_data(fin_df, last_index, data_cols)
     del last_df['index']
     # 合并数据
-    data = pd.merge(left=data, right=last_df, left_index=True, right_index=True, how='left', suffixes=('', '_' + label))
+    data = pd.merge(left=fin_df, right=last_df, left_index=True, right_index=True, how='left',
+                    suffixes=('', '_' + label))
     # 只输出历史数据
     new_cols = [col + '_' + label for col in data_cols]
     keep_col = ['publish_date', 'report_date'] + new_cols
@@ -280,59 +338,110 @@ def get_his_data(fin_df, data_cols, span='q'):
     return data, new_cols
 
 
+def get_his_values(fin_df, data_cols, span='q', his_index_dict=None):
+    """
+    获取财务数据的历史数据值，结果和 get_his_data 一致，只返回历史数据列。
+    财务数据的索引是 0 ~ n-1 的排列时，直接按位置从数组中取值，不需要逐个区间合并
+    :param fin_df: 财务数据的dataframe
+    :param data_cols: 需要获取的列名
+    :param span: 事件间隔，参考 HIS_SPAN_LABELS，默认使用上季度
+    :param his_index_dict: 已经计算好的历史区间索引，None表示重新计算
+    :return: 历史数据，索引和 fin_df 一致
+    """
+    labels = fin_df.index.to_numpy()
+    n = len(labels)
+    if labels.dtype.kind not in 'iu' or not np.array_equal(np.sort(labels), np.arange(n)):
+        data, new_cols = get_his_data(fin_df, data_cols, span, his_index_dict)
+        return data[new_cols]
+
+    if his_index_dict is None:
+        his_index_dict = get_his_index_dict(fin_df['report_date'])
+    if span not in HIS_SPAN_LABELS:  # 默认使用上季度
+        span = 'q'
+    label = HIS_SPAN_LABELS[span]
+
+    # 和 get_index_data 一致：按索引标签取值，取到最后一行的视为没有历史数据
+    pos_of_label = np.empty(n, dtype=np.int64)
+    pos_of_label[labels] = np.arange(n)
+    target = np.asarray(his_index_dict[span], dtype=np.int64)[labels]
+    valid = target != n - 1
+    rows = pos_of_label[target]
+
+    his_values = {}
+    for col in data_cols:
+        values = fin_df[col].to_numpy()
+        his_values[col + '_' + label] = values[rows] if valid.all() else np.where(valid, values[rows], np.nan)
+    return pd.DataFrame(his_values, index=fin_df.index)
+
+
+def split_fin_cols(fin_cols):
+    """
+    划分流量型和截面型财务数据
+    :param fin_cols: 需要的财务因子列
+    :return: 流量型财务数据列、截面型财务数据列、需要从财务数据存储中读取的列
+    """
+    flow_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if
+                              (col.startswith('R_')) or (col.startswith('C_'))]))  # 流量型
+    cross_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if col.startswith('B_')]))  # 截面型
+    return flow_fin_cols, cross_fin_cols, set(flow_fin_cols + cross_fin_cols + fin_cols)
+
+
+def get_finance_reports(fin_cols, stock_code, stock_fin_df=None):
+    """
+    读取单只股票的财务数据，按原始文件计算财务指标，并按照发布日期排序
+    :param fin_cols: 需要的财务因子列
+    :param stock_code: 股票代码
+    :param stock_fin_df: 已经批量读取的这只股票的财务数据，None表示从财务数据存储中读取
+    :return: 删除废弃报告后的财务数据、原始财务数据（不抛弃废弃的报告数据），没有财务数据时返回None
+    """
+    # 划分流量型和截面型财务数据
+    flow_fin_cols, cross_fin_cols, read_cols = split_fin_cols(fin_cols)
+    if stock_fin_df is None:
+        # 从财务数据存储中只读取需要的列，原始文件中没有的列已经补充为nan
+        stock_fin_df = read_fin_df(stock_code, read_cols)
+    if stock_fin_df is None:
+        return None
+
+    finance_dfs = []
+    # 各个原始财务数据文件分别计算
+    for _, finance_df in stock_fin_df.groupby(FIN_FILE_COL, sort=False):
+        del finance_df[FIN_FILE_COL]
+        # 计算财务类因子
+        finance_df = cal_fin_data(data=finance_df, flow_fin_list=flow_fin_cols, cross_fin_list=cross_fin_cols,
+                                  discard=False)
+        # 合并
+        col = ['publish_date', 'report_date'] + fin_cols
+        finance_dfs.append(finance_df[col])
+
+    # 对数据做合并和排序处理
+    all_finance_df = pd.concat(finance_dfs, ignore_index=True)
+    all_finance_df.sort_values(by=['publish_date', 'report_date'], inplace=True)
+    all_finance_df_not_discord = all_finance_df.copy()
+
+    all_finance_df['废弃报告'] = mark_old_report(all_finance_df['report_date'])  # 获取废弃报告
+    # 删除废弃的研报
+    all_finance_df = all_finance_df[all_finance_df['废弃报告'] != 1]
+    # 删除不必要的行
+    del all_finance_df['废弃报告']
+
+    all_finance_df.drop_duplicates(subset=['publish_date'], keep='last', inplace=True)  # 删除重复数据
+    all_finance_df.reset_index(drop=True, inplace=True)  # 重置索引
+    return all_finance_df, all_finance_df_not_discord
+
+
 # 计算财务预处理数据
-def merge_with_finance_data(conf: BacktestConfig, stock_code, stock_df):
+def merge_with_finance_data(conf: 'BacktestConfig', stock_code, stock_df):
     """
     将财务数据合并到日线数据上
     :param conf: 回测配置
     :param stock_code: 股票代码
     :param stock_df: 日线数据
     """
-    # 判断路径是否存在
-    stock_fin_folder = conf.fin_data_path / stock_code
     fin_cols = conf.fin_cols
+    finance_reports = get_finance_reports(fin_cols, stock_code)
 
-    if stock_fin_folder.exists():
-        # 获取路径下的所有文件名
-        # 划分流量型和截面型财务数据
-        flow_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if
-                                  (col.startswith('R_')) or (col.startswith('C_'))]))  # 流量型
-        cross_fin_cols = list(set([col.split('@xbx')[0] + '@xbx' for col in fin_cols if col.startswith('B_')]))  # 截面型
-
-        finance_dfs = []
-        # 读取路径下的各个财务数据文件
-        for file in stock_fin_folder.iterdir():
-            # 读取财务数据
-            finance_df = pd.read_csv(stock_fin_folder / file, parse_dates=['publish_date'], skiprows=1, encoding='gbk')
-
-            # 判断财务数据中是否包含我们需要的finance_cols
-            for col in set(flow_fin_cols + cross_fin_cols + fin_cols):
-                # 如果没有我们需要的，赋值nan到财务数据的dataframe中
-                if col not in finance_df.columns:
-                    finance_df[col] = np.nan
-
-            necessary_cols = ['stock_code', 'report_date', 'publish_date']  # 所必须的字段
-            finance_df = finance_df[list(set(necessary_cols + flow_fin_cols + cross_fin_cols + fin_cols))]  # 取需要的数据
-            # 计算财务类因子
-            finance_df = cal_fin_data(data=finance_df, flow_fin_list=flow_fin_cols, cross_fin_list=cross_fin_cols,
-                                      discard=False)
-            # 合并
-            col = ['publish_date', 'report_date'] + fin_cols
-            finance_dfs.append(finance_df[col])
-
-        # 对数据做合并和排序处理
-        all_finance_df = pd.concat(finance_dfs, ignore_index=True)
-        all_finance_df.sort_values(by=['publish_date', 'report_date'], inplace=True)
-        all_finance_df_not_discord = all_finance_df.copy()
-
-        all_finance_df['废弃报告'] = mark_old_report(all_finance_df['report_date'])  # 获取废弃报告
-        # 删除废弃的研报
-        all_finance_df = all_finance_df[all_finance_df['废弃报告'] != 1]
-        # 删除不必要的行
-        del all_finance_df['废弃报告']
-
-        all_finance_df.drop_duplicates(subset=['publish_date'], keep='last', inplace=True)  # 删除重复数据
-        all_finance_df.reset_index(drop=True, inplace=True)  # 重置索引
+    if finance_reports is not None:
+        all_finance_df, all_finance_df_not_discord = finance_reports
         stock_df = pd.merge_asof(stock_df, all_finance_df, left_on='交易日期', right_on='publish_date',
                                  direction='backward')  # 合并股票数据和财务数据
         # 演示merge_asof效果：右边的数据，会找左边最接近的日期去合并。backward往上找，forward往下找，nearest最近
@@ -347,6 +456,42 @@ def merge_with_finance_data(conf: BacktestConfig, stock_code, stock_df):
     return stock_df, all_finance_df, all_finance_df_not_discord
 
 
+def build_fin_panel(fin_cols, symbols, dates, candle_dates=None) -> dict:
+    """
+    构建财务数据的时点面板：每个交易日、每只股票在当天已经发布的最新财报数据，废弃报告已经删除。
+    和 merge_with_finance_data 的 merge_asof 一致，发布日期当天即可使用，最新财报中的空值不会用更早的财报填充
+    :param fin_cols: 需要的财务因子列
+    :param symbols: 股票代码，按股票分组构建时只需要传入一组股票，面板只包含这组股票的列
+    :param dates: 交易日期
+    :param candle_dates: 股票代码 -> 该股票K线的交易日期，指定时只保留有K线的日期，其余位置为空值
+    :return: dict，包含 dates(DatetimeIndex)、symbols(Index)，以及每个财务因子列的 日期 x 股票 二维数组
+    """
+    dates = pd.DatetimeIndex(dates)
+    symbols = pd.Index(symbols)
+    panel = {'dates': dates, 'symbols': symbols}
+    for col in fin_cols:
+        panel[col] = np.full((len(dates), len(symbols)), np.nan)
+
+    # 一次读取这组股票需要的财务数据列，再按股票分别计算财务指标，没有财务数据的股票保持空值
+    fin_df = load_fin_data(symbols, split_fin_cols(fin_cols)[2])
+    for stock_code, stock_fin_df in fin_df.groupby('stock_code', sort=False):
+        sym_idx = symbols.get_loc(stock_code)
+        all_finance_df = get_finance_reports(fin_cols, stock_code, stock_fin_df)[0]
+        # 每个交易日对应的最新财报，发布日期在交易日期之后的为-1
+        report_index = np.searchsorted(all_finance_df['publish_date'].to_numpy(dtype='datetime64[ns]'),
+                                       dates.values, side='right') - 1
+        valid = report_index >= 0
+        if candle_dates is not None:
+            has_candle = np.zeros(len(dates), dtype=bool)
+            rows = dates.get_indexer(pd.DatetimeIndex(candle_dates[stock_code]))
+            has_candle[rows[rows >= 0]] = True
+            valid &= has_candle
+        for col in fin_cols:
+            values = all_finance_df[col].to_numpy(dtype=np.float64)
+            panel[col][valid, sym_idx] = values[report_index[valid]]
+    return panel
+
+
 def merge_with_calc_fin_data(stock_df, no_discard_finance_df, calc_fin_cols, extra_agg_dict):
     """
     通过计算添加研报的同期数据
@@ -359,27 +504,41 @@ def merge_with_calc_fin_data(stock_df, no_discard_finance_df, calc_fin_cols, ext
     if len(calc_fin_cols) == 0:
         return stock_df
 
+    his_index_dict = None  # 历史区间的索引只需要计算一次
+    his_dfs = []
+    all_new_cols = []
     for col_dict in calc_fin_cols:
         cols = col_dict.get('col')
         q = col_dict.get('quarter')
         if len(cols) == 0 or len(q) == 0:
             continue
 
-        # 获取去年年报数据，注意用全量未删除的废弃的财报数据
-        fin_df, new_cols = get_his_data(no_discard_finance_df, cols, q)
         # 刚刚上市的股票没有研报
-        if fin_df.empty:
-            for new_col in new_cols:
-                stock_df[new_col] = np.nan
-                extra_agg_dict[new_col] = 'last'
+        if no_discard_finance_df.empty:
+            label = HIS_SPAN_LABELS.get(q, HIS_SPAN_LABELS['q'])
+            all_new_cols += [col + '_' + label for col in cols]
             continue
 
-        # 去年年报数据合并到df中
+        # 获取历史数据，注意用全量未删除的废弃的财报数据
+        if his_index_dict is None:
+            his_index_dict = get_his_index_dict(no_discard_finance_df['report_date'])
+        his_df = get_his_values(no_discard_finance_df, cols, q, his_index_dict)
+        his_dfs.append(his_df)
+        all_new_cols += his_df.columns.tolist()
+
+    all_new_cols = list(dict.fromkeys(all_new_cols))
+    if his_dfs:
+        # 全部历史数据拼接之后，一次性合并到df中
+        fin_df = pd.concat([no_discard_finance_df[['publish_date', 'report_date']], *his_dfs], axis=1)
+        fin_df = fin_df.loc[:, ~fin_df.columns.duplicated()]
         stock_df = pd.merge_asof(left=stock_df, right=fin_df, left_on='交易日期', right_on='publish_date',
                                  direction='backward', suffixes=("", "_y"))
-        for new_col in new_cols:
-            stock_df[new_col].fillna(method='ffill', inplace=True)
-            extra_agg_dict[new_col] = 'last'
+        stock_df[all_new_cols] = stock_df[all_new_cols].ffill()
+    else:
+        for new_col in all_new_cols:
+            stock_df[new_col] = np.nan
 
+    for new_col in all_new_cols:
+        extra_agg_dict[new_col] = 'last'
     return stock_df
 # endregion
@@ -1,12 +1,15 @@
 
-import json
+import math
 import os
-import random
-import time
 
+import numba as nb
 import numpy as np
 import pandas as pd
-import requests
+
+from core.adjust_price import AdjustedPrices
+from core.model.type_def import BSE_MAIN, SSE_STAR, SZSE_CHINEXT, get_symbol_types
+from core.name_status import cal_name_status, get_status_flag
+from core.trading_calendar import EastmoneyCalendarProvider
 
 pd.set_option('expand_frame_repr', False)
 pd.set_option('future.no_silent_downcasting', True)
@@ -14,6 +17,34 @@ pd.set_option('future.no_silent_downcasting', True)
 pd.set_option('display.unicode.ambiguous_as_wide', True)
 pd.set_option('display.unicode.east_asian_width', True)
 
+# PERIOD_AGG_DICT 是周期内数据整合所必须的字典。数据整合方法包括:
+# first(保留周期内第一条数据)、max(保留周期内最大的数据)、min(保留周期内最小的数据)、sum(周期内所有数据求和)、last(保留最新数据)
+PERIOD_AGG_DICT = {
+    # 必须列
+    '周期最后交易日': 'last',
+    '股票代码': 'last',
+    '股票名称': 'last',
+    '是否交易': ['last', 'sum', 'count'],  # 统计局和计算是否交易，交易天数，市场交易天数
+    '开盘价': 'first',
+    '最高价': 'max',
+    '最低价': 'min',
+    '收盘价': 'last',
+    '成交额': 'sum',
+    '流通市值': 'last',
+    '总市值': 'last',
+    '上市至今交易天数': 'last',
+    '下日_是否交易': 'last',
+    '下日_开盘涨停': 'last',
+    '下日_是否ST': 'last',
+    # '下日_是否S': 'last',
+    '下日_是否退市': 'last',
+    # '下日_开盘买入涨跌幅': 'last',
+    '复权因子': 'last'
+}
+
+# 周期转换之后，同一列有多种聚合方式时的列名
+PERIOD_AGG_RENAME = {('是否交易', 'last'): '是否交易', ('是否交易', 'sum'): '交易天数', ('是否交易', 'count'): '市场交易天数'}
+
 
 def cal_fuquan_price(df, fuquan_type='后复权', method=None):
     """
@@ -28,34 +59,21 @@ def cal_fuquan_price(df, fuquan_type='后复权', method=None):
     DataFrame: 最终输出的df中，新增字段：收盘价_复权，开盘价_复权，最高价_复权，最低价_复权
     """
 
-    # 计算复权因子
-    fq_factor = (df['收盘价'] / df['前收盘价']).cumprod()
-
-    # 计算前复权或后复权收盘价
-    if fuquan_type == '后复权':  # 如果使用后复权方法
-        fq_close = fq_factor * (df.iloc[0]['收盘价'] / fq_factor.iloc[0])
-    elif fuquan_type == '前复权':  # 如果使用前复权方法
-        fq_close = fq_factor * (df.iloc[-1]['收盘价'] / fq_factor.iloc[-1])
-    else:  # 如果给的复权方法非上述两种标准方法会报错
-        raise ValueError(f'计算复权价时，出现未知的复权类型：{fuquan_type}')
-
-    # 计算其他价格的复权值
-    fq_open = df['开盘价'] / df['收盘价'] * fq_close
-    fq_high = df['最高价'] / df['收盘价'] * fq_close
-    fq_low = df['最低价'] / df['收盘价'] * fq_close
+    # 计算复权因子，以及前复权或后复权价格
+    fq_prices = AdjustedPrices(df, fuquan_type=fuquan_type)
 
     # 一次性赋值，提高计算效率
     df = df.assign(
-        复权因子=fq_factor,
-        收盘价_复权=fq_close,
-        开盘价_复权=fq_open,
-        最高价_复权=fq_high,
-        最低价_复权=fq_low,
+        复权因子=fq_prices.fq_factor,
+        收盘价_复权=fq_prices['收盘价_复权'],
+        开盘价_复权=fq_prices['开盘价_复权'],
+        最高价_复权=fq_prices['最高价_复权'],
+        最低价_复权=fq_prices['最低价_复权'],
     )
 
     # 如果指定了额外的方法，计算该方法的复权价格
     if method and method != '开盘':
-        df[f'{method}_复权'] = df[method] / df['收盘价'] * fq_close
+        df[f'{method}_复权'] = df[method] / df['收盘价'] * fq_prices['收盘价_复权']
 
     # 删除中间变量复权因子
     # df.drop(columns=['复权因子'], inplace=True)
@@ -157,10 +175,150 @@ def import_index_data(path, date_range=(None, None), max_param=0):
     return df_index
 
 
+@nb.njit(cache=True)
+def ffill_positions(valid):
+    """
+    计算向前填充时每个位置使用的数据位置：之前（包含自身）最近的有效位置，没有有效位置时为-1
+    """
+    positions = np.empty(len(valid), dtype=np.int64)
+    last = -1
+    for i in range(len(valid)):
+        if valid[i]:
+            last = i
+        positions[i] = last
+    return positions
+
+
+@nb.njit(cache=True)
+def ffill_float(values):
+    """
+    原地向前填充浮点数组中的空值
+    """
+    for i in range(1, len(values)):
+        if np.isnan(values[i]):
+            values[i] = values[i - 1]
+
+
+def fillna_float(values, fill_values):
+    """
+    用fill_values原地填充浮点数组中的空值，非浮点数组没有空值，不需要处理
+    """
+    if values.dtype.kind == 'f':
+        is_nan = np.isnan(values)
+        values[is_nan] = fill_values[is_nan]
+
+
+def ffill_array(values):
+    """
+    向前填充空值，支持numpy数组以及category等扩展类型
+    """
+    valid = pd.notna(values)
+    if valid.all():
+        return values
+    return pd.api.extensions.take(values, ffill_positions(valid), allow_fill=True)
+
+
 def merge_with_index_data(df, index_data, fill_0_list=()):
     """
     原始股票数据在不交易的时候没有数据。
     将原始股票数据和指数数据合并，可以补全原始股票数据没有交易的日期。
+    通过二分查找把股票的交易日期映射到指数数据的行号，每一列按照行号分散到预先分配的数组中，再向前填充空值，
+    是否交易直接由映射结果得到，结果和 pd.merge 合并的方式完全一致。
+
+    参数:
+    df (DataFrame): 股票数据
+    index_data (DataFrame): 指数数据，按照交易日期排序
+    extra_fill_0_list (list, optional): 合并时需要填充为0的字段，默认为空列表
+
+    返回:
+    DataFrame: 合并后的股票数据，包含补全的日期
+    """
+    index_cols = [col for col in index_data.columns if col != '交易日期']
+    # 股票数据有重复日期，或者和指数数据有同名的列时，使用pd.merge合并
+    if df['交易日期'].duplicated().any() or df.columns.isin(index_cols).any():
+        return merge_with_index_data_by_merge(df, index_data, fill_0_list)
+
+    # 股票数据的每一行对应的指数数据行号，不在指数数据中的行不参与合并
+    index_dates = index_data['交易日期'].to_numpy()
+    stock_dates = df['交易日期'].to_numpy()
+    positions = np.searchsorted(index_dates, stock_dates)
+    is_matched = positions < len(index_dates)
+    is_matched[is_matched] = index_dates[positions[is_matched]] == stock_dates[is_matched]
+    source_rows = np.full(len(index_dates), -1, dtype=np.int64)
+    source_rows[positions[is_matched]] = np.flatnonzero(is_matched)
+    is_trading = source_rows >= 0
+
+    # 浮点数列按照行号整体分散到预先分配的二维数组中，没有数据的日期为空值
+    float_cols = [col for col, dtype in df.dtypes.items() if dtype == np.float64]
+    float_values = np.full((len(index_dates), len(float_cols)), np.nan, order='F')
+    float_values[positions[is_matched]] = df[float_cols].to_numpy()[is_matched]
+    data = {col: float_values[:, i] for i, col in enumerate(float_cols)}
+
+    # 其他类型的列：不需要特殊补全并且没有空值时，分散和向前填充可以一次完成
+    fill_0_cols = set(['成交量', '成交额', '涨跌幅'] + list(fill_0_list))
+    special_cols = {'收盘价', '开盘价', '最高价', '最低价', '均价', '前收盘价', '收盘价_复权', '开盘价_复权', '最高价_复权',
+                    '最低价_复权', *fill_0_cols}
+    fill_positions = ffill_positions(is_trading)
+    fill_rows = np.where(fill_positions >= 0, source_rows[fill_positions], -1)  # 向前填充之后每一天使用的数据行号
+    other_cols = []  # 需要单独向前填充的列
+    for col in df.columns:
+        if col == '交易日期':
+            data[col] = index_dates
+        elif col not in data:
+            values = df[col].values
+            if col in special_cols or pd.isna(values).any():
+                data[col] = pd.api.extensions.take(values, source_rows, allow_fill=True)
+                other_cols.append(col)
+                continue
+            filled = pd.api.extensions.take(values, fill_rows, allow_fill=True)
+            # 和合并的结果一致：有不交易的日期时，整数列转换为浮点数，布尔列转换为object
+            if not is_trading.all() and isinstance(filled, np.ndarray) and filled.dtype.kind in 'iub':
+                filled = filled.astype(object if filled.dtype.kind == 'b' else np.float64)
+            data[col] = filled
+
+    # 对开、高、收、低、前收盘价价格进行补全处理
+    # 用前一天的收盘价，补全收盘价的空值
+    close = data['收盘价']
+    ffill_float(close)
+    # 用收盘价补全开盘价、最高价、最低价的空值
+    for col in ['开盘价', '最高价', '最低价', '均价']:
+        fillna_float(data[col], close)
+    # 补全前收盘价
+    fillna_float(data['前收盘价'], np.r_[np.nan, close[:-1]])
+
+    # 如果前面算过复权，复权价也做fillna
+    if '收盘价_复权' in data:
+        ffill_float(data['收盘价_复权'])
+        for col in ['开盘价_复权', '最高价_复权', '最低价_复权']:
+            if col in data:
+                fillna_float(data[col], data['收盘价_复权'])
+
+    # 将停盘时间的某些列，数据填补为0
+    for col in fill_0_cols:
+        fillna_float(data[col], np.zeros(len(index_dates)))
+
+    # 用前一天的数据，补全其余空值
+    for i in range(len(float_cols)):
+        ffill_float(float_values[:, i])
+    for col in other_cols:
+        data[col] = ffill_array(data[col])
+    for col in index_cols:
+        data[col] = ffill_array(index_data[col].values)
+
+    # 去除上市之前的数据
+    listed = pd.notna(data['股票代码'])
+    first_row = listed.argmax() if listed.any() else len(listed)
+    df = pd.DataFrame({col: data[col][first_row:] for col in [*df.columns, *index_cols]})
+
+    # 判断计算当天是否交易
+    df['是否交易'] = is_trading[first_row:].astype(np.int8)
+
+    return df
+
+
+def merge_with_index_data_by_merge(df, index_data, fill_0_list=()):
+    """
+    通过pd.merge将股票数据和指数数据合并，股票数据有重复日期等特殊情况时使用。
 
     参数:
     df (DataFrame): 股票数据
@@ -232,41 +390,14 @@ def transfer_to_period_data(df, period, extra_agg_dict=None):
         extra_agg_dict = {}
     df['周期最后交易日'] = df['交易日期']
 
-    # agg_dict 是周期内数据整合所必须的字典。数据整合方法包括:
-    # first(保留周期内第一条数据)、max(保留周期内最大的数据)、min(保留周期内最小的数据)、sum(周期内所有数据求和)、last(保留最新数据)
-    agg_dict = {
-        # 必须列
-        '周期最后交易日': 'last',
-        '股票代码': 'last',
-        '股票名称': 'last',
-        '是否交易': ['last', 'sum', 'count'],  # 统计局和计算是否交易，交易天数，市场交易天数
-        '开盘价': 'first',
-        '最高价': 'max',
-        '最低价': 'min',
-        '收盘价': 'last',
-        '成交额': 'sum',
-        '流通市值': 'last',
-        '总市值': 'last',
-        '上市至今交易天数': 'last',
-        '下日_是否交易': 'last',
-        '下日_开盘涨停': 'last',
-        '下日_是否ST': 'last',
-        # '下日_是否S': 'last',
-        '下日_是否退市': 'last',
-        # '下日_开盘买入涨跌幅': 'last',
-        '复权因子': 'last'
-    }
     # 合并额外的聚合字典
-    agg_dict = {**agg_dict, **extra_agg_dict}
+    agg_dict = {**PERIOD_AGG_DICT, **extra_agg_dict}
 
     # 根据周期offset情况，进行groupby后，得到对应的nD/周线/月线数据
     group_tag = f'{period}起始日'
     period_df = df.groupby(group_tag).agg(agg_dict)
     period_df.columns = [
-        '是否交易' if col == ('是否交易', 'last') else
-        '交易天数' if col == ('是否交易', 'sum') else
-        '市场交易天数' if col == ('是否交易', 'count') else
-        col[0] if isinstance(col, tuple) else col
+        PERIOD_AGG_RENAME.get(col, col[0]) if isinstance(col, tuple) else col
         for col in period_df.columns
     ]  # 重命名列名，聚合之后的数据列名是这样的：... (股票名称, last)  (是否交易, last)  (是否交易, sum)  (是否交易, count)  (开盘价, first)  (最高价, max) ...
 
@@ -300,6 +431,200 @@ def transfer_to_period_data(df, period, extra_agg_dict=None):
     return period_df
 
 
+@nb.njit(cache=True)
+def segment_kahan_sum(values, starts, ends):
+    """
+    按分段对浮点数求和，忽略空值，和pandas分组求和一样使用Kahan补偿求和，保证结果完全一致
+    """
+    out = np.zeros(len(starts), dtype=values.dtype)
+    for k in range(len(starts)):
+        total = out[k]
+        compensation = out[k]
+        for i in range(starts[k], ends[k]):
+            val = values[i]
+            if val == val:
+                y = val - compensation
+                t = total + y
+                compensation = t - total - y
+                if compensation != compensation:  # inf的情况
+                    compensation = out[k]
+                total = t
+        out[k] = total
+    return out
+
+
+def agg_segments(series, func, starts, ends, labels):
+    """
+    按照预先计算好的分段，对一列数据进行聚合，结果和pandas分组聚合完全一致
+
+    参数:
+    series (Series): 需要聚合的数据，同一个分段的数据是连续的
+    func (str or callable): 聚合方式，first/last/max/min/sum/count 直接按分段计算，其他方式使用pandas分组计算
+    starts (ndarray): 每个分段的起始位置
+    ends (ndarray): 每个分段的结束位置（不包含）
+    labels (ndarray): 每行数据所属的分段编号
+
+    返回:
+    Series: 每个分段的聚合结果
+    """
+    kind = series.dtype.kind if isinstance(series.dtype, np.dtype) else 'O'
+    if func in ('first', 'last', 'count'):
+        valid = series.notna().to_numpy()
+        if func == 'count':
+            return pd.Series(np.add.reduceat(valid.astype(np.int64), starts))
+        # 分段内第一个/最后一个非空值的位置，没有非空值时位置落在数据范围之外
+        if func == 'first':
+            pos = np.minimum.reduceat(np.where(valid, np.arange(len(series)), len(series)), starts)
+        else:
+            pos = np.maximum.reduceat(np.where(valid, np.arange(len(series)), -1), starts)
+        found = (pos >= 0) & (pos < len(series))
+        result = series.take(np.where(found, pos, 0)).reset_index(drop=True)
+        return result if found.all() else result.where(found)
+    elif func in ('max', 'min') and kind in 'biuf':
+        if kind == 'f':  # 浮点数忽略空值
+            ufunc = np.fmax if func == 'max' else np.fmin
+        else:
+            ufunc = np.maximum if func == 'max' else np.minimum
+        return pd.Series(ufunc.reduceat(series.to_numpy(), starts))
+    elif func == 'sum' and kind in 'biuf':
+        values = series.to_numpy()
+        if kind == 'f':
+            return pd.Series(segment_kahan_sum(values, starts, ends))
+        total = np.add.reduceat(values.astype(np.uint64 if kind == 'u' else np.int64), starts)
+        # 和pandas一致：整数求和的结果没有溢出时，保留原始的整数类型
+        if kind != 'b' and np.array_equal(total.astype(values.dtype), total):
+            total = total.astype(values.dtype)
+        return pd.Series(total)
+    return series.groupby(labels, sort=False).agg(func).reset_index(drop=True)
+
+
+def transfer_to_period_data_market(df_list, period, extra_agg_dict=None, calendar=None):
+    """
+    将全市场的日线数据一次性转换为相应的周期数据，结果和逐个股票调用 transfer_to_period_data 后合并完全一致。
+    按照 (股票, 周期起始日) 预先计算分段边界，每一列只需要聚合一次，避免每个股票单独groupby的开销。
+    nD周期（例如 5D）会同时计算所有偏移 0~n-1，分段边界为 (偏移, 股票, 周期)，结果中新增 周期偏移 列。
+
+    参数:
+    df_list (list): 每个股票的日线数据，需要按照交易日期排序
+    period (str): 需要转换的数据周期，例如 '周频'、'月频'，或者 '5D' 表示每5个交易日一个周期
+    extra_agg_dict (dict, optional): 额外的聚合字典，默认为空字典
+    calendar (TradingCalendar, optional): 交易日历，nD周期需要根据交易日历计算周期
+
+    返回:
+    DataFrame: 所有股票的周期数据
+    """
+    if extra_agg_dict is None:
+        extra_agg_dict = {}
+    agg_dict = {**PERIOD_AGG_DICT, **extra_agg_dict}
+
+    df = pd.concat(df_list, ignore_index=True)
+    stock_ids = np.repeat(np.arange(len(df_list)), [len(item) for item in df_list])
+    rows = None  # nD周期中，每个偏移对应的原始数据行
+    if period.endswith('D'):
+        if calendar is None:
+            raise ValueError(f'{period}周期需要提供交易日历')
+        # 所有偏移的数据按照 (偏移, 股票, 交易日期) 排列，每个偏移的周期编号由交易日历计算
+        offsets = np.arange(int(period[:-1]))
+        ordinals = calendar.get_ordinals(df['交易日期'])
+        rows = np.tile(np.arange(len(df)), len(offsets))
+        tags = np.concatenate([calendar.get_period_ids(period, offset)[ordinals] for offset in offsets])
+        group_ids = np.repeat(offsets, len(df)) * len(df_list) + np.tile(stock_ids, len(offsets))
+        same_group = group_ids[1:] == group_ids[:-1]
+    else:
+        group_tag = f'{period}起始日'
+        # 和groupby一样，周期起始日为空的数据不参与聚合
+        has_tag = df[group_tag].notna().to_numpy()
+        if not has_tag.all():
+            df = df[has_tag].reset_index(drop=True)
+            stock_ids = stock_ids[has_tag]
+        tags = df[group_tag].to_numpy()
+        same_group = stock_ids[1:] == stock_ids[:-1]
+        if (same_group & (tags[1:] < tags[:-1])).any():
+            # 周期起始日不是递增的，同一个周期的数据不连续，使用逐个股票转换
+            return pd.concat([transfer_to_period_data(item, period, extra_agg_dict) for item in df_list],
+                             ignore_index=True)
+
+    # 计算分段边界：股票（以及偏移）或者周期变化的位置
+    is_start = np.r_[True, ~same_group | (tags[1:] != tags[:-1])]
+    starts = np.flatnonzero(is_start)
+    ends = np.r_[starts[1:], len(is_start)]
+    labels = np.cumsum(is_start) - 1
+
+    col_names, period_series_list = [], []
+    for col, funcs in agg_dict.items():
+        series = df['交易日期' if col == '周期最后交易日' else col]
+        if rows is not None:
+            series = series.take(rows).reset_index(drop=True)
+        for func in (funcs if isinstance(funcs, list) else [funcs]):
+            # 重命名列名，和 transfer_to_period_data 一致
+            col_names.append(PERIOD_AGG_RENAME.get((col, func), col) if isinstance(funcs, list) else col)
+            period_series_list.append(agg_segments(series, func, starts, ends, labels))
+    period_df = pd.concat(period_series_list, axis=1, ignore_index=True)
+    period_df.columns = col_names
+    if rows is not None:
+        period_df.insert(1, '周期偏移', np.repeat(offsets, len(df))[starts])
+
+    # 国庆节、春节等假期可能导致A股整周不交易，从而出现空的周期，需要删除这些空的周期
+    period_df.dropna(subset=['股票代码'], inplace=True)
+    period_df.rename(columns={'周期最后交易日': '交易日期'}, inplace=True)
+
+    # 只保留交易日的数据
+    period_df = period_df[period_df['是否交易'] == 1]
+
+    return period_df.reset_index(drop=True)
+
+
+# 创业板涨跌幅新规：2020年8月24日开始，创业板的涨跌幅限制为20%
+CHINEXT_REFORM_DATE = pd.to_datetime('2020-08-23')
+
+
+@nb.njit
+def round_cents(price, half_up):
+    """
+    将价格精确地舍入到分，结果与 Decimal(x).quantize(Decimal('0.01'), rounding) 完全一致。
+    浮点数可以精确表示为 尾数 * 2^指数，其中尾数是53位整数，因此 价格*100 可以用整数精确表示，
+    舍入也可以在整数上通过移位完成，不会有浮点误差。
+    half_up 为True时四舍五入（ROUND_HALF_UP），否则向零截断（ROUND_DOWN），空值保持为空值
+    """
+    if not np.isfinite(price):
+        return np.nan
+    # |价格| = mantissa * 2^(-shift)，mantissa为53位整数
+    fraction, exponent = math.frexp(abs(price))
+    mantissa = np.int64(fraction * 2.0 ** 53)
+    # 价格小于0.001时，无论如何舍入都是0分，限制移位数防止整数溢出
+    shift = min(max(53 - exponent, 0), 62)
+    cents = mantissa * 100  # 小于2^60，不会溢出
+    if half_up:
+        cents = cents + ((np.int64(1) << shift) >> 1)
+    cents = cents >> shift
+    return np.sign(price) * cents / 100
+
+
+@nb.njit
+def zdt_price_kernel(pre_close, board, is_st, after_reform):
+    """
+    按照板块、是否ST以及日期，计算每一行的涨停价和跌停价，规则和 cal_zdt_price 的说明一致
+    """
+    n = len(pre_close)
+    up_prices = np.empty(n)
+    down_prices = np.empty(n)
+    for i in range(n):
+        if board[i] == BSE_MAIN:
+            # 北交所的规则是涨跌停价格小于等于30%，不做四舍五入
+            up_prices[i] = round_cents(pre_close[i] * 1.3, False)
+            down_prices[i] = round_cents(pre_close[i] * 0.7, False)
+            continue
+        if board[i] == SSE_STAR or (board[i] == SZSE_CHINEXT and after_reform[i]):
+            up_ratio, down_ratio = 1.2, 0.8
+        elif is_st[i]:
+            up_ratio, down_ratio = 1.05, 0.95
+        else:
+            up_ratio, down_ratio = 1.1, 0.9
+        up_prices[i] = round_cents(pre_close[i] * up_ratio + 1e-7, True)
+        down_prices[i] = round_cents(pre_close[i] * down_ratio + 1e-7, True)
+    return up_prices, down_prices
+
+
 def cal_zdt_price(df):
     """
     计算股票当天的涨跌停价格。在计算涨跌停价格的时候，按照严格的四舍五入。
@@ -320,107 +645,44 @@ def cal_zdt_price(df):
 
         北交所（bj） 30%
 
+    板块代码和是否ST只计算一次，作为int8的 板块、是否ST 列保存在数据中，已经存在时直接使用。
+
     参数:
-    df (DataFrame): 必须得是日线数据。必须包含的字段：前收盘价，开盘价，最高价，最低价
+    df (DataFrame): 必须得是日线数据。必须包含的字段：股票代码，股票名称，交易日期，前收盘价，开盘价，最高价，最低价
 
     返回:
-    DataFrame: 包含涨停价、跌停价、一字涨停、一字跌停、开盘涨停、开盘跌停等字段的DataFrame
-    """
-    from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN
-    # 计算普通股票的涨停价和跌停价
-    cond = df['股票名称'].str.contains('ST')
-    df['涨停价'] = df['前收盘价'] * 1.1
-    df['跌停价'] = df['前收盘价'] * 0.9
-    df.loc[cond, '涨停价'] = df['前收盘价'] * 1.05
-    df.loc[cond, '跌停价'] = df['前收盘价'] * 0.95
-
-    # 计算科创板和新规后的创业板的涨停价和跌停价
-    rule_kcb = df['股票代码'].str.contains('sh68')  # 科创板
-    new_rule_cyb = (df['交易日期'] > pd.to_datetime('2020-08-23')) & df['股票代码'].str.contains('sz3')  # 新规后的创业板
-    df.loc[rule_kcb | new_rule_cyb, '涨停价'] = df['前收盘价'] * 1.2
-    df.loc[rule_kcb | new_rule_cyb, '跌停价'] = df['前收盘价'] * 0.8
-
-    # 计算北交所的涨停价和跌停价
-    cond_bj = df['股票代码'].str.contains('bj')
-    df.loc[cond_bj, '涨停价'] = df['前收盘价'] * 1.3
-    df.loc[cond_bj, '跌停价'] = df['前收盘价'] * 0.7
-
-    # 四舍五入
-    def price_round(x):
-        return float(Decimal(x + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP))
-    df.loc[~cond_bj, '涨停价'] = df['涨停价'].apply(price_round)
-    df.loc[~cond_bj, '跌停价'] = df['跌停价'].apply(price_round)
-
-    # 北交所特殊处理：北交所的规则是涨跌停价格小于等于30%，不做四舍五入，所以超过30%的部分需要减去1分钱
-    def price_round_bj(x):
-        return float(Decimal(x).quantize(Decimal('0.00'), rounding=ROUND_DOWN))
-    df.loc[cond_bj, '涨停价'] = df['涨停价'].apply(price_round_bj)
-    df.loc[cond_bj, '跌停价'] = df['跌停价'].apply(price_round_bj)
-
-    # 判断是否一字涨停
-    df['一字涨停'] = False
-    df.loc[df['最低价'] >= df['涨停价'], '一字涨停'] = True
-
-    # 判断是否一字跌停
-    df['一字跌停'] = False
-    df.loc[df['最高价'] <= df['跌停价'], '一字跌停'] = True
-
-    # 判断是否开盘涨停
-    df['开盘涨停'] = False
-    df.loc[df['开盘价'] >= df['涨停价'], '开盘涨停'] = True
-
-    # 判断是否开盘跌停
-    df['开盘跌停'] = False
-    df.loc[df['开盘价'] <= df['跌停价'], '开盘跌停'] = True
+    DataFrame: 包含板块、是否ST、涨停价、跌停价、一字涨停、一字跌停、开盘涨停、开盘跌停等字段的DataFrame
+    """
+    if '板块' not in df.columns:
+        df['板块'] = get_symbol_types(df['股票代码'])
+    if '是否ST' not in df.columns:
+        df['是否ST'] = get_status_flag(cal_name_status(df['股票名称']), '是否ST')
+
+    after_reform = df['交易日期'].to_numpy(dtype='datetime64[ns]') > CHINEXT_REFORM_DATE.to_datetime64()
+    up_prices, down_prices = zdt_price_kernel(
+        df['前收盘价'].to_numpy(dtype=np.float64), df['板块'].to_numpy(dtype=np.int8),
+        df['是否ST'].to_numpy(dtype=np.int8), after_reform)
+    df['涨停价'] = up_prices
+    df['跌停价'] = down_prices
+
+    # 判断是否一字涨停、一字跌停、开盘涨停、开盘跌停
+    df['一字涨停'] = df['最低价'] >= df['涨停价']
+    df['一字跌停'] = df['最高价'] <= df['跌停价']
+    df['开盘涨停'] = df['开盘价'] >= df['涨停价']
+    df['开盘跌停'] = df['开盘价'] <= df['跌停价']
 
     return df
 
 
-def get_trade_date(index_data: pd.DataFrame) -> pd.DataFrame:
-    # ==获取交易日历
-    url = "https://datacenter-web.eastmoney.com/api/data/v1/get"
-    params = {
-        "reportName": "RPTA_WEB_ZGXSRL",
-        "columns": "ALL",
-        "pageSize": 200,
-        "sortColumns": "SDATE",
-        "sortTypes": -1,
-        "callback": f"jQuery1123{random.randint(10000000000000000, 99999999999999999)}_" + str(int(time.time() * 1000)),
-        # 动态生成时间戳
-        "_": int(time.time() * 1000)  # 动态生成时间戳
-    }
-
-    response = requests.get(url, params=params)
-    content = response.text
-
-    # 去除JSONP封装
-    start = content.find('(') + 1
-    end = content.rfind(')')
-    json_data = json.loads(content[start:end])
-
-    # ==处理交易日历
-    holiday_df = pd.DataFrame(json_data['result']['data'])
-    holiday_df = holiday_df[holiday_df['MKT'] == 'A股'].sort_values('SDATE').reset_index(drop=True)
-    holiday_df['SDATE'] = pd.to_datetime(holiday_df['SDATE'])
-    holiday_df['EDATE'] = pd.to_datetime(holiday_df['EDATE'])
-    # 日历从最小的时间点开始
-    start = holiday_df['SDATE'].min()
-    # 截止到最大的时间点的年底
-    end = pd.to_datetime(f"{holiday_df['EDATE'].max().year}-12-31")
-
-    # 创建日历，并标记不交易的日期
-    date_range = pd.DataFrame(pd.date_range(start=start, end=end), columns=['交易日期'])
-    for i in holiday_df.index:
-        con = (date_range['交易日期'] >= holiday_df.loc[i, 'SDATE']) & (
-                date_range['交易日期'] <= holiday_df.loc[i, 'EDATE'])
-        date_range.loc[con, '交易日期'] = np.nan
-
-    # 正常的周末也是不交易的
-    con = date_range['交易日期'].dt.weekday.isin([5, 6])
-    date_range.loc[con, '交易日期'] = np.nan
-    date_range = date_range[date_range['交易日期'].notnull()]
-
-    # ==合并交易日
-    trade_date_df = pd.concat([index_data[['交易日期']], date_range], ignore_index=True)
-    trade_date_df = trade_date_df.drop_duplicates(subset='交易日期', keep='first').reset_index(drop=True)
-    return trade_date_df
+def get_trade_date(index_data: pd.DataFrame, timeout: float = 5) -> pd.DataFrame:
+    """
+    联网获取休市安排，和指数的交易日期合并为交易日历
+
+    参数:
+    index_data (DataFrame): 指数数据，包含交易日期
+    timeout (float): 网络请求的超时时间（秒）
+
+    返回:
+    DataFrame: 交易日历，包含交易日期
+    """
+    return EastmoneyCalendarProvider(timeout).build(index_data['交易日期'])
@@ -1,19 +1,21 @@
 
-from datetime import datetime
 from itertools import product
 from pathlib import Path
 from types import ModuleType
 from typing import Optional, List
 
-import numpy as np
 import pandas as pd
 
 from core.model.strategy_config import StrategyConfig
 from core.utils.factor_hub import FactorHub
 from core.utils.path_kit import get_file_path, get_folder_path
 from core.utils.strategy_hub import get_strategy_by_name
-from core.market_essentials import get_trade_date, import_index_data
+from core.market_essentials import import_index_data
 from core.model.timing_signal import EquityTiming
+from core.trading_calendar import prepare_trading_calendar
+
+# 进程内的指数数据缓存：(指数文件指纹, 开始日期, 结束日期, 交易日历) -> 合并交易日历之后的指数数据
+_index_data_cache = {}
 
 
 class BacktestConfig:
@@ -28,6 +30,15 @@ class BacktestConfig:
         self.initial_cash: float = config_dict.get("initial_cash", 100_0000)  # 初始资金默认100万
         self.c_rate: float = config_dict.get("c_rate", 1.2 / 10000)  # 手续费，默认为0.002，表示万分之二
         self.t_rate: float = config_dict.get("t_rate", 1 / 1000)  # 印花税，默认为0.001
+        self.n_jobs: int = config_dict.get("n_jobs", 1)  # 并行计算的进程数，1表示串行
+        self.incremental_update: bool = config_dict.get("incremental_update", False)  # 是否增量更新数据
+        self.panel_preprocess: bool = config_dict.get("panel_preprocess", False)  # 是否使用全市场面板模式预处理数据
+        self.csv_reader: str = config_dict.get("csv_reader", "pandas")  # 股票日线CSV的读取方式
+        self.dtype_policy: str = config_dict.get("dtype_policy", "default")  # 数据类型策略
+        self.memory_budget_mb: Optional[float] = config_dict.get("memory_budget_mb", None)  # 内存预算（MB）
+        self.use_pipeline_cache: bool = config_dict.get("use_pipeline_cache", False)  # 是否自动跳过不需要重新运行的步骤
+        self.calendar_online_refresh: bool = config_dict.get("calendar_online_refresh", True)  # 是否在后台联网更新节假日数据
+        self.calendar_timeout: float = config_dict.get("calendar_timeout", 5)  # 联网更新节假日数据的超时时间（秒）
 
         # 根据输入，进行一下重要中间变量的处理
         # 股票日线数据
@@ -43,6 +54,7 @@ class BacktestConfig:
 
         self.factor_params_dict: dict = {}  # 缓存因子参数，用于后续的因子聚合
         self.fin_cols: list = []  # 缓存财务因子列
+        self.input_cols: Optional[list] = None  # 缓存因子需要的K线数据列，None表示需要全部列
 
         # 资金曲线再择时配置，会在load_strategy中初始化
         self.equity_timing: Optional[EquityTiming] = None
@@ -65,34 +77,25 @@ class BacktestConfig:
 
         # 针对当前策略的因子信息，整理之后的列名信息，并且缓存到全局
         fin_cols = set()
+        input_cols = set()
         for factor_config in self.strategy.all_factors:
             # 添加到并行计算的缓存中
             if factor_config.name not in self.factor_params_dict:
                 self.factor_params_dict[factor_config.name] = set()
             self.factor_params_dict[factor_config.name].add(factor_config.param)
 
-            new_cols = FactorHub.get_by_name(factor_config.name).fin_cols
-            fin_cols = fin_cols.union(set(new_cols))
+            factor = FactorHub.get_by_name(factor_config.name)
+            fin_cols = fin_cols.union(set(factor.fin_cols))
+            # 只要有一个因子没有声明需要的K线数据列，就需要读取全部列
+            if input_cols is not None:
+                input_cols = None if factor.input_cols is None else input_cols.union(set(factor.input_cols))
 
         self.fin_cols = list(fin_cols)
+        self.input_cols = sorted(input_cols) if input_cols is not None else None
 
         if equity_timing is not None:
             self.equity_timing = EquityTiming.init(**equity_timing)
 
-    def update_trading_date(self, tc_path):
-        print("⚠️ 交易日历文件不存在，或者需要更新，从网络获取最新的交易日历数据。")
-        index_data_all = import_index_data(self.index_data_path / "sh000001.csv")
-        # 如果需要更新，从网络获取最新的交易日历数据
-        try:
-            tc_df = get_trade_date(index_data_all)
-            tc_df.to_csv(tc_path, index=False)
-            print(f'🔄 交易日历更新为：{tc_df["交易日期"].min()}~{tc_df["交易日期"].max()}')
-            return tc_df
-        except Exception as e:
-            print(e)
-            print("需要更新交易日历，但无法联网")
-            return None
-
     def read_index_with_trading_date(self):
         """
         加载交易日历数据，并与指数数据合并
@@ -104,53 +107,25 @@ class BacktestConfig:
         返回:
         index_data (DataFrame): 合并后的指数数据
         """
-        # 获取今天的日期
-        today = datetime.today()
-        index_data = import_index_data(self.index_data_path / "sh000001.csv", [self.start_date, self.end_date])
+        index_path = self.index_data_path / "sh000001.csv"
 
         # 构建交易日历文件路径
         tc_path = get_file_path("data", "交易日历.csv")
 
-        if tc_path.exists():
-            tc_df = pd.read_csv(tc_path)
-            if pd.to_datetime(tc_df["交易日期"].max()) - today <= pd.to_timedelta("30 days"):
-                new_tc_df = self.update_trading_date(tc_path)
-                if new_tc_df is not None:
-                    tc_df = new_tc_df
-        else:
-            tc_df = self.update_trading_date(tc_path)
-
-        # 检查文件是否存在，或者是否需要更新
-        if tc_df is None:
-            print("本地不存在交易日历，需要联网更新后继续，程序退出")
-            exit()
-
-        print(f'🌀 本地交易日历数据为：{tc_df["交易日期"].min()}~{tc_df["交易日期"].max()}')
-
-        # 将交易日期列转换为datetime类型
-        tc_df["交易日期"] = pd.to_datetime(tc_df["交易日期"])
-
-        # 计算下个交易日
-        tc_df["次交易日"] = tc_df["交易日期"].shift(-1)
-
-        # 标记周频起始日
-        con1 = tc_df["交易日期"].diff().dt.days != 1
-        tc_df.loc[con1, "周频起始日"] = tc_df["交易日期"]
-
-        # 处理只有一个交易日的周期
-        con2 = tc_df["交易日期"].diff(-1).dt.days != -1
-        tc_df.loc[con1 & con2, "周频起始日"] = np.nan
-        tc_df["周频起始日"] = tc_df["周频起始日"].ffill()
-        tc_df["周频终止日"] = tc_df["周频起始日"] != tc_df["周频起始日"].shift(-1)
+        # 只用本地的指数数据和节假日表离线生成交易日历，临近过期时在后台联网更新节假日表，不会等待网络
+        calendar = prepare_trading_calendar(
+            tc_path, index_path, online_refresh=self.calendar_online_refresh, timeout=self.calendar_timeout)
 
-        # 标记月频起始日
-        con3 = tc_df["交易日期"].dt.month != tc_df["交易日期"].shift().dt.month
-        tc_df.loc[con3, "月频起始日"] = tc_df["交易日期"]
-        tc_df["月频起始日"] = tc_df["月频起始日"].ffill()
-        tc_df["月频终止日"] = tc_df["月频起始日"] != tc_df["月频起始日"].shift(-1)
+        print(f'🌀 本地交易日历数据为：{calendar.first_date:%Y-%m-%d}~{calendar.last_date:%Y-%m-%d}')
 
-        # 将交易日历数据与指数数据合并
-        index_data = pd.merge(left=index_data, right=tc_df, on="交易日期", how="left")
+        # 指数数据和交易日历都没有变化时，复用进程内已经合并好的数据
+        stat = index_path.stat()
+        cache_key = (str(index_path), stat.st_mtime_ns, stat.st_size, self.start_date, self.end_date, id(calendar))
+        if cache_key not in _index_data_cache:
+            index_data = import_index_data(index_path, [self.start_date, self.end_date])
+            # 将交易日历数据与指数数据合并
+            _index_data_cache[cache_key] = pd.merge(left=index_data, right=calendar.to_frame(), on="交易日期", how="left")
+        index_data = _index_data_cache[cache_key].copy()
 
         return index_data
 
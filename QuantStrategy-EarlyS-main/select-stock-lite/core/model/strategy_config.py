@@ -8,6 +8,7 @@ import numpy as np
 import pandas as pd
 
 from config import days_listed
+from core.name_status import get_status_flag, lookup_name_status
 
 
 def filter_series_by_range(series, range_str):
@@ -232,6 +233,13 @@ class StrategyConfig:
             case _:
                 return self.hold_period
 
+    @cached_property
+    def period_offsets(self) -> List[int]:
+        # 持仓周期的所有偏移。nD周期（例如5D）有n个偏移，每个偏移在不同的交易日换仓；周频、月频只有一个偏移
+        if self.period_type == 'D':
+            return list(range(int(self.hold_period[:-1])))
+        return [0]
+
     @cached_property
     def factor_columns(self) -> List[str]:
         factor_columns = set()  # 去重
@@ -278,19 +286,22 @@ class StrategyConfig:
                 max_int = max(max_int, factor_config.param)
         return max_int
 
-    def filter_before_select(self, period_df):
+    def filter_before_select(self, period_df, name_history):
+        # name_history 为股票名称变化区间表，由选股流程读取后传入，这里只做查找
         if 'filter_stock' in self.funcs:
             return self.funcs['filter_stock'](period_df)
 
         # 通用的filter筛选
         # =删除不能交易的周期数
+        # 通过股票名称变化区间表查找周期末的名称状态，不需要匹配字符串
+        name_status = lookup_name_status(name_history, period_df['股票代码'], period_df['交易日期'])
         # 删除月末为st状态的周期数
-        cond1 = ~period_df['股票名称'].str.contains('ST', regex=False)
+        cond1 = get_status_flag(name_status, '是否ST') == 0
         # 删除月末为s状态的周期数
-        cond2 = ~period_df['股票名称'].str.contains('S', regex=False)
+        cond2 = get_status_flag(name_status, '是否S') == 0
         # 删除月末有退市风险的周期数
-        cond3 = ~period_df['股票名称'].str.contains('*', regex=False)
-        cond4 = ~period_df['股票名称'].str.contains('退', regex=False)
+        cond3 = get_status_flag(name_status, '是否退市风险') == 0
+        cond4 = get_status_flag(name_status, '是否退市') == 0
         # 删除交易天数过少的周期数
         cond5 = period_df['交易天数'] / period_df['市场交易天数'] >= 0.8
 
@@ -1,5 +1,7 @@
 
 import numba as nb
+import numpy as np
+import pandas as pd
 from numba.experimental import jitclass
 
 # 北交所(理应拉黑) bjxxxxxx
@@ -65,9 +67,20 @@ def get_symbol_type(symbol: str) -> int:
             return SSE_MAIN  # 上交所主板
 
     if symbol.startswith('sz'):
-        if symbol.startswith('sz0'):
-            return SZSE_MAIN  # 深交所主板
-        else:
+        if symbol.startswith('sz3'):
             return SZSE_CHINEXT  # 深交所创业板
+        else:
+            return SZSE_MAIN  # 深交所主板
 
     raise ValueError(f'Unknown stock {symbol}')
+
+
+def get_symbol_types(symbols) -> np.ndarray:
+    """
+    批量获取股票的板块代码。股票代码的种类远少于行数，只对去重后的代码判断，再映射回每一行
+    :param symbols: 股票代码，可以包含重复
+    :return: int8的板块代码数组
+    """
+    codes, uniques = pd.factorize(symbols)
+    types = np.array([get_symbol_type(symbol) for symbol in uniques], dtype=np.int8)
+    return types[codes]
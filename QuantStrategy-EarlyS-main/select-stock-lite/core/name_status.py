@@ -0,0 +1,95 @@
+"""
+股票名称状态
+
+股票名称中的 ST、S、*、退 表示股票的特殊状态。股票名称变化很少，按股票整理成名称变化区间表：
+每个区间记录 股票代码、开始日期、结束日期 以及状态位，任意K线或者周期的状态都通过区间查找获得，不需要逐行匹配字符串。
+"""
+import numpy as np
+import pandas as pd
+
+# 状态列 -> 股票名称中的关键字，状态位按照顺序依次为 1、2、4、8
+NAME_STATUS_FLAGS = {'是否ST': 'ST', '是否S': 'S', '是否退市风险': '*', '是否退市': '退'}
+
+# 状态列 -> 状态位
+NAME_STATUS_BITS = {col: np.int8(1 << idx) for idx, col in enumerate(NAME_STATUS_FLAGS)}
+
+# 名称变化区间表的列
+NAME_HISTORY_COLS = ['股票代码', '开始日期', '结束日期', '状态']
+
+
+def cal_name_status(names) -> np.ndarray:
+    """
+    计算每个股票名称的状态位。名称的种类很少，只对去重后的名称匹配关键字，再映射回每一行
+    :param names: 股票名称，可以包含重复
+    :return: int8的状态位数组，空的名称为0
+    """
+    codes, uniques = pd.factorize(names)
+    status = np.zeros(len(uniques) + 1, dtype=np.int8)  # 最后一个位置对应空的名称
+    for idx, name in enumerate(uniques):
+        for col, keyword in NAME_STATUS_FLAGS.items():
+            if keyword in name:
+                status[idx] |= NAME_STATUS_BITS[col]
+    return status[codes]
+
+
+def get_status_flag(status, col) -> np.ndarray:
+    """
+    从状态位中取出某个状态
+    :param status: 状态位数组
+    :param col: 状态列，参考 NAME_STATUS_FLAGS
+    :return: int8的标记数组
+    """
+    return ((np.asarray(status) & NAME_STATUS_BITS[col]) != 0).astype(np.int8)
+
+
+def build_name_history(symbols, dates, names) -> pd.DataFrame:
+    """
+    根据每日的股票名称构建名称变化区间表，股票代码或者名称变化时开始一个新的区间
+    :param symbols: 股票代码
+    :param dates: 交易日期
+    :param names: 股票名称，和股票代码、交易日期一一对应，需要按照 股票代码、交易日期 排序
+    :return: 名称变化区间表，结束日期为区间内最后一根K线的日期
+    """
+    symbol_codes = pd.factorize(symbols)[0]
+    name_codes = pd.factorize(names)[0]
+    dates = pd.DatetimeIndex(dates).values
+    if len(dates) == 0:
+        return pd.DataFrame({col: [] for col in NAME_HISTORY_COLS})
+
+    is_start = np.r_[True, (symbol_codes[1:] != symbol_codes[:-1]) | (name_codes[1:] != name_codes[:-1])]
+    starts = np.flatnonzero(is_start)
+    ends = np.r_[starts[1:], len(dates)] - 1
+    return pd.DataFrame({
+        '股票代码': pd.Categorical(np.asarray(symbols)[starts]),
+        '开始日期': dates[starts],
+        '结束日期': dates[ends],
+        '状态': cal_name_status(np.asarray(names)[starts]),
+    })
+
+
+def lookup_name_status(name_history: pd.DataFrame, symbols, dates) -> np.ndarray:
+    """
+    通过区间查找获取股票在指定日期的状态位。日期在两个区间之间时沿用之前的区间，早于第一个区间或者没有记录的股票为0
+    :param name_history: 名称变化区间表
+    :param symbols: 股票代码
+    :param dates: 日期，和股票代码一一对应
+    :return: int8的状态位数组
+    """
+    history_symbols = pd.Index(name_history['股票代码'].astype(str).unique())
+    history_codes = history_symbols.get_indexer(name_history['股票代码'].astype(str))
+    query_codes = history_symbols.get_indexer(pd.Index(np.asarray(symbols, dtype=object)).astype(str))
+
+    # 股票编号和日期组合成一个整数，一次二分查找同时定位股票和区间，日期精确到天
+    history_keys = (history_codes.astype(np.int64) << 32) + pd.DatetimeIndex(name_history['开始日期']).values.astype(
+        'datetime64[D]').astype(np.int64)
+    query_keys = (query_codes.astype(np.int64) << 32) + pd.DatetimeIndex(dates).values.astype(
+        'datetime64[D]').astype(np.int64)
+    order = np.argsort(history_keys, kind='stable')
+    history_keys = history_keys[order]
+
+    pos = np.searchsorted(history_keys, query_keys, side='right') - 1
+    matched = (query_codes >= 0) & (pos >= 0)
+    pos = np.maximum(pos, 0)
+    matched &= history_codes[order][pos] == query_codes
+    status = name_history['状态'].to_numpy(dtype=np.int8)[order][pos]
+    return np.where(matched, status, 0).astype(np.int8)
@@ -0,0 +1,288 @@
+"""
+全市场面板预处理
+
+逐只股票的 pre_process 会对每只股票重复一遍 与指数合并、补全停牌、计算下日状态 的流程。
+面板模式把全部股票的原始K线拼接在一起，只与K线本身相关的指标（涨跌幅、换手率、复权因子、涨跌停等）一次性向量化计算，
+然后构建一个 交易日 x 股票 的行号矩阵，补全停牌、是否交易、下日状态以及退市清理都通过二维数组完成。
+每只股票的预处理结果在需要的时候才生成，结果与逐只股票的 pre_process 完全一致。
+"""
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from core.market_essentials import cal_zdt_price
+from core.name_status import cal_name_status, get_status_flag
+
+# 停牌日需要填充为0的列，和 merge_with_index_data 保持一致
+FILL_0_COLS = ['成交量', '成交额', '涨跌幅', '换手率']
+
+# 停牌日用收盘价填充的列
+FILL_CLOSE_COLS = ['开盘价', '最高价', '最低价', '均价']
+
+# 下日状态列
+NEXT_DAY_COLS = ['下日_是否交易', '下日_一字涨停', '下日_开盘涨停', '下日_是否ST', '下日_是否S', '下日_是否退市']
+
+
+def ffill_axis0(values):
+    """
+    沿着第0维向前填充空值，支持一维和二维数组
+
+    参数:
+    values (np.ndarray): 浮点数组
+
+    返回:
+    np.ndarray: 填充后的数组
+    """
+    row_index = np.arange(len(values)).reshape(-1, *([1] * (values.ndim - 1)))
+    row_index = np.where(np.isnan(values), 0, row_index)
+    np.maximum.accumulate(row_index, axis=0, out=row_index)
+    return np.take_along_axis(values, row_index, axis=0)
+
+
+def shift_axis0(values, periods=1):
+    """
+    沿着第0维平移数组，空出来的位置填充为NaN，和 pd.Series.shift 一致
+
+    参数:
+    values (np.ndarray): 浮点数组
+    periods (int): 平移的行数，正数向下，负数向上
+
+    返回:
+    np.ndarray: 平移后的数组
+    """
+    result = np.full(values.shape, np.nan)
+    if periods > 0:
+        result[periods:] = values[:-periods]
+    elif periods < 0:
+        result[:periods] = values[-periods:]
+    else:
+        result[:] = values
+    return result
+
+
+def cal_candle_indicators_long(raw_df, lengths):
+    """
+    对多只股票拼接在一起的原始K线，一次性计算涨跌幅、换手率、上市至今交易天数、均价、复权因子以及涨跌停价格。
+    计算方式和逐只股票计算完全一致。
+
+    参数:
+    raw_df (DataFrame): 按股票依次拼接的原始K线，每只股票内部按交易日期排序
+    lengths (np.ndarray): 每只股票的K线数量
+
+    返回:
+    DataFrame: 增加指标后的数据
+    """
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    stock_id = np.repeat(np.arange(len(lengths)), lengths)
+
+    # 计算涨跌幅、换手率等关键指标
+    pct_change = raw_df['收盘价'] / raw_df['前收盘价'] - 1
+    turnover_rate = raw_df['成交额'] / raw_df['流通市值']
+    trading_days = np.arange(len(raw_df)) - np.repeat(starts, lengths) + 1
+    avg_price = raw_df['成交额'] / raw_df['成交量']
+    # 复权因子，和 cal_candle_indicators 保持一致，复权价格需要时再按需计算
+    fq_factor = (raw_df['收盘价'] / raw_df['前收盘价']).groupby(stock_id).cumprod()
+
+    df = raw_df.assign(
+        涨跌幅=pct_change,
+        换手率=turnover_rate,
+        上市至今交易天数=trading_days,
+        均价=avg_price,
+        复权因子=fq_factor,
+    )
+
+    # 涨跌停价格只和当天数据有关，可以直接在拼接后的数据上计算
+    return cal_zdt_price(df)
+
+
+class MarketPanel(Mapping):
+    """
+    全市场面板数据，按股票代码读取时才生成该股票的预处理结果，可以直接当作 股票代码 -> DataFrame 的字典使用
+    """
+
+    def __init__(self, raw_data_dict, index_data):
+        """
+        构建全市场面板
+
+        参数:
+        raw_data_dict (dict): 股票代码 -> 原始K线数据，每只股票内部按交易日期排序
+        index_data (DataFrame): 指数数据
+        """
+        codes = [code for code, df in raw_data_dict.items() if not df.empty]
+        lengths = np.array([len(raw_data_dict[code]) for code in codes], dtype=np.int64)
+        raw_df = pd.concat([raw_data_dict[code] for code in codes], ignore_index=True)
+        raw_df = cal_candle_indicators_long(raw_df, lengths)
+        stock_id = np.repeat(np.arange(len(codes)), lengths)
+
+        # 只保留交易日历内的K线，相当于和指数数据合并
+        dates = pd.DatetimeIndex(index_data['交易日期'])
+        date_id = dates.get_indexer(raw_df['交易日期'])
+        in_calendar = date_id >= 0
+        self.raw_df = raw_df[in_calendar].reset_index(drop=True)
+        stock_id, date_id = stock_id[in_calendar], date_id[in_calendar]
+
+        # 每只股票内部向前填充，停牌日的数据都来自最近一根K线
+        self.ffill_df = self.raw_df.groupby(stock_id, sort=False).ffill()
+        # 股票名称的种类很少，cal_name_status 只对去重后的名称计算状态，再映射回每一行
+        name_status = cal_name_status(self.ffill_df['股票名称'])
+        self.name_flags = {flag: get_status_flag(name_status, flag) for flag in ['是否ST', '是否S', '是否退市']}
+
+        # 行号矩阵：每个交易日、每只股票对应的最近一根K线的行号，上市之前为-1
+        n_dates = len(dates)
+        row_id = np.full((n_dates, len(codes)), -1, dtype=np.int64)
+        row_id[date_id, stock_id] = np.arange(len(self.raw_df))
+        self.is_trading = row_id >= 0  # 当天是否交易
+        np.maximum.accumulate(row_id, axis=0, out=row_id)
+        self.row_id = row_id
+
+        # 指数数据和股票数据合并后也会被向前填充
+        self.index_data = index_data.ffill().reset_index(drop=True)
+        self.dates = dates
+
+        # 股票有效区间的开始位置：第一根在交易日历内的K线
+        listed = row_id >= 0
+        has_data = listed.any(axis=0)
+        self.begin = np.argmax(listed, axis=0)
+
+        # 股票有效区间的结束位置：处理退市的股票
+        self.end = self._cal_delist_end(codes, has_data)
+        valid = has_data & (self.end >= 0)
+        self.codes = [code for code, is_valid in zip(codes, valid) if is_valid]
+        self.code_index = {code: idx for idx, code in enumerate(codes) if valid[idx]}
+
+        # 合并后出现过空值的股票，整数列会变为浮点数，布尔列会变为object，和逐只股票处理保持一致
+        self.has_missing = ~self.is_trading.all(axis=0)
+
+    def _take(self, df, col, rows):
+        """
+        按行号读取数据，行号为-1的位置为空值
+        """
+        values = df[col].to_numpy()[rows]
+        if values.dtype.kind == 'f':
+            values[rows < 0] = np.nan
+        return values
+
+    def _cal_delist_end(self, codes, has_data):
+        """
+        计算每只股票有效区间的结束位置，和 trim_delisted 保持一致，没有有效数据的股票返回-1
+        """
+        n_dates = len(self.dates)
+        end = np.full(len(codes), n_dates - 1, dtype=np.int64)
+        listed = self.row_id >= 0
+
+        # 成交额：停牌日为0
+        amount = np.where(self.is_trading, np.nan_to_num(self._take(self.raw_df, '成交额', self.row_id), nan=0.0), 0.0)
+        last_names = self.ffill_df['股票名称'].to_numpy()[self.row_id[-1]]
+        is_delisted = has_data & np.array(['退' in name or 'S' in name for name in last_names], dtype=bool)
+
+        # 所有交易日成交额都为0的退市股票，没有有效数据
+        has_amount = ((amount != 0) & listed).any(axis=0)
+        end[is_delisted & ~has_amount] = -1
+
+        # 最后一个 当天有成交额、下一个交易日没有成交额 的位置
+        cond = (amount != 0) & (shift_axis0(amount, -1) == 0) & listed
+        has_cond = cond.any(axis=0)
+        last_cond = n_dates - 1 - np.argmax(cond[::-1], axis=0)
+        trim = is_delisted & has_amount & has_cond
+        end[trim] = last_cond[trim]
+        end[~has_data] = -1
+        return end
+
+    def _fill_price(self, col, rows, is_trading, fill_values):
+        """
+        停牌日和空值用指定的价格填充，然后向前填充
+        """
+        values = np.where(is_trading, self._take(self.raw_df, col, rows), np.nan)
+        values = np.where(np.isnan(values), fill_values, values)
+        return ffill_axis0(values)
+
+    def _cal_panel_data(self, rows, is_trading):
+        """
+        根据行号矩阵计算补全停牌日之后的数据，和 merge_with_index_data 保持一致。
+        rows 和 is_trading 可以是一维（单只股票）或者二维（全市场）
+        """
+        close = self._take(self.ffill_df, '收盘价', rows)
+        data = {
+            '收盘价': close,
+            '前收盘价': self._fill_price('前收盘价', rows, is_trading, shift_axis0(close, 1)),
+        }
+        for col in FILL_CLOSE_COLS:
+            data[col] = self._fill_price(col, rows, is_trading, close)
+        for col in FILL_0_COLS:
+            data[col] = np.where(is_trading, np.nan_to_num(self._take(self.raw_df, col, rows), nan=0.0), 0.0)
+        return data
+
+    def __getitem__(self, code):
+        """
+        生成单只股票的预处理数据，和 pre_process 的结果一致
+        """
+        idx = self.code_index[code]
+        begin, end = self.begin[idx], self.end[idx]
+        # 下日状态需要用到有效区间之后的数据，先计算到最后一个交易日，最后再截取
+        rows = self.row_id[begin:, idx]
+        is_trading = self.is_trading[begin:, idx]
+
+        data = self._cal_panel_data(rows, is_trading)
+        df = pd.DataFrame({col: data[col] if col in data else self._take(self.ffill_df, col, rows)
+                           for col in self.raw_df.columns})
+        df['交易日期'] = self.dates[begin:]
+        if self.has_missing[idx]:
+            df = df.astype({col: 'float64' if dtype.kind in 'iu' else 'object'
+                            for col, dtype in self.raw_df.dtypes.items() if dtype.kind in 'iub'})
+        else:
+            df = df.astype({col: dtype for col, dtype in self.raw_df.dtypes.items() if df[col].dtype != dtype})
+
+        # 合并指数数据
+        index_df = self.index_data.iloc[begin:].drop(columns=['交易日期']).reset_index(drop=True)
+        df = pd.concat([df, index_df], axis=1)
+        df['是否交易'] = is_trading.astype(np.int8)
+
+        # 计算下日状态，最后一根K线默认沿用前一日的数据
+        next_day_data = {
+            '下日_是否交易': df['是否交易'].astype('int8').shift(-1),
+            '下日_一字涨停': df['一字涨停'].astype('int8').shift(-1),
+            '下日_开盘涨停': df['开盘涨停'].astype('int8').shift(-1),
+        }
+        for flag, flag_values in self.name_flags.items():
+            next_day_data[f'下日_{flag}'] = pd.Series(flag_values[rows]).shift(-1)
+        df = df.assign(**{col: next_day_data[col] for col in NEXT_DAY_COLS})
+        state_cols = ['下日_是否交易', '下日_是否ST', '下日_是否S', '下日_是否退市']
+        df[state_cols] = df[state_cols].ffill()
+
+        return df.iloc[:end - begin + 1]
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def make_market_pivot(self):
+        """
+        直接从面板生成开盘价、收盘价、前收盘价的透视表，和逐只股票生成的透视表一致
+
+        返回:
+        dict: 字段 -> 透视表（index为交易日期，columns为股票代码）
+        """
+        close = self._take(self.ffill_df, '收盘价', self.row_id)
+        data = {
+            '开盘价': self._fill_price('开盘价', self.row_id, self.is_trading, close),
+            '收盘价': close,
+            '前收盘价': self._fill_price('前收盘价', self.row_id, self.is_trading, shift_axis0(close, 1)),
+        }
+        col_index = np.array([self.code_index[code] for code in self.codes], dtype=np.int64)
+
+        # 有效区间之外的数据为空
+        date_index = np.arange(len(self.dates)).reshape(-1, 1)
+        valid = (date_index >= self.begin[col_index]) & (date_index <= self.end[col_index])
+        has_data = valid.any(axis=1)
+
+        order = np.argsort(self.codes, kind='stable')
+        columns = pd.Index(np.array(self.codes, dtype=object)[order], name='股票代码')
+        index = pd.Index(self.dates[has_data], name='交易日期')
+        pivot_dict = {}
+        for key, col in (('open', '开盘价'), ('close', '收盘价'), ('preclose', '前收盘价')):
+            values = np.where(valid, data[col][:, col_index], np.nan)
+            pivot_dict[key] = pd.DataFrame(values[has_data][:, order], index=index, columns=columns)
+        return pivot_dict
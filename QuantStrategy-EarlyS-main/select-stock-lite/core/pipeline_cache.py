@@ -0,0 +1,223 @@
+
+import ast
+import hashlib
+import importlib.util
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+from core.data_store import SYMBOL_LIST_FILE, get_candle_store_folder, get_market_panel_folder
+from core.model.backtest_config import BacktestConfig
+from core.model.strategy_config import days_listed
+from core.utils.path_kit import PROJECT_ROOT, get_file_path
+
+# 流水线缓存文件，记录每个步骤上次运行时的输入指纹
+PIPELINE_CACHE_FILE = '流水线缓存.pkl'
+
+# 每个步骤的入口源代码，步骤依赖的源代码是入口导入的全部项目模块，任何一个变化时都需要重新运行
+STEP1_ENTRY = 'program/step1_整理数据.py'
+STEP2_ENTRY = 'program/step2_计算因子.py'
+STEP3_ENTRY = 'program/step3_选股.py'
+
+# 不计入源代码指纹的模块：配置文件中和步骤相关的配置已经单独计入指纹，修改其他配置不需要重新运行
+IGNORED_MODULES = {'config'}
+
+
+# region 指纹计算
+def hash_parts(*parts) -> str:
+    """
+    计算多个输入的指纹
+    :param parts: 可以用repr稳定表示的对象
+    :return: 指纹字符串
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(repr(part).encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def get_files_fingerprint(paths: Iterable[Path | str], pattern='*.csv') -> str:
+    """
+    根据文件名、修改时间和大小计算数据文件的指纹，不需要读取文件内容
+    :param paths: 文件或者文件夹，文件夹会遍历其中匹配pattern的文件
+    :param pattern: 文件夹中需要匹配的文件
+    :return: 指纹字符串
+    """
+    file_info = []
+    for path in map(Path, paths):
+        file_list = sorted(path.glob(pattern)) if path.is_dir() else [path]
+        for file_path in file_list:
+            if file_path.exists():
+                stat = file_path.stat()
+                file_info.append((str(file_path), stat.st_mtime_ns, stat.st_size))
+            else:
+                file_info.append((str(file_path), None))
+    return hash_parts(file_info)
+
+
+def get_source_fingerprint(paths: Iterable[Path | str]) -> str:
+    """
+    根据源代码内容计算指纹
+    :param paths: 源代码路径，相对路径基于项目根目录
+    :return: 指纹字符串
+    """
+    sources = []
+    for path in paths:
+        path = Path(PROJECT_ROOT) / path
+        sources.append((str(path.relative_to(PROJECT_ROOT)), path.read_bytes() if path.exists() else None))
+    return hash_parts(sources)
+
+
+def resolve_module_file(module_name: str) -> Path | None:
+    """
+    获取项目内模块的源代码路径，不在项目内的模块（标准库、第三方库）返回None
+    """
+    if module_name.split('.')[0] in IGNORED_MODULES:
+        return None
+    module_path = Path(PROJECT_ROOT).joinpath(*module_name.split('.'))
+    for file_path in [module_path.with_name(f'{module_path.name}.py'), module_path / '__init__.py']:
+        if file_path.is_file():
+            return file_path
+    return None
+
+
+def get_imported_modules(file_path: Path) -> list:
+    """
+    解析源代码中导入的模块名称，不需要执行代码。from a import b 会同时尝试 a 和 a.b，b 可能是子模块
+    """
+    tree = ast.parse(file_path.read_bytes(), filename=str(file_path))
+    # 相对导入基于当前模块所在的包
+    package = file_path.relative_to(PROJECT_ROOT).parent.parts
+    module_names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            parts = list(package[:len(package) - node.level + 1]) if node.level else []
+            base = '.'.join(parts + ([node.module] if node.module else []))
+            module_names.append(base)
+            module_names.extend(f'{base}.{alias.name}' for alias in node.names)
+    return module_names
+
+
+def get_step_sources(*entries: Path | str) -> list:
+    """
+    从步骤的入口源代码开始，递归查找导入的全部项目模块
+    :param entries: 入口源代码，相对路径基于项目根目录
+    :return: 源代码路径（相对项目根目录），按路径排序
+    """
+    root = Path(PROJECT_ROOT)
+    pending = [root / entry for entry in entries]
+    sources = set()
+    while pending:
+        file_path = pending.pop()
+        if file_path in sources or not file_path.exists():
+            continue
+        sources.add(file_path)
+        for module_name in get_imported_modules(file_path):
+            module_file = resolve_module_file(module_name)
+            if module_file is not None:
+                pending.append(module_file)
+    return sorted(str(path.relative_to(root)) for path in sources)
+
+
+def get_module_path(module_name: str) -> str | None:
+    """
+    获取模块的源代码路径，模块不存在时返回None
+    """
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except ModuleNotFoundError:
+        return None
+    return spec.origin if spec is not None else None
+
+
+def get_step_keys(conf: BacktestConfig) -> dict:
+    """
+    计算每个步骤的输入指纹，下游步骤的指纹包含上游步骤的指纹，上游变化时下游会自动失效
+    :param conf: 回测配置
+    :return: 步骤名称 -> 指纹
+    """
+    # step1：股票和指数数据、交易日历、数据区间、预处理方式、读取方式以及数据类型策略
+    step1_key = hash_parts(
+        get_files_fingerprint([conf.stock_data_path, conf.index_data_path / 'sh000001.csv',
+                               get_file_path('data', '交易日历.csv')]),
+        conf.start_date, conf.end_date, conf.panel_preprocess, conf.csv_reader, conf.dtype_policy,
+        get_source_fingerprint(get_step_sources(STEP1_ENTRY)),
+    )
+
+    # step2：因子及其参数、因子源代码、财务数据、持仓周期以及数据类型策略
+    factor_params = sorted((name, sorted(map(repr, params))) for name, params in conf.factor_params_dict.items())
+    factor_sources = [get_module_path(f'因子库.{name}') for name in sorted(conf.factor_params_dict)]
+    step2_key = hash_parts(
+        step1_key,
+        factor_params, sorted(conf.fin_cols), conf.input_cols, conf.strategy.hold_period_name,
+        conf.csv_reader, conf.dtype_policy,
+        get_files_fingerprint([conf.fin_data_path], pattern='**/*.csv') if conf.fin_cols else None,
+        get_source_fingerprint(get_step_sources(STEP2_ENTRY, *[path for path in factor_sources if path])),
+    )
+
+    # step3：策略配置以及策略源代码，选股结果保存在策略的结果文件夹中，每个策略单独记录
+    strategy_config = {k: v for k, v in conf.strategy_raw.items() if k != 'funcs'}
+    strategy_source = get_module_path(f'策略库.{conf.strategy.name}')
+    step3_key = hash_parts(
+        step2_key, sorted(strategy_config.items(), key=lambda item: item[0]),
+        days_listed,
+        get_source_fingerprint(get_step_sources(STEP3_ENTRY, *([strategy_source] if strategy_source else []))),
+    )
+
+    return {
+        '准备数据': step1_key,
+        '因子计算': step2_key,
+        f'选股:{conf.get_result_folder()}': step3_key,
+    }
+# endregion
+
+
+# region 流水线缓存
+class PipelineCache:
+    """
+    流水线缓存：记录每个步骤上次成功运行时的输入指纹，输入没有变化并且产物存在时，可以直接复用上次的结果
+    """
+
+    def __init__(self, conf: BacktestConfig):
+        self.conf = conf
+        self.keys = get_step_keys(conf)
+        self.cache_path = get_file_path('data', '运行缓存', PIPELINE_CACHE_FILE)
+        self.state: dict = pd.read_pickle(self.cache_path) if self.cache_path.exists() else {}
+
+    def get_step_name(self, step: int) -> str:
+        return list(self.keys.keys())[step - 1]
+
+    def get_artifacts(self, step: int) -> list:
+        """
+        获取步骤的产物文件
+        """
+        if step == 1:
+            return [get_candle_store_folder() / SYMBOL_LIST_FILE, get_market_panel_folder() / 'dates.npy']
+        if step == 2:
+            return [get_file_path('data', '运行缓存', '因子计算结果.pkl'),
+                    get_file_path('data', '运行缓存', '策略因子列信息.pkl')]
+        return [self.conf.get_result_folder() / f'{self.conf.strategy.name}选股结果.pkl']
+
+    def is_fresh(self, step: int) -> bool:
+        """
+        判断步骤的输入是否没有变化，并且产物都存在
+        :param step: 步骤编号，1、2、3
+        """
+        step_name = self.get_step_name(step)
+        if self.state.get(step_name) != self.keys[step_name]:
+            return False
+        return all(path.exists() for path in self.get_artifacts(step))
+
+    def mark_done(self, step: int):
+        """
+        记录步骤运行成功，保存本次的输入指纹
+        :param step: 步骤编号，1、2、3
+        """
+        step_name = self.get_step_name(step)
+        self.state[step_name] = self.keys[step_name]
+        pd.to_pickle(self.state, self.cache_path)
+# endregion
@@ -0,0 +1,144 @@
+"""
+多参数滚动窗口计算
+
+同一个因子扫描多个窗口参数时，每个参数单独调用 pandas rolling 都要重新遍历一遍数据。
+这里先一次性计算带补偿的前缀和、有效值数量以及连续相同值的长度，所有窗口参数共享这些中间结果；
+标准差在 numba 中对每个窗口做一遍滑动更新，不需要逐个参数调用 pandas。
+结果和 pandas rolling 一致：空值不参与计算，窗口内的有效值全部相同时，均值就是该值，标准差为0。
+"""
+from typing import Dict, Iterable
+
+import numba as nb
+import numpy as np
+
+
+@nb.njit(cache=True)
+def cal_prefix_sums(values):
+    """
+    计算滚动窗口共享的中间结果
+    :param values: 一维浮点数组，可以包含空值
+    :return: 前缀和、有效值数量的前缀和（长度都比values多1），截至每一行连续相同的有效值数量，以及截至每一行最近的有效值
+    """
+    n = len(values)
+    prefix = np.zeros(n + 1)
+    counts = np.zeros(n + 1, dtype=np.int64)
+    same_len = np.zeros(n, dtype=np.int64)
+    last_value = np.full(n, np.nan)
+
+    total = 0.0
+    compensation = 0.0
+    count = 0
+    run = 0
+    prev = np.nan
+    for i in range(n):
+        value = values[i]
+        if value == value:
+            # Kahan求和，减少长序列累加的误差
+            y = value - compensation
+            t = total + y
+            compensation = (t - total) - y
+            total = t
+            count += 1
+            # 和pandas一致，连续相同值的计数跳过空值
+            run = run + 1 if value == prev else 1
+            prev = value
+        prefix[i + 1] = total
+        counts[i + 1] = count
+        same_len[i] = run
+        last_value[i] = prev
+    return prefix, counts, same_len, last_value
+
+
+@nb.njit(cache=True)
+def rolling_mean_kernel(prefix, counts, same_len, last_value, window, min_periods):
+    """
+    根据共享的中间结果计算滚动均值
+    """
+    n = len(same_len)
+    out = np.full(n, np.nan)
+    for i in range(n):
+        lo = max(i + 1 - window, 0)
+        count = counts[i + 1] - counts[lo]
+        if count >= min_periods and count > 0:
+            if same_len[i] >= count:
+                out[i] = last_value[i]
+            else:
+                out[i] = (prefix[i + 1] - prefix[lo]) / count
+    return out
+
+
+@nb.njit(cache=True)
+def rolling_std_kernel(values, same_len, window, min_periods):
+    """
+    滑动窗口的 Welford 算法计算滚动标准差（ddof=1），每个窗口只遍历一遍数据。
+    值进入窗口时更新均值和离差平方和，离开窗口时反向更新，均值的更新带Kahan补偿，和 pandas rolling 的算法一致
+    """
+    n = len(values)
+    out = np.full(n, np.nan)
+    nobs = 0
+    mean = 0.0
+    ssqdm = 0.0
+    compensation_add = 0.0
+    compensation_remove = 0.0
+    for i in range(n):
+        # 移出窗口的值
+        if i >= window:
+            value = values[i - window]
+            if value == value:
+                nobs -= 1
+                if nobs:
+                    prev_mean = mean - compensation_remove
+                    y = value - compensation_remove
+                    t = y - mean
+                    compensation_remove = t + mean - y
+                    mean -= t / nobs
+                    ssqdm -= (value - prev_mean) * (value - mean)
+                else:
+                    mean = 0.0
+                    ssqdm = 0.0
+        # 进入窗口的值
+        value = values[i]
+        if value == value:
+            nobs += 1
+            prev_mean = mean - compensation_add
+            y = value - compensation_add
+            t = y - mean
+            compensation_add = t + mean - y
+            mean += t / nobs
+            ssqdm += (value - prev_mean) * (value - mean)
+        if nobs >= min_periods and nobs > 1:
+            if same_len[i] >= nobs:
+                out[i] = 0.0
+            else:
+                # 浮点误差可能让离差平方和略小于0，和pandas一致视为0
+                out[i] = np.sqrt(max(ssqdm, 0.0) / (nobs - 1))
+    return out
+
+
+def rolling_mean_batch(values, windows: Iterable[int], min_periods=None) -> Dict[int, np.ndarray]:
+    """
+    一次性计算多个窗口的滚动均值，和 pd.Series.rolling(window, min_periods).mean() 一致
+    :param values: 一维数组
+    :param windows: 窗口长度
+    :param min_periods: 最少的有效值数量，None表示等于窗口长度
+    :return: 窗口长度 -> 滚动均值
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    prefix, counts, same_len, last_value = cal_prefix_sums(values)
+    return {window: rolling_mean_kernel(prefix, counts, same_len, last_value, window,
+                                        window if min_periods is None else min_periods)
+            for window in windows}
+
+
+def rolling_std_batch(values, windows: Iterable[int], min_periods=None) -> Dict[int, np.ndarray]:
+    """
+    一次性计算多个窗口的滚动标准差，和 pd.Series.rolling(window, min_periods).std() 一致
+    :param values: 一维数组
+    :param windows: 窗口长度
+    :param min_periods: 最少的有效值数量，None表示等于窗口长度
+    :return: 窗口长度 -> 滚动标准差
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    same_len = cal_prefix_sums(values)[2]
+    return {window: rolling_std_kernel(values, same_len, window, window if min_periods is None else min_periods)
+            for window in windows}
@@ -0,0 +1,125 @@
+
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from core.model.type_def import get_symbol_type
+from core.utils.path_kit import get_file_path
+
+# 股票元数据文件，记录每个股票数据文件的基本信息
+SYMBOL_INDEX_FILE = '股票元数据.pkl'
+
+# 股票元数据的列
+SYMBOL_INDEX_COLS = ['首个交易日期', '最后交易日期', '板块', '最新股票名称', '修改时间', '文件大小']
+
+# 股票元数据的格式版本，元数据的列或者计算方式（例如 get_symbol_type 的板块划分）变化时需要重新扫描全部文件
+SYMBOL_INDEX_VERSION = 3
+
+
+# region 股票元数据
+def read_last_line(f, file_size: int, block_size=4096) -> bytes:
+    """
+    从文件末尾向前按块读取，找到最后一个非空行，不需要读取整个文件
+    :param f: 以二进制模式打开的文件
+    :param file_size: 文件大小
+    :param block_size: 每次向前读取的字节数
+    :return: 最后一个非空行，不包含换行符
+    """
+    data = b''
+    pos = file_size
+    while pos > 0:
+        read_size = min(block_size, pos)
+        pos -= read_size
+        f.seek(pos)
+        data = f.read(read_size) + data
+        # 去掉末尾的空行之后，最后一个换行符之后的内容就是完整的最后一行
+        stripped = data.rstrip()
+        line_start = stripped.rfind(b'\n')
+        if line_start >= 0:
+            return stripped[line_start + 1:]
+    return data.rstrip()
+
+
+def scan_stock_file(file_path: Path) -> dict:
+    """
+    扫描单个股票数据文件，只读取表头、第一行数据，再从文件末尾读取最后一行数据，不需要读取整个CSV
+    :param file_path: 股票日线数据文件路径，gbk编码，第一行为说明文字，第二行为表头
+    :return: 股票元数据
+    """
+    stat = file_path.stat()
+    with open(file_path, 'rb') as f:
+        f.readline()  # 说明文字
+        header_line = f.readline()
+        first_line = next((line for line in iter(f.readline, b'') if line.strip()), b'')
+        last_line = read_last_line(f, stat.st_size) if first_line else b''
+
+    meta = {'首个交易日期': pd.NaT, '最后交易日期': pd.NaT, '板块': None,
+            '最新股票名称': None, '修改时间': stat.st_mtime_ns, '文件大小': stat.st_size}
+    if first_line:
+        header = header_line.decode('gbk').strip().split(',')
+        first_row = first_line.decode('gbk').strip().split(',')
+        last_row = last_line.decode('gbk').strip().split(',')
+        date_index, name_index = header.index('交易日期'), header.index('股票名称')
+        meta.update({
+            '首个交易日期': pd.to_datetime(first_row[date_index]),
+            '最后交易日期': pd.to_datetime(last_row[date_index]),
+            '最新股票名称': last_row[name_index],
+        })
+    meta['板块'] = get_symbol_type(file_path.stem)
+    return meta
+
+
+def load_symbol_index(stock_data_path: Path) -> pd.DataFrame:
+    """
+    读取股票元数据，并增量刷新：只重新扫描新增或者修改过（修改时间、大小变化）的文件，删除的文件会被移除
+    :param stock_data_path: 股票日线数据文件夹
+    :return: 股票元数据，index为股票代码，按股票代码排序
+    """
+    index_path = get_file_path('data', '运行缓存', SYMBOL_INDEX_FILE)
+    symbol_index = pd.DataFrame(columns=SYMBOL_INDEX_COLS)
+    if index_path.exists():
+        cache = pd.read_pickle(index_path)
+        if cache.get('version') == SYMBOL_INDEX_VERSION and cache['stock_data_path'] == str(stock_data_path):
+            symbol_index = cache['symbol_index']
+
+    meta_dict = {}
+    n_scanned = 0
+    for file_path in stock_data_path.glob('*.csv'):
+        code = file_path.stem
+        # 排除北交所股票和隐藏文件
+        if code.startswith(('bj', '.')):
+            continue
+        stat = file_path.stat()
+        if code in symbol_index.index and (symbol_index.at[code, '修改时间'], symbol_index.at[code, '文件大小']) == (
+                stat.st_mtime_ns, stat.st_size):
+            meta_dict[code] = symbol_index.loc[code].to_dict()
+        else:
+            meta_dict[code] = scan_stock_file(file_path)
+            n_scanned += 1
+
+    # 有新扫描的文件，或者有文件被删除时，保存股票元数据
+    is_changed = n_scanned > 0 or len(symbol_index) != len(meta_dict)
+    symbol_index = pd.DataFrame.from_dict(meta_dict, orient='index', columns=SYMBOL_INDEX_COLS).sort_index()
+    if is_changed:
+        pd.to_pickle({'version': SYMBOL_INDEX_VERSION, 'stock_data_path': str(stock_data_path),
+                      'symbol_index': symbol_index}, index_path)
+    return symbol_index
+
+
+def filter_symbols(symbol_index: pd.DataFrame, start_date: Optional[str] = None,
+                   end_date: Optional[str] = None) -> List[str]:
+    """
+    根据股票元数据，过滤掉在回测区间内没有数据的股票：在开始日期之前已经退市，或者在结束日期之后才上市
+    :param symbol_index: 股票元数据
+    :param start_date: 回测开始日期
+    :param end_date: 回测结束日期
+    :return: 需要读取的股票代码
+    """
+    cond = symbol_index['首个交易日期'].notna()  # 排除没有数据行的文件
+    if start_date:
+        cond &= symbol_index['最后交易日期'] >= pd.to_datetime(start_date)
+    if end_date:
+        cond &= symbol_index['首个交易日期'] <= pd.to_datetime(end_date)
+    return symbol_index.index[cond].tolist()
+# endregion
@@ -0,0 +1,363 @@
+
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from core.utils.path_kit import get_file_path
+
+# 交易日历缓存文件，保存计算好的交易日历，交易日历文件没有变化时直接读取
+CALENDAR_CACHE_FILE = '交易日历缓存.pkl'
+
+# 本地节假日表，保存A股的休市安排（开始日期、结束日期），离线生成交易日历时使用
+HOLIDAY_FILE = '节假日.csv'
+
+# 交易日历的覆盖范围距离今天不足这个天数时，在后台联网更新节假日表
+CALENDAR_REFRESH_DAYS = 30
+
+# 周期名称，和持仓周期的对应关系
+PERIOD_NAMES = {'W': '周频', 'M': '月频'}
+
+# 进程内的交易日历缓存：交易日历文件指纹 -> TradingCalendar
+_calendar_cache = {}
+
+# 后台更新节假日表的线程，每个进程最多启动一次
+_refresh_thread: threading.Thread | None = None
+
+
+# region 交易日历
+class TradingCalendar:
+    """
+    交易日历：交易日序号为交易日在日历中的位置（从0开始），日期相关的计算都转换为整数数组的计算
+    """
+
+    def __init__(self, dates):
+        self.dates = pd.DatetimeIndex(pd.to_datetime(dates)).unique().sort_values()
+        self.ordinals = np.arange(len(self.dates))
+        self._period_ids = {}  # 周期 -> 每个交易日所属的周期编号
+        self._frame = None  # 交易日历表
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def first_date(self) -> pd.Timestamp:
+        return self.dates[0]
+
+    @property
+    def last_date(self) -> pd.Timestamp:
+        return self.dates[-1]
+
+    def get_ordinals(self, dates, strict=True) -> np.ndarray:
+        """
+        通过二分查找，把日期批量转换为交易日序号
+        :param dates: 日期
+        :param strict: True 时日期必须都是交易日，否则抛出KeyError；False 时非交易日映射到之前最近的交易日，早于日历的日期为-1
+        :return: 交易日序号
+        """
+        values = pd.DatetimeIndex(pd.to_datetime(dates)).values.astype('datetime64[ns]')
+        ordinals = np.searchsorted(self.dates.values, values, side='right') - 1
+        if strict:
+            is_trading = (ordinals >= 0) & (self.dates.values[np.maximum(ordinals, 0)] == values)
+            if not is_trading.all():
+                raise KeyError(f'日期不在交易日历中：{pd.DatetimeIndex(values[~is_trading]).tolist()[:10]}')
+        return ordinals
+
+    def next_trading_day(self, dates) -> pd.DatetimeIndex:
+        """
+        获取每个日期之后的下一个交易日，超出交易日历范围时为NaT
+        :param dates: 日期，可以不是交易日
+        """
+        next_ordinals = self.get_ordinals(dates, strict=False) + 1
+        in_range = next_ordinals < len(self.dates)
+        next_dates = self.dates.values[np.where(in_range, next_ordinals, 0)]
+        return pd.DatetimeIndex(np.where(in_range, next_dates, np.datetime64('NaT')))
+
+    def get_period_ids(self, period: str, offset: int = 0) -> np.ndarray:
+        """
+        获取每个交易日所属的周期编号，同一个周期的交易日编号相同，编号随时间递增
+        :param period: 周期，W/周频 表示周频，M/月频 表示月频，nD（例如 5D）表示每n个交易日一个周期
+        :param offset: nD周期的偏移，取值 0~n-1，偏移为k时，周期从序号为 k、k+n、k+2n... 的交易日开始
+        :return: 周期编号，-1 表示不属于任何周期
+        """
+        key = (period, offset)
+        if key not in self._period_ids:
+            self._period_ids[key] = self._cal_period_ids(period, offset)
+        return self._period_ids[key]
+
+    def _cal_period_ids(self, period: str, offset: int) -> np.ndarray:
+        day_values = self.dates.values.astype('datetime64[D]').astype(np.int64)
+        if period in ('W', PERIOD_NAMES['W']):
+            # 和前一个交易日不是连续的自然日时，开始新的一周，只有一个交易日的周期合并到上一个周期
+            gap_before = np.r_[0, np.diff(day_values)] != 1
+            gap_after = np.r_[np.diff(day_values), 0] != 1
+            is_start = gap_before & ~gap_after
+        elif period in ('M', PERIOD_NAMES['M']):
+            months = self.dates.year.values * 12 + self.dates.month.values
+            is_start = np.r_[True, months[1:] != months[:-1]]
+        elif period.endswith('D') and period[:-1].isdigit() and int(period[:-1]) > 0:
+            n = int(period[:-1])
+            if not 0 <= offset < n:
+                raise ValueError(f'{period}周期的偏移需要在 0~{n - 1} 之间：{offset}')
+            return (self.ordinals + n - offset) // n
+        else:
+            raise ValueError(f'不支持的周期：{period}')
+        return np.cumsum(is_start) - 1
+
+    def get_period_starts(self, period: str, offset: int = 0) -> pd.DatetimeIndex:
+        """
+        获取每个交易日所属周期的起始日，不属于任何周期时为NaT
+        """
+        period_ids = self.get_period_ids(period, offset)
+        is_start = np.r_[True, period_ids[1:] != period_ids[:-1]] & (period_ids >= 0)
+        start_ordinals = np.maximum.accumulate(np.where(is_start, self.ordinals, -1))
+        starts = self.dates.values[np.maximum(start_ordinals, 0)]
+        return pd.DatetimeIndex(np.where(start_ordinals >= 0, starts, np.datetime64('NaT')))
+
+    def get_period_ends(self, period: str, offset: int = 0) -> np.ndarray:
+        """
+        获取每个交易日是否是所属周期的最后一个交易日
+        """
+        period_ids = self.get_period_ids(period, offset)
+        return np.r_[period_ids[1:] != period_ids[:-1], True]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        转换为交易日历表，包括 交易日期、次交易日，以及周频和月频的起始日、终止日
+        """
+        if self._frame is None:
+            tc_df = pd.DataFrame({'交易日期': self.dates})
+            tc_df['次交易日'] = tc_df['交易日期'].shift(-1)
+            for period, name in PERIOD_NAMES.items():
+                tc_df[f'{name}起始日'] = self.get_period_starts(period)
+                tc_df[f'{name}终止日'] = tc_df[f'{name}起始日'] != tc_df[f'{name}起始日'].shift(-1)
+            self._frame = tc_df
+        return self._frame.copy()
+
+
+def load_trading_calendar(tc_path: Path) -> TradingCalendar:
+    """
+    读取交易日历。每个进程只构建一次，并且持久化到运行缓存，交易日历文件没有变化时直接复用
+    :param tc_path: 交易日历文件路径
+    :return: 交易日历
+    """
+    stat = tc_path.stat()
+    fingerprint = (str(tc_path), stat.st_mtime_ns, stat.st_size)
+    if fingerprint in _calendar_cache:
+        return _calendar_cache[fingerprint]
+
+    cache_path = get_file_path('data', '运行缓存', CALENDAR_CACHE_FILE)
+    calendar = None
+    if cache_path.exists():
+        cache = pd.read_pickle(cache_path)
+        if cache['fingerprint'] == fingerprint:
+            calendar = cache['calendar']
+
+    if calendar is None:
+        calendar = TradingCalendar(pd.read_csv(tc_path)['交易日期'])
+        calendar.to_frame()
+        pd.to_pickle({'fingerprint': fingerprint, 'calendar': calendar}, cache_path)
+
+    _calendar_cache[fingerprint] = calendar
+    return calendar
+# endregion
+
+
+# region 交易日历数据源
+class CalendarProvider(ABC):
+    """
+    交易日历数据源：提供A股的休市安排，和指数的交易日期一起生成交易日历
+    """
+
+    @abstractmethod
+    def get_holidays(self) -> pd.DataFrame:
+        """
+        获取休市安排
+        :return: 包含 开始日期、结束日期 两列的休市安排，没有数据时为空表
+        """
+
+    def build(self, index_dates) -> pd.DataFrame:
+        """
+        生成交易日历
+        :param index_dates: 指数的交易日期
+        :return: 包含 交易日期 一列的交易日历
+        """
+        return build_trade_dates(index_dates, self.get_holidays())
+
+
+class LocalCalendarProvider(CalendarProvider):
+    """
+    离线数据源：读取本地节假日表，不访问网络
+    """
+
+    def __init__(self, holiday_path: Path):
+        self.holiday_path = holiday_path
+
+    def get_holidays(self) -> pd.DataFrame:
+        if not self.holiday_path.exists():
+            return pd.DataFrame(columns=['开始日期', '结束日期'], dtype='datetime64[ns]')
+        return pd.read_csv(self.holiday_path, parse_dates=['开始日期', '结束日期'])
+
+
+class EastmoneyCalendarProvider(CalendarProvider):
+    """
+    在线数据源：从东方财富获取休市安排，网络请求有严格的超时时间
+    """
+
+    def __init__(self, timeout: float = 5):
+        self.timeout = timeout
+
+    def get_holidays(self) -> pd.DataFrame:
+        import requests  # 只有联网更新时才需要
+
+        url = "https://datacenter-web.eastmoney.com/api/data/v1/get"
+        params = {
+            "reportName": "RPTA_WEB_ZGXSRL",
+            "columns": "ALL",
+            "pageSize": 200,
+            "sortColumns": "SDATE",
+            "sortTypes": -1,
+            "callback": f"jQuery1123{random.randint(10000000000000000, 99999999999999999)}_" + str(int(time.time() * 1000)),
+            # 动态生成时间戳
+            "_": int(time.time() * 1000)  # 动态生成时间戳
+        }
+
+        response = requests.get(url, params=params, timeout=(self.timeout, self.timeout))
+        content = response.text
+
+        # 去除JSONP封装
+        start = content.find('(') + 1
+        end = content.rfind(')')
+        json_data = json.loads(content[start:end])
+
+        holiday_df = pd.DataFrame(json_data['result']['data'])
+        holiday_df = holiday_df[holiday_df['MKT'] == 'A股']
+        return pd.DataFrame({
+            '开始日期': pd.to_datetime(holiday_df['SDATE']).values,
+            '结束日期': pd.to_datetime(holiday_df['EDATE']).values,
+        })
+
+
+def build_trade_dates(index_dates, holiday_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    根据指数的交易日期和休市安排生成交易日历。
+    从最早的休市安排开始，到最晚的休市安排的年底为止，除去休市日和周末的日期都是交易日，再并上指数的交易日期
+    :param index_dates: 指数的交易日期
+    :param holiday_df: 休市安排，包含 开始日期、结束日期
+    :return: 包含 交易日期 一列的交易日历
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(index_dates)).dropna()
+    if not holiday_df.empty:
+        holiday_df = holiday_df.sort_values('开始日期')
+        holiday_starts = holiday_df['开始日期'].values
+        # 休市安排可能重叠，用累计最大的结束日期判断是否在休市安排中
+        holiday_ends = np.maximum.accumulate(holiday_df['结束日期'].values)
+
+        all_days = pd.date_range(start=holiday_starts[0], end=f"{holiday_df['结束日期'].max().year}-12-31")
+        pos = np.searchsorted(holiday_starts, all_days.values, side='right') - 1
+        is_holiday = (pos >= 0) & (all_days.values <= holiday_ends[np.maximum(pos, 0)])
+        # 正常的周末也是不交易的
+        is_trading = ~is_holiday & (all_days.weekday < 5)
+        dates = dates.append(all_days[is_trading])
+
+    return pd.DataFrame({'交易日期': dates.unique().sort_values()})
+
+
+def derive_holidays(trade_dates) -> pd.DataFrame:
+    """
+    根据已有的交易日历反推休市安排：日历范围内不是交易日的工作日都是休市日，相邻的休市日（中间只隔周末）合并为一个区间
+    :param trade_dates: 交易日期
+    :return: 包含 开始日期、结束日期 两列的休市安排
+    """
+    trade_dates = pd.DatetimeIndex(pd.to_datetime(trade_dates)).dropna().unique().sort_values()
+    if trade_dates.empty:
+        return pd.DataFrame(columns=['开始日期', '结束日期'], dtype='datetime64[ns]')
+    weekdays = pd.bdate_range(trade_dates[0], trade_dates[-1])
+    is_holiday = ~weekdays.isin(trade_dates)
+    pos = np.flatnonzero(is_holiday)
+    # 休市日在工作日中的位置不连续时，开始一个新的休市区间
+    is_start = np.r_[True, np.diff(pos) > 1] if len(pos) else np.array([], dtype=bool)
+    is_end = np.r_[is_start[1:], True] if len(pos) else np.array([], dtype=bool)
+    return pd.DataFrame({'开始日期': weekdays[pos[is_start]], '结束日期': weekdays[pos[is_end]]})
+
+
+def refresh_holidays(holiday_path: Path, timeout: float = 5) -> bool:
+    """
+    联网更新本地节假日表，和已有的休市安排合并后原子写入
+    :param holiday_path: 本地节假日表路径
+    :param timeout: 网络请求的超时时间（秒）
+    :return: 是否更新成功
+    """
+    try:
+        holiday_df = EastmoneyCalendarProvider(timeout).get_holidays()
+    except Exception as e:
+        print(f'⚠️ 联网更新节假日数据失败，继续使用本地数据：{type(e).__name__}')
+        return False
+
+    holiday_df = pd.concat([LocalCalendarProvider(holiday_path).get_holidays(), holiday_df], ignore_index=True)
+    holiday_df = holiday_df.drop_duplicates().sort_values('开始日期').reset_index(drop=True)
+    tmp_path = holiday_path.with_name(f'{holiday_path.name}.{os.getpid()}.tmp')
+    holiday_df.to_csv(tmp_path, index=False, date_format='%Y-%m-%d')
+    os.replace(tmp_path, holiday_path)
+    print(f'🔄 节假日数据更新为：{holiday_df["开始日期"].min():%Y-%m-%d}~{holiday_df["结束日期"].max():%Y-%m-%d}，下次运行时生效')
+    return True
+
+
+def start_holiday_refresh(holiday_path: Path, timeout: float = 5):
+    """
+    在后台线程联网更新节假日表，不阻塞当前程序。更新结果在下次生成交易日历时生效，保证本次运行的交易日历不变
+    """
+    global _refresh_thread
+    if _refresh_thread is not None:
+        return
+    _refresh_thread = threading.Thread(target=refresh_holidays, args=(holiday_path, timeout), daemon=True)
+    _refresh_thread.start()
+
+
+def prepare_trading_calendar(tc_path: Path, index_path: Path, online_refresh=True, timeout: float = 5,
+                             holiday_path: Path = None) -> TradingCalendar:
+    """
+    准备交易日历：只用本地的指数数据和节假日表离线生成，不会等待网络。
+    还没有本地节假日表时，先从已有的交易日历反推生成；交易日历临近过期，或者仍然没有本地节假日表时，在后台联网更新节假日表
+    :param tc_path: 交易日历文件路径
+    :param index_path: 指数数据文件路径，指数的交易日期都是交易日
+    :param online_refresh: 是否允许在后台联网更新节假日表
+    :param timeout: 网络请求的超时时间（秒）
+    :param holiday_path: 本地节假日表路径，默认为 data/节假日.csv
+    :return: 交易日历
+    """
+    holiday_path = holiday_path or get_file_path('data', HOLIDAY_FILE)
+    if not holiday_path.exists() and tc_path.exists():
+        # 第一次运行时没有本地节假日表，从已有的交易日历中反推休市安排，离线也能生成完整的交易日历
+        holiday_df = derive_holidays(pd.read_csv(tc_path, parse_dates=['交易日期'])['交易日期'])
+        holiday_df.to_csv(holiday_path, index=False, date_format='%Y-%m-%d')
+        print(f'ℹ️ 根据已有的交易日历生成本地节假日表：{holiday_path}')
+    index_dates = pd.read_csv(index_path, usecols=['candle_end_time'], encoding='gbk')['candle_end_time']
+    tc_df = LocalCalendarProvider(holiday_path).build(index_dates)
+
+    # 离线生成的交易日历有变化时才写入，避免改变交易日历文件的指纹。
+    # 没有节假日表时离线结果只包含历史交易日，不覆盖已有的覆盖更长的交易日历
+    old_tc_df = pd.read_csv(tc_path, parse_dates=['交易日期']) if tc_path.exists() else None
+    if old_tc_df is None or (tc_df['交易日期'].max() >= old_tc_df['交易日期'].max()
+                             and not tc_df['交易日期'].equals(old_tc_df['交易日期'])):
+        tc_df.to_csv(tc_path, index=False)
+        print(f'🔄 交易日历更新为：{tc_df["交易日期"].min():%Y-%m-%d}~{tc_df["交易日期"].max():%Y-%m-%d}')
+
+    calendar = load_trading_calendar(tc_path)
+    is_expiring = calendar.last_date - pd.Timestamp(datetime.today()) <= pd.to_timedelta(f'{CALENDAR_REFRESH_DAYS} days')
+    if is_expiring or not holiday_path.exists():
+        if online_refresh:
+            start_holiday_refresh(holiday_path, timeout)
+        elif is_expiring:
+            print(f'⚠️ 交易日历即将过期（截止到{calendar.last_date:%Y-%m-%d}），请更新本地节假日表：{holiday_path}')
+        else:
+            print(f'ℹ️ 没有本地节假日表：{holiday_path}，交易日历只包含指数数据中的交易日')
+    return calendar
+# endregion
@@ -11,6 +11,7 @@ Author: 邢不行
 """
 import importlib
 
+import numpy as np
 import pandas as pd
 
 
@@ -21,6 +22,9 @@ class FactorInterface:
     # 财务因子列：此列表用于存储财务因子相关的列名称
     fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
 
+    # K线数据列：此列表用于声明因子计算需要读取的K线数据列名称
+    input_cols = None  # None表示需要全部列，配置后系统只会读取声明的列（以及周期转换必须的列）
+
     @staticmethod
     def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
         """
@@ -32,6 +36,8 @@ class FactorInterface:
         3. 定义因子的聚合方式，用于周期转换时的数据聚合。
 
         :param df: pd.DataFrame，包含单只股票的K线数据，必须包括市场数据（如收盘价等）。
+            配置了 input_cols 时只包含 input_cols 和 fin_cols 中的列。数据和step2共享内存并且是只读的，
+            不需要复制，不能原地修改已有的列，可以直接添加新的因子列。
         :param param: 因子计算所需的参数，格式和含义根据因子类型的不同而有所不同。
         :param kwargs: 其他关键字参数，包括：
             - col_name: 新计算的因子列名。
@@ -72,9 +78,34 @@ class FactorInterface:
         # 我们只返回因子的列信息，以及周期转换时候因子列的聚合方式
         return df[[col_name]], agg_dict
 
-    def add_factors(self, df: pd.DataFrame, params=(), **kwargs) -> (pd.DataFrame, dict):
+    @staticmethod
+    def add_panel_factor(panel: dict, param=None, **kwargs) -> (np.ndarray, dict):
+        """
+        可选实现：按股票分组构建面板，对一组股票一次性计算因子，实现后step2不再逐只股票调用 add_factor
+
+        :param panel: dict，财务数据的时点面板，每个财务因子列是一个 日期 x 股票 的二维数组，参考 build_fin_panel。
+            面板中没有K线的日期为空值，沿日期方向的计算和逐只股票计算一致。
+        :param param: 因子计算所需的参数，和 add_factor 相同。
+        :param kwargs: 其他关键字参数，包括 col_name：新计算的因子列名。
+        :return: tuple
+            - np.ndarray: 日期 x 股票 的因子数据。
+            - dict: 聚合方式字典，和 add_factor 相同。
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def add_factors(df: pd.DataFrame, params=(), **kwargs) -> (pd.DataFrame, dict):
         """
-        批量计算多个参数下的因子数值
+        可选实现：批量计算多个参数下的因子数值，实现后step2对每只股票只调用一次，不再逐个参数调用 add_factor
+
+        :param df: pd.DataFrame，包含单只股票的K线数据，和 add_factor 相同。
+        :param params: 因子的全部参数。
+        :param kwargs: 其他关键字参数，包括：
+            - col_names: 和 params 一一对应的因子列名。
+            - fin_data: 财务数据字典，和 add_factor 相同。
+        :return: tuple
+            - pd.DataFrame: 包含全部参数的因子列，与输入的df具有相同的索引。
+            - dict: 聚合方式字典，包含全部因子列。
         """
         raise NotImplementedError
 
@@ -104,6 +135,12 @@ class FactorHub:
             if 'fin_cols' not in factor_content:
                 factor_content['fin_cols'] = []
 
+            if 'input_cols' not in factor_content:
+                factor_content['input_cols'] = None
+
+            # 因子文件中实现了 add_factors 时，支持一次性计算全部参数
+            factor_content['is_batch'] = callable(factor_content.get('add_factors'))
+
             # 创建一个包含这些变量和函数的对象
             factor_instance = type(factor_name, (), factor_content)
 
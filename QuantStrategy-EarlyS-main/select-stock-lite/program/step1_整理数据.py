@@ -1,14 +1,23 @@
 
 import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from core.csv_reader import STOCK_DATA_COLS, read_stock_csv
+from core.data_store import (get_candle_store_folder, get_candle_symbols, get_market_panel_folder, load_market_pivot,
+                             read_candle_df, save_candle_data, save_market_panel)
+from core.dtype_policy import print_memory_report
 from core.model.backtest_config import load_config, BacktestConfig
-from core.utils.path_kit import get_file_path
-from core.market_essentials import cal_fuquan_price, cal_zdt_price, merge_with_index_data
+from core.adjust_price import cal_fq_factor
+from core.market_essentials import cal_zdt_price, merge_with_index_data
+from core.name_status import cal_name_status, get_status_flag
+from core.panel_essentials import NEXT_DAY_COLS, MarketPanel
+from core.symbol_index import filter_symbols, load_symbol_index
 
 # ====================================================================================================
 # ** 配置与初始化 **
@@ -19,52 +28,109 @@ pd.set_option('expand_frame_repr', False)  # 使数据框在控制台显示不
 pd.set_option('display.unicode.ambiguous_as_wide', True)
 pd.set_option('display.unicode.east_asian_width', True)
 
-# 定义股票数据所需的列
-STOCK_DATA_COLS = [
-    '股票代码', '股票名称', '交易日期', '开盘价', '最高价', '最低价', '收盘价', '前收盘价', '成交量', '成交额',
-    '流通市值', '总市值',
-]
+# 增量更新信息文件
+UPDATE_INFO_FILE = '增量更新信息.pkl'
+
+# 预处理数据的格式版本，格式变化时（例如不再保存复权价格列、新增板块和是否ST列、新增股票名称历史）需要全量更新
+STORE_FORMAT_VERSION = 4
 
 
 def prepare_data(conf: BacktestConfig):
     start_time = time.time()  # 记录数据准备开始时间
 
-    # 1. 获取股票代码列表
-    stock_code_list = []  # 用于存储股票代码
-    # 遍历文件夹下，所有csv文件
-    for filename in conf.stock_data_path.glob('*.csv'):
-        # 排除北交所股票和隐藏文件
-        if filename.stem.startswith(('bj', '.')):
-            continue
-        stock_code_list.append(filename.stem)
-    stock_code_list = sorted(stock_code_list)
-    print(f'📂 读取到股票数量：{len(stock_code_list)}，不包括北交所股票')
+    # 1. 获取股票代码列表，通过股票元数据跳过回测区间内没有数据的股票，不需要读取这些股票的文件
+    symbol_index = load_symbol_index(conf.stock_data_path)
+    stock_code_list = filter_symbols(symbol_index, conf.start_date, conf.end_date)
+    print(f'📂 读取到股票数量：{len(symbol_index)}，不包括北交所股票，'
+          f'其中{len(symbol_index) - len(stock_code_list)}只股票在回测区间内没有数据，跳过读取')
 
     # 2. 读取并处理指数数据，确保股票数据与指数数据的时间对齐
     index_data = conf.read_index_with_trading_date()
-    all_candle_data_dict = {}  # 用于存储所有股票的K线数据
-    for code in tqdm(stock_code_list, desc='预处理数据', total=len(stock_code_list)):
-        file_path = conf.stock_data_path / f'{code}.csv'
-        df = pd.read_csv(file_path, encoding='gbk', skiprows=1, parse_dates=['交易日期'], usecols=STOCK_DATA_COLS)
-        df = pre_process(df, index_data)  # 预处理数据，包括与指数数据合并和状态计算
-        if not df.empty:
-            all_candle_data_dict[code] = df  # 仅存储非空数据
 
-    # 3. 缓存预处理后的数据
-    cache_path = get_file_path('data', '运行缓存', '股票预处理数据.pkl')
-    print('💾 保存到缓存文件...', cache_path)
-    pd.to_pickle(all_candle_data_dict, cache_path)
+    # 增量更新模式：只处理有新数据的股票，并原地更新缓存和透视表
+    update_info = load_update_info(conf, index_data) if conf.incremental_update else None
+    if update_info is not None:
+        update_data(conf, stock_code_list, index_data, update_info)
+        save_update_info(conf, stock_code_list, index_data)
+        print_memory_report('增量更新数据', conf.memory_budget_mb)
+        print(f'✅ 增量更新数据耗时：{time.time() - start_time} 秒\n')
+        return
+    elif conf.incremental_update:
+        print('⚠️ 没有可用的增量更新信息，或者数据配置发生变化，执行全量数据准备')
+
+    file_path_list = [conf.stock_data_path / f'{code}.csv' for code in stock_code_list]
+    if conf.panel_preprocess:
+        # 面板模式：读取全部原始数据后，一次性对全市场做预处理
+        print('🚀 使用全市场面板模式预处理数据')
+        df_list = map_files(conf, partial(read_stock_csv, reader=conf.csv_reader), file_path_list, desc='读取数据')
+        all_candle_data_dict = MarketPanel(dict(zip(stock_code_list, df_list)), index_data)
+    else:
+        read_func = partial(read_and_pre_process, index_data=index_data, reader=conf.csv_reader)
+        df_list = map_files(conf, read_func, file_path_list, desc='预处理数据')
+        all_candle_data_dict = {}  # 用于存储所有股票的K线数据
+        for code, df in zip(stock_code_list, df_list):
+            if not df.empty:
+                all_candle_data_dict[code] = df  # 仅存储非空数据
+
+    # 3. 缓存预处理后的数据，每只股票一个列式存储文件，后续可以按列、按股票读取
+    print('💾 保存到列式缓存...', get_candle_store_folder())
+    save_candle_data(all_candle_data_dict, dtype_policy=conf.dtype_policy)
 
-    # 4. 准备并缓存pivot透视表数据，用于后续回测
+    # 4. 准备并缓存行情面板数据，用于后续回测，回测时通过内存映射读取
     print('ℹ️ 准备透视表数据...')
-    market_pivot_dict = make_market_pivot(all_candle_data_dict)
-    pivot_cache_path = get_file_path('data', '运行缓存', '全部股票行情pivot.pkl')
-    print('💾 保存到缓存文件...', pivot_cache_path)
-    pd.to_pickle(market_pivot_dict, pivot_cache_path)
+    if conf.panel_preprocess:
+        market_pivot_dict = all_candle_data_dict.make_market_pivot()
+    else:
+        market_pivot_dict = make_market_pivot(all_candle_data_dict)
+    print('💾 保存到行情面板...', get_market_panel_folder())
+    save_market_panel(market_pivot_dict)
 
+    # 5. 记录本次数据准备的文件信息，用于下次增量更新
+    save_update_info(conf, stock_code_list, index_data)
+
+    print_memory_report('准备数据', conf.memory_budget_mb)
     print(f'✅ 数据准备耗时：{time.time() - start_time} 秒\n')
 
 
+def map_files(conf: BacktestConfig, func, file_path_list, desc):
+    """
+    对每个文件执行func，n_jobs大于1时使用多进程并行处理
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    func (callable): 处理单个文件的函数
+    file_path_list (list): 文件路径列表
+    desc (str): 进度条描述
+
+    返回:
+    list: 和文件路径顺序一致的处理结果
+    """
+    if conf.n_jobs > 1:
+        # 多进程并行处理，map会按照输入顺序返回结果，保证输出顺序和串行一致
+        print(f'🚀 并行{desc}，进程数：{conf.n_jobs}')
+        chunk_size = max(1, len(file_path_list) // (conf.n_jobs * 4))
+        with ProcessPoolExecutor(max_workers=conf.n_jobs) as executor:
+            return list(tqdm(executor.map(func, file_path_list, chunksize=chunk_size),
+                             desc=desc, total=len(file_path_list)))
+    return [func(file_path) for file_path in tqdm(file_path_list, desc=desc)]
+
+
+def read_and_pre_process(file_path, index_data, reader='pandas') -> pd.DataFrame:
+    """
+    读取单个股票的日线数据并进行预处理，串行和并行模式共用这个函数。
+
+    参数:
+    file_path (Path): 股票日线数据文件路径
+    index_data (DataFrame): 指数数据
+    reader (str, optional): CSV读取方式，参考 core.csv_reader.read_stock_csv
+
+    返回:
+    df (DataFrame): 预处理后的数据
+    """
+    df = read_stock_csv(file_path, reader)
+    return pre_process(df, index_data)  # 预处理数据，包括与指数数据合并和状态计算
+
+
 def pre_process(df, index_data) -> pd.DataFrame:
     """
     对股票数据进行预处理，包括合并指数数据和计算未来交易日状态。
@@ -76,47 +142,90 @@ def pre_process(df, index_data) -> pd.DataFrame:
     返回:
     df (DataFrame): 预处理后的数据
     """
+    # 计算涨跌幅、换手率、复权因子等全历史指标，以及涨跌停价格
+    df = cal_candle_indicators(df)
+    df = cal_zdt_price(df)
+
+    # 合并股票与指数数据，补全停牌日期等信息
+    df = merge_with_index_data(df, index_data.copy(), fill_0_list=['换手率'])
+
+    # 股票退市时间小于指数开始时间，就会出现空值
+    if df.empty:
+        # 如果出现这种情况，返回空的DataFrame用于后续操作
+        return pd.DataFrame(columns=STOCK_DATA_COLS)
+
+    # 计算开盘买入涨跌幅和未来交易日状态
+    df = cal_next_day_state(df)
+
+    # 清理退市数据，保留有效交易数据
+    return trim_delisted(df)
+
+
+def cal_candle_indicators(df) -> pd.DataFrame:
+    """
+    计算涨跌幅、换手率、上市至今交易天数、均价以及复权因子，这些指标都是基于原始K线整体计算的。
+    复权价格不再保存，需要时根据复权因子按需计算，参考 core.adjust_price
+
+    参数:
+    df (DataFrame): 股票日线数据
+
+    返回:
+    df (DataFrame): 增加指标后的数据
+    """
     # 计算涨跌幅、换手率等关键指标
     pct_change = df['收盘价'] / df['前收盘价'] - 1
     turnover_rate = df['成交额'] / df['流通市值']
     trading_days = df.index.astype('int') + 1
     avg_price = df['成交额'] / df['成交量']
+    fq_factor = cal_fq_factor(df['收盘价'], df['前收盘价'])
 
     # 一次性赋值提高性能
-    df = df.assign(
+    return df.assign(
         涨跌幅=pct_change,
         换手率=turnover_rate,
         上市至今交易天数=trading_days,
         均价=avg_price,
+        复权因子=fq_factor,
     )
 
-    # 复权价计算及涨跌停价格计算
-    df = cal_fuquan_price(df, fuquan_type='后复权')
-    df = cal_zdt_price(df)
 
-    # 合并股票与指数数据，补全停牌日期等信息
-    df = merge_with_index_data(df, index_data.copy(), fill_0_list=['换手率'])
+def cal_next_day_state(df) -> pd.DataFrame:
+    """
+    计算下一个交易日的状态，最后一根K线的状态默认沿用前一日的数据。
 
-    # 股票退市时间小于指数开始时间，就会出现空值
-    if df.empty:
-        # 如果出现这种情况，返回空的DataFrame用于后续操作
-        return pd.DataFrame(columns=STOCK_DATA_COLS)
+    参数:
+    df (DataFrame): 与指数数据合并后的股票数据
 
-    # 计算开盘买入涨跌幅和未来交易日状态
+    返回:
+    df (DataFrame): 增加下日状态后的数据
+    """
+    # 股票名称状态只对去重后的名称计算一次，不逐行匹配字符串
+    name_status = cal_name_status(df['股票名称'])
     df = df.assign(
         下日_是否交易=df['是否交易'].astype('int8').shift(-1),
         下日_一字涨停=df['一字涨停'].astype('int8').shift(-1),
         下日_开盘涨停=df['开盘涨停'].astype('int8').shift(-1),
-        下日_是否ST=df['股票名称'].str.contains('ST').astype('int8').shift(-1),
-        下日_是否S=df['股票名称'].str.contains('S').astype('int8').shift(-1),
-        下日_是否退市=df['股票名称'].str.contains('退').astype('int8').shift(-1),
+        下日_是否ST=df['是否ST'].astype('int8').shift(-1),
+        下日_是否S=pd.Series(get_status_flag(name_status, '是否S'), index=df.index).shift(-1),
+        下日_是否退市=pd.Series(get_status_flag(name_status, '是否退市'), index=df.index).shift(-1),
     )
 
     # 处理最后一根K线的数据：最后一根K线默认沿用前一日的数据
     state_cols = ['下日_是否交易', '下日_是否ST', '下日_是否S', '下日_是否退市']
     df[state_cols] = df[state_cols].ffill()
+    return df
 
-    # 清理退市数据，保留有效交易数据
+
+def trim_delisted(df) -> pd.DataFrame:
+    """
+    清理退市数据，保留有效交易数据。
+
+    参数:
+    df (DataFrame): 计算完下日状态的股票数据
+
+    返回:
+    df (DataFrame): 清理后的数据，如果没有有效数据则返回空的DataFrame
+    """
     if ('退' in df['股票名称'].iloc[-1]) or ('S' in df['股票名称'].iloc[-1]):
         if df['成交额'].iloc[-1] == 0 and np.all(df['成交额'] == 0):
             return pd.DataFrame(columns=STOCK_DATA_COLS)
@@ -132,6 +241,211 @@ def pre_process(df, index_data) -> pd.DataFrame:
     return df if not df.empty else pd.DataFrame(columns=STOCK_DATA_COLS)
 
 
+# ====================================================================================================
+# ** 增量更新 **
+# 每天只会新增一根K线，通过文件的修改时间和大小判断哪些股票有新数据，只处理新增的尾部数据，
+# 然后原地更新列式缓存和透视表。首次运行或者配置变化时，会自动回退到全量数据准备。
+# ====================================================================================================
+def get_stock_file_info(conf: BacktestConfig, stock_code_list) -> dict:
+    """
+    获取股票数据文件的修改时间和大小，用于判断文件是否有更新
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_code_list (list): 股票代码列表
+
+    返回:
+    dict: 股票代码 -> (修改时间, 文件大小)
+    """
+    file_info = {}
+    for code in stock_code_list:
+        stat = (conf.stock_data_path / f'{code}.csv').stat()
+        file_info[code] = (stat.st_mtime_ns, stat.st_size)
+    return file_info
+
+
+def save_update_info(conf: BacktestConfig, stock_code_list, index_data):
+    """
+    保存本次数据准备的信息，包括数据配置、指数数据以及每个股票文件的信息
+    """
+    update_info = {
+        'format_version': STORE_FORMAT_VERSION,
+        'stock_data_path': str(conf.stock_data_path),
+        'start_date': conf.start_date,
+        'end_date': conf.end_date,
+        'index_data': index_data,
+        'file_info': get_stock_file_info(conf, stock_code_list),
+    }
+    pd.to_pickle(update_info, get_candle_store_folder() / UPDATE_INFO_FILE)
+
+
+def load_update_info(conf: BacktestConfig, index_data):
+    """
+    读取上次数据准备的信息，并检查是否可以进行增量更新
+
+    返回:
+    dict: 上次数据准备的信息，不能增量更新时返回None
+    """
+    update_info_path = get_candle_store_folder() / UPDATE_INFO_FILE
+    if not update_info_path.exists():
+        return None
+    update_info = pd.read_pickle(update_info_path)
+
+    # 预处理数据的格式发生变化，需要全量更新
+    if update_info.get('format_version') != STORE_FORMAT_VERSION:
+        return None
+
+    # 数据路径和回测区间发生变化，需要全量更新
+    if (update_info['stock_data_path'], update_info['start_date'], update_info['end_date']) != (
+            str(conf.stock_data_path), conf.start_date, conf.end_date):
+        return None
+
+    # 指数数据只能在尾部追加，历史部分发生变化时需要全量更新
+    last_index_data = update_info['index_data']
+    if len(last_index_data) > len(index_data):
+        return None
+    if not index_data.iloc[:len(last_index_data)].reset_index(drop=True).equals(last_index_data):
+        return None
+
+    return update_info
+
+
+def update_data(conf: BacktestConfig, stock_code_list, index_data, update_info):
+    """
+    增量更新股票预处理数据和透视表数据
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_code_list (list): 股票代码列表
+    index_data (DataFrame): 指数数据
+    update_info (dict): 上次数据准备的信息
+    """
+    file_info = get_stock_file_info(conf, stock_code_list)
+    last_file_info = update_info['file_info']
+    last_index_date = update_info['index_data']['交易日期'].iloc[-1]
+    has_new_dates = index_data['交易日期'].iloc[-1] > last_index_date
+    cached_symbols = set(get_candle_symbols())
+
+    updated_data_dict = {}  # 发生变化的股票数据
+    removed_symbols = cached_symbols - set(stock_code_list)  # 数据文件已经被删除的股票
+    for code in tqdm(stock_code_list, desc='增量更新数据'):
+        file_path = conf.stock_data_path / f'{code}.csv'
+        file_changed = last_file_info.get(code) != file_info[code]
+
+        if code not in cached_symbols:
+            # 新增的股票，或者上次数据为空的股票，文件有变化才需要重新处理
+            if file_changed:
+                df = read_and_pre_process(file_path, index_data, conf.csv_reader)
+                if not df.empty:
+                    updated_data_dict[code] = df
+            continue
+
+        # 上次已经做过退市清理的股票，文件没有变化时，结果不会改变
+        cached_df = read_candle_df(code)
+        is_trimmed = cached_df['交易日期'].iloc[-1] < last_index_date
+        if not file_changed and (is_trimmed or not has_new_dates):
+            continue
+
+        df = None
+        if not is_trimmed:
+            df = pre_process_tail(cached_df, read_stock_csv(file_path, conf.csv_reader) if file_changed else None, index_data)
+        if df is None:
+            # 无法增量处理的情况（历史数据被修改等），回退到单只股票的全量处理
+            df = read_and_pre_process(file_path, index_data, conf.csv_reader)
+
+        if df.empty:
+            removed_symbols.add(code)
+        else:
+            updated_data_dict[code] = df
+
+    print(f'ℹ️ 更新股票数量：{len(updated_data_dict)}，移除股票数量：{len(removed_symbols)}')
+
+    # 更新列式缓存
+    symbols = [code for code in stock_code_list
+               if code in updated_data_dict or (code in cached_symbols and code not in removed_symbols)]
+    save_candle_data(updated_data_dict, symbols, dtype_policy=conf.dtype_policy)
+
+    # 原地更新行情面板
+    market_pivot_dict = update_market_pivot(load_market_pivot(), updated_data_dict, symbols)
+    print('💾 保存到行情面板...', get_market_panel_folder())
+    save_market_panel(market_pivot_dict)
+
+
+def pre_process_tail(cached_df, raw_df, index_data):
+    """
+    只处理新增的尾部数据，结果与全量调用 pre_process 一致。
+
+    参数:
+    cached_df (DataFrame): 上次预处理后的数据
+    raw_df (DataFrame): 最新的原始日线数据，文件没有变化时为None，只需要补全新的交易日
+    index_data (DataFrame): 指数数据
+
+    返回:
+    df (DataFrame): 预处理后的数据，历史数据发生变化、无法增量处理时返回None
+    """
+    last_date = cached_df['交易日期'].iloc[-1]
+    # 合并指数前的列，用于拼接尾部数据
+    pre_merge_cols = [col for col in cached_df.columns if col not in index_data.columns or col == '交易日期']
+    pre_merge_cols = [col for col in pre_merge_cols if col not in ('是否交易', *NEXT_DAY_COLS)]
+
+    if raw_df is not None:
+        # 通过最后一根真实K线的上市至今交易天数，定位原始数据中已经处理过的部分
+        last_trade = cached_df[cached_df['是否交易'] == 1].iloc[-1]
+        n_rows = int(last_trade['上市至今交易天数'])
+        if len(raw_df) < n_rows or raw_df['交易日期'].iloc[n_rows - 1] != last_trade['交易日期']:
+            return None
+        # 复权、上市天数等指标依赖全部历史，计算成本很低，直接全量计算后截取尾部
+        tail_df = cal_candle_indicators(raw_df).iloc[n_rows:].copy()
+        if (tail_df['交易日期'] <= last_date).any():
+            return None
+        tail_df = cal_zdt_price(tail_df)[pre_merge_cols]
+    else:
+        tail_df = cached_df.iloc[:0][pre_merge_cols]
+
+    # 用缓存的最后一行作为种子，保证停牌日期的补全和全量处理一致
+    seed_df = cached_df.iloc[[-1]][pre_merge_cols]
+    new_df = merge_with_index_data(pd.concat([seed_df, tail_df], ignore_index=True),
+                                   index_data[index_data['交易日期'] >= last_date].copy(), fill_0_list=['换手率'])
+    new_df = new_df.iloc[1:]
+    if new_df.empty:
+        return cached_df
+
+    # 重新计算最后一行以及新增数据的下日状态，然后重新做退市清理
+    new_df = new_df[[col for col in cached_df.columns if col not in NEXT_DAY_COLS]]
+    state_df = cal_next_day_state(pd.concat([cached_df.iloc[[-1]], new_df], ignore_index=True))
+    df = pd.concat([cached_df.iloc[:-1], state_df[cached_df.columns]], ignore_index=True)
+    return trim_delisted(df)
+
+
+def update_market_pivot(market_pivot_dict, updated_data_dict, symbols):
+    """
+    原地更新透视表数据，只替换发生变化的股票列
+
+    参数:
+    market_pivot_dict (dict): 上次的透视表数据
+    updated_data_dict (dict): 发生变化的股票数据
+    symbols (list): 最新的股票代码列表
+
+    返回:
+    dict: 更新后的透视表数据
+    """
+    dates = market_pivot_dict['open'].index
+    for df in updated_data_dict.values():
+        dates = dates.union(df['交易日期'])
+
+    new_pivot_dict = {}
+    for key, col in (('open', '开盘价'), ('close', '收盘价'), ('preclose', '前收盘价')):
+        pivot_df = market_pivot_dict[key].reindex(index=dates, columns=sorted(symbols))
+        values = pivot_df.to_numpy(copy=True)
+        for code, df in updated_data_dict.items():
+            col_index = pivot_df.columns.get_loc(code)
+            values[:, col_index] = np.nan
+            values[dates.get_indexer(df['交易日期']), col_index] = df[col].to_numpy()
+        new_pivot_dict[key] = pd.DataFrame(values, index=pivot_df.index, columns=pivot_df.columns)
+
+    return new_pivot_dict
+
+
 def make_market_pivot(market_dict):
     """
     构建市场数据的pivot透视表，便于回测计算。
@@ -1,17 +1,26 @@
 
 import time
+import traceback
 import warnings
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from core.adjust_price import add_adjusted_prices
+from core.data_store import get_candle_symbols, read_candle_df, sync_fin_store
+from core.dtype_policy import apply_dtype_policy, print_memory_report
 from core.model.backtest_config import load_config, BacktestConfig
 from core.model.strategy_config import get_col_name
 from core.utils.factor_hub import FactorHub
 from core.utils.path_kit import get_file_path
-from core.fin_essentials import merge_with_finance_data
-from core.market_essentials import transfer_to_period_data
+from core.fin_essentials import build_fin_panel, merge_with_finance_data
+from core.market_essentials import transfer_to_period_data_market
+from core.trading_calendar import load_trading_calendar
 
 # ====================================================================================================
 # ** 配置与初始化 **
@@ -29,8 +38,74 @@ FACTOR_COLS = [
     '下日_开盘涨停', '下日_是否ST', '下日_是否交易', '下日_是否退市'
 ]
 
+# 串行计算面板因子时每组股票的数量，面板数据的内存占用和这组股票的数量成正比
+PANEL_CHUNK_SIZE = 500
 
-def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data: Dict[str, pd.DataFrame] = None):
+
+def make_factor_input(candle_df, factor_file) -> pd.DataFrame:
+    """
+    构建因子计算的输入数据，只包含因子声明的 input_cols 和 fin_cols，没有声明 input_cols 时包含全部列。
+    各列和K线数据共享内存，不复制数据；数值列是只读的，因子原地修改输入数据时会报错，新的因子列可以直接添加
+
+    参数:
+    candle_df (DataFrame): 股票的K线数据
+    factor_file (FactorInterface): 因子
+
+    返回:
+    DataFrame: 因子计算的输入数据
+    """
+    if factor_file.input_cols is None:
+        cols = candle_df.columns
+    else:
+        cols = [col for col in dict.fromkeys([*factor_file.input_cols, *factor_file.fin_cols]) if col in candle_df]
+
+    input_dict = {}
+    for col in cols:
+        series = candle_df[col]
+        if isinstance(series.dtype, np.dtype):
+            values = series.to_numpy().view()
+            values.flags.writeable = False
+            input_dict[col] = values
+        else:
+            # category等扩展类型无法设置只读，复制单列数据
+            input_dict[col] = series.copy()
+    return pd.DataFrame(input_dict, index=candle_df.index, copy=False)
+
+
+def call_factor(func, stock_code, factor_name, factor_input: pd.DataFrame, *args, **kwargs):
+    """
+    调用因子的计算函数。输入数据是只读的，写入时会抛出 read-only 的ValueError，
+    这里补充出错的因子代码行以及涉及的输入列，异常类型保持不变
+
+    参数:
+    func (callable): 因子的 add_factor 或 add_factors
+    stock_code (str): 股票代码
+    factor_name (str): 因子名称
+    factor_input (DataFrame): 因子计算的输入数据，参考 make_factor_input
+    args, kwargs: 传给因子计算函数的其他参数
+
+    返回:
+    因子计算函数的返回值
+    """
+    try:
+        return func(factor_input, *args, **kwargs)
+    except ValueError as e:
+        if 'read-only' not in str(e):
+            raise
+        # 找到因子文件中出错的代码行，根据代码中引用的列名确定写入的输入列
+        factor_frames = [frame for frame in traceback.extract_tb(e.__traceback__)
+                         if Path(frame.filename).stem == factor_name]
+        location = ''
+        if factor_frames:
+            frame = factor_frames[-1]
+            cols = [col for col in factor_input.columns if f"'{col}'" in frame.line or f'"{col}"' in frame.line]
+            location = f'，第{frame.lineno}行：{frame.line}' + (f'，涉及的列：{cols}' if cols else '')
+        raise ValueError(f'{stock_code}的{factor_name}因子写入了只读的输入数据{location}。输入的K线数据和step2共享内存，'
+                         f'不能原地修改，新的因子列可以直接添加；第三方函数需要可写的数组时，请先复制对应的列') from e
+
+
+def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data: Dict[str, pd.DataFrame] = None,
+                         panel_factors: Dict[str, np.ndarray] = None):
     """
     计算指定股票的策略因子。
 
@@ -39,6 +114,7 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
     stock_code (str): 股票代码
     candle_df (DataFrame): 股票的K线数据
     fin_data (dict): 财务数据
+    panel_factors (dict): 已经通过面板计算好的因子列 -> (当前股票的因子数据, 周期转换规则)，因子数据和K线数据一一对应
 
     返回:
     DataFrame: 包含计算因子的K线数据
@@ -50,17 +126,36 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
 
     for factor_name, param_list in conf.factor_params_dict.items():
         factor_file = FactorHub.get_by_name(factor_name)
-        for param in param_list:
-            col_name = get_col_name(factor_name, param)
-            factor_df, column_dict = factor_file.add_factor(
-                candle_df.copy(), param, fin_data=fin_data, col_name=col_name)
+        col_name_dict = {param: get_col_name(factor_name, param) for param in param_list}
+        if panel_factors is not None and all(col_name in panel_factors for col_name in col_name_dict.values()):
+            # 面板因子已经对全市场一次性计算，直接使用当前股票的数据
+            for col_name in col_name_dict.values():
+                factor_series_dict[col_name], column_dict = panel_factors[col_name]
+                agg_dict.update(column_dict)
+            continue
 
+        if factor_file.is_batch:
+            # 批量因子一次性计算全部参数
+            factor_df, column_dict = call_factor(
+                factor_file.add_factors, stock_code, factor_name, make_factor_input(candle_df, factor_file), list(param_list),
+                fin_data=fin_data, col_names=list(col_name_dict.values()))
+            factor_result_list = [(param, col_name, factor_df) for param, col_name in col_name_dict.items()]
+            agg_dict.update(column_dict)
+        else:
+            factor_result_list = []
+            for param, col_name in col_name_dict.items():
+                factor_df, column_dict = call_factor(
+                    factor_file.add_factor, stock_code, factor_name, make_factor_input(candle_df, factor_file), param,
+                    fin_data=fin_data, col_name=col_name)
+                factor_result_list.append((param, col_name, factor_df))
+                agg_dict.update(column_dict)
+
+        for param, col_name, factor_df in factor_result_list:
             factor_series_dict[col_name] = factor_df[col_name].values
             # 检查因子计算是否出错
             if before_len != len(factor_series_dict[col_name]):
                 print(f'{stock_code}的{factor_name}因子({param}，{col_name})导致数据长度发生变化，请检查！')
                 raise Exception('因子计算出错，请避免在cal_factors中修改数据行数')
-            agg_dict.update(column_dict)
 
     kline_with_factor_dict = {
         **{col_name: candle_df[col_name] for col_name in FACTOR_COLS},
@@ -71,11 +166,115 @@ def cal_strategy_factors(conf: BacktestConfig, stock_code, candle_df, fin_data:
     return kline_with_factor_df, agg_dict
 
 
+def get_panel_factor_names(conf: BacktestConfig) -> List[str]:
+    """
+    获取策略中可以通过面板一次性计算的因子，即因子文件中实现了 add_panel_factor 的因子
+
+    参数:
+    conf (BacktestConfig): 回测配置
+
+    返回:
+    list: 面板因子名称
+    """
+    return [factor_name for factor_name in conf.factor_params_dict
+            if hasattr(FactorHub.get_by_name(factor_name), 'add_panel_factor')]
+
+
+def cal_panel_factors(conf: BacktestConfig, stock_code_list, factor_names):
+    """
+    构建一组股票的财务数据时点面板，对这组股票一次性计算面板因子
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_code_list (list): 股票代码，面板的列和股票代码一一对应
+    factor_names (list): 面板因子名称
+
+    返回:
+    DatetimeIndex: 面板的交易日期
+    dict: 因子列 -> (日期 x 股票 的因子数据, 周期转换规则)
+    """
+    # 面板只保留每只股票有K线的日期，和逐只股票合并财务数据的结果一致。
+    # 每只股票的K线在交易日历上是连续的，日期取这组股票的并集时，沿日期方向的计算结果和全市场面板相同
+    candle_dates = {code: read_candle_df(code, ['交易日期'])['交易日期'] for code in stock_code_list}
+    dates = pd.DatetimeIndex(np.unique(np.concatenate([date.to_numpy() for date in candle_dates.values()])))
+    fin_panel = build_fin_panel(conf.fin_cols, stock_code_list, dates, candle_dates)
+
+    panel_factor_dict = {}
+    for factor_name in factor_names:
+        factor_file = FactorHub.get_by_name(factor_name)
+        for param in conf.factor_params_dict[factor_name]:
+            col_name = get_col_name(factor_name, param)
+            panel_factor_dict[col_name] = factor_file.add_panel_factor(fin_panel, param, col_name=col_name)
+    return dates, panel_factor_dict
+
+
+def cal_symbol_factors(conf: BacktestConfig, stock_code_list, panel_factor_names=(), candle_cols=None,
+                       stock_fin_cols=(), show_progress=False):
+    """
+    计算一组股票的因子，并一次性转换为持仓周期的数据，串行和并行模式共用这个函数
+
+    参数:
+    conf (BacktestConfig): 回测配置
+    stock_code_list (list): 股票代码
+    panel_factor_names (list): 面板因子名称，只对这组股票构建面板，同一时间只有一组股票的面板数据在内存中
+    candle_cols (list): 需要读取的K线数据列，None表示读取全部列
+    stock_fin_cols (set): 需要逐只股票合并的财务数据列，为空时不合并财务数据
+    show_progress (bool): 是否显示每只股票的进度条
+
+    返回:
+    DataFrame: 这组股票的周期数据
+    dict: 因子列的周期转换规则
+    """
+    if panel_factor_names:
+        panel_dates, panel_factor_dict = cal_panel_factors(conf, stock_code_list, panel_factor_names)
+    else:
+        panel_dates, panel_factor_dict = None, None
+    factor_df_list = []  # 日线因子计算结果会存储在这个列表，全部计算完成后一次性转换周期
+    factor_col_info = dict()
+
+    # ** 注意 **
+    # `tqdm`是一个显示为进度条的，非常有用的工具
+    stock_iter = tqdm(stock_code_list, desc='计算因子') if show_progress else stock_code_list
+    for sym_idx, stock_code in enumerate(stock_iter):
+        candle_df = read_candle_df(stock_code, candle_cols)
+        if candle_cols is None:
+            # 读取全部列时，补充按需计算的复权价格列
+            candle_df = add_adjusted_prices(candle_df)
+
+        # 导入财务数据，将个股数据与财务数据合并，并计算财务指标的衍生指标
+        if stock_fin_cols:  # 前面已经做了预检，这边只需要动态台南佳即可
+            # 分别为：个股数据、财务数据、原始财务数据（不抛弃废弃的报告数据）
+            candle_df, fin_df, raw_fin_df = merge_with_finance_data(conf, stock_code, candle_df)
+            fin_data = {'财务数据': fin_df, '原始财务数据': raw_fin_df}
+        else:
+            fin_data = None
+
+        # 从面板因子中取出当前股票的数据
+        if panel_factor_dict is not None:
+            rows = panel_dates.get_indexer(candle_df['交易日期'])
+            panel_factors = {col_name: (values[rows, sym_idx], column_dict)
+                             for col_name, (values, column_dict) in panel_factor_dict.items()}
+        else:
+            panel_factors = None
+
+        # 计算因子，并且获得新的因子列的周期转换规则
+        factor_df, agg_dict = cal_strategy_factors(conf, stock_code, candle_df, fin_data=fin_data,
+                                                   panel_factors=panel_factors)
+        factor_col_info.update(agg_dict)  # 更新因子列的周期转换规则
+        factor_df_list.append(factor_df)
+
+    # 对这组股票的因子数据一次性进行交易周期转换，nD持仓周期会同时得到所有偏移的周期数据
+    calendar = load_trading_calendar(get_file_path('data', '交易日历.csv'))
+    period_df = transfer_to_period_data_market(
+        factor_df_list, conf.strategy.hold_period_name, factor_col_info, calendar=calendar)
+    return period_df, factor_col_info
+
+
 def calculate_factors(conf: BacktestConfig):
     """
     计算所有股票的因子，分为三步：
     1. 加载股票K线数据
-    2. 计算每个股票的因子，并存储到列表
+    2. 按股票分组计算因子并转换交易周期，n_jobs大于1时多进程并行
     3. 合并所有因子数据并存储
 
     参数:
@@ -93,55 +292,73 @@ def calculate_factors(conf: BacktestConfig):
         raise ValueError('请在 config.py 中配置财务数据路径')
     elif len(conf.fin_cols) > 0:
         print(f'ℹ️ 检测到财务因子：{conf.fin_cols}')
+        # 原始财务数据有变化的股票，重新整理为列式存储，之后按列读取
+        updated_symbols = sync_fin_store(conf.fin_data_path)
+        print(f'ℹ️ 财务数据整理完成，更新股票数量：{len(updated_symbols)}')
 
     print('ℹ️ 读取股票K线数据...')
-    candle_df_dict: Dict[str, pd.DataFrame] = pd.read_pickle(
-        get_file_path('data', '运行缓存', '股票预处理数据.pkl'))
+    stock_code_list = get_candle_symbols()
+    # 只读取因子声明需要的列，有因子没有声明 input_cols 时读取全部列
+    candle_cols = None if conf.input_cols is None else list(dict.fromkeys([*FACTOR_COLS, *conf.input_cols]))
 
     # ====================================================================================================
     # 2. 计算因子并存储结果
     # ====================================================================================================
-    all_factor_df_list = []  # 计算结果会存储在这个列表
-    # ** 注意 **
-    # `tqdm`是一个显示为进度条的，非常有用的工具
-    # 目前是串行模式，比较适合debug和测试。
-    # 可以用 python自带的 concurrent.futures.ProcessPoolExecutor() 并行优化，速度可以提升超过5x
-    factor_col_info = dict()
-
-    for stock_code, candle_df in tqdm(candle_df_dict.items(), desc='计算因子', total=len(candle_df_dict.keys())):
-        # 导入财务数据，将个股数据与财务数据合并，并计算财务指标的衍生指标
-        if conf.fin_cols:  # 前面已经做了预检，这边只需要动态台南佳即可
-            # 分别为：个股数据、财务数据、原始财务数据（不抛弃废弃的报告数据）
-            candle_df, fin_df, raw_fin_df = merge_with_finance_data(conf, stock_code, candle_df)
-            fin_data = {'财务数据': fin_df, '原始财务数据': raw_fin_df}
-        else:
-            fin_data = None
+    # 实现了 add_panel_factor 的因子（例如财务因子），在每组股票内部构建面板一次性计算
+    panel_factor_names = get_panel_factor_names(conf)
+    if panel_factor_names:
+        print(f'ℹ️ 面板计算因子：{panel_factor_names}')
+    # 其余因子需要的财务数据列，没有时不需要逐只股票合并财务数据
+    stock_fin_cols = set()
+    for factor_name in conf.factor_params_dict:
+        if factor_name not in panel_factor_names:
+            stock_fin_cols.update(FactorHub.get_by_name(factor_name).fin_cols)
 
-        # 计算因子，并且获得新的因子列的周期转换规则
-        factor_df, agg_dict = cal_strategy_factors(conf, stock_code, candle_df, fin_data=fin_data)
-        factor_col_info.update(agg_dict)  # 更新因子列的周期转换规则
-
-        # 对因子数据进行交易周期转换
-        period_df = transfer_to_period_data(factor_df, conf.strategy.hold_period_name, agg_dict)
-        all_factor_df_list.append(period_df)
+    # 按股票分组计算因子并转换交易周期，n_jobs大于1时每个子进程处理一组股票。
+    # 子进程直接读取列式存储中的K线数据，只传递股票代码，不需要把每只股票的DataFrame序列化后发送给子进程
+    func = partial(cal_symbol_factors, conf, panel_factor_names=panel_factor_names, candle_cols=candle_cols,
+                   stock_fin_cols=stock_fin_cols)
+    period_df_list = []
+    factor_col_info = dict()
+    if conf.n_jobs > 1 and len(stock_code_list) > 1:
+        print(f'🚀 并行计算因子，进程数：{conf.n_jobs}')
+        chunk_size = max(1, len(stock_code_list) // (conf.n_jobs * 4))
+        chunk_list = [stock_code_list[i:i + chunk_size] for i in range(0, len(stock_code_list), chunk_size)]
+        with ProcessPoolExecutor(max_workers=conf.n_jobs) as executor:
+            # map会按照输入顺序返回结果，每组股票计算完成后就可以取回
+            for period_df, agg_dict in tqdm(executor.map(func, chunk_list), desc='计算因子', total=len(chunk_list)):
+                period_df_list.append(period_df)
+                factor_col_info.update(agg_dict)
+    else:
+        # 有面板因子时串行计算也按股票分组，同一时间只有一组股票的面板数据在内存中
+        chunk_size = PANEL_CHUNK_SIZE if panel_factor_names else max(1, len(stock_code_list))
+        for i in range(0, len(stock_code_list), chunk_size):
+            period_df, agg_dict = func(stock_code_list[i:i + chunk_size], show_progress=True)
+            period_df_list.append(period_df)
+            factor_col_info.update(agg_dict)
+    all_factors_df = pd.concat(period_df_list, ignore_index=True)
+    del period_df_list
 
     # ====================================================================================================
     # 3. 合并因子数据并存储
     # ====================================================================================================
-    all_factors_df = pd.concat(all_factor_df_list, ignore_index=True)
-
     # 转化一下symbol的类型为category，可以加快因子计算速度，节省内存
-    # 并且排序和整理index
+    # 并且排序和整理index，nD持仓周期先按照周期偏移排序
+    sort_cols = ['周期偏移', '交易日期', '股票代码'] if '周期偏移' in all_factors_df.columns else ['交易日期', '股票代码']
     all_factors_df = all_factors_df.assign(
         股票代码=all_factors_df['股票代码'].astype('category'),
         股票名称=all_factors_df['股票名称'].astype('category'),
-    ).sort_values(by=['交易日期', '股票代码']).reset_index(drop=True)
+    ).sort_values(by=sort_cols).reset_index(drop=True)
+    # 按照数据类型策略压缩因子数据，减少内存和缓存文件大小
+    all_factors_df = apply_dtype_policy(all_factors_df, conf.dtype_policy, factor_col_info.keys())
     print(all_factors_df)
 
     print('💾 存储因子数据...')
     all_factors_df.to_pickle(get_file_path('data', '运行缓存', '因子计算结果.pkl'))
     pd.to_pickle(factor_col_info, get_file_path('data', '运行缓存', '策略因子列信息.pkl'))
 
+    print_memory_report('因子计算', conf.memory_budget_mb, 因子计算结果=all_factors_df)
+
     print(f'✅ 因子计算完成，耗时：{time.time() - s_time:.2f}秒\n')
 
 
@@ -3,7 +3,10 @@ import time
 import warnings
 import pandas as pd
 
+from core.data_store import load_name_history
+from core.dtype_policy import apply_dtype_policy, print_memory_report
 from core.model.backtest_config import load_config, BacktestConfig
+from core.model.strategy_config import StrategyConfig
 from core.utils.path_kit import get_file_path
 
 # ====================================================================================================
@@ -47,6 +50,7 @@ def select_stocks(conf: BacktestConfig):
     s = time.time()
     period_df = pd.read_pickle(get_file_path('data', '运行缓存', '因子计算结果.pkl'))  # 加载带有因子计算结果的数据
     factor_columns_dict = pd.read_pickle(get_file_path('data', '运行缓存', '策略因子列信息.pkl'))  # 读取策略因子列信息
+    period_df = apply_dtype_policy(period_df, conf.dtype_policy, factor_columns_dict.keys())
 
     # 过滤掉每一个周期中，没有交易的股票
     period_df = period_df[period_df['是否交易'] == 1].dropna(subset=factor_columns_dict.keys()).copy()
@@ -56,32 +60,24 @@ def select_stocks(conf: BacktestConfig):
     period_df.sort_values(by=['交易日期', '股票代码'], inplace=True)
     period_df.reset_index(drop=True, inplace=True)
 
+    # 读取股票名称变化区间表，前置筛选时用来查找周期末的名称状态
+    name_history = load_name_history()
+
     print(f'[{strategy.name}] 选股数据准备完成，耗时：{time.time() - s:.2f}s')
 
     # ====================================================================================================
-    # 3. 因子计算和筛选流程
-    # 3.1 前置筛选
-    # 3.2 计算选股因子
-    # 3.3 基于选股因子进行选股
+    # 3. 因子计算和筛选流程，nD持仓周期的每个偏移分别选股
     # ====================================================================================================
-
-    # 3.1 前置筛选
-    s = time.time()
-    period_df = strategy.filter_before_select(period_df)
-    print(f'[{strategy.name}] 前置筛选耗时：{time.time() - s:.2f}s')
-
-    # 3.2 计算选股因子
-    s = time.time()
-    result_df = strategy.calc_select_factor(period_df)
-    period_df = period_df.join(result_df)
-    print(f'[{strategy.name}] 因子计算耗时：{time.time() - s:.2f}s')
-
-    # 3.3 进行选股
-    s = time.time()
-    period_df = select_by_factor(period_df, strategy.select_num, strategy.factor_name)
-    print(f'[{strategy.name}] 选股耗时：{time.time() - s:.2f}s')
-
-    select_result_df = period_df[[*FACTOR_COLS, '目标资金占比']].copy()
+    if '周期偏移' in period_df.columns:
+        offset_result_list = []
+        for offset, offset_df in period_df.groupby('周期偏移'):
+            print(f'[{strategy.name}] 周期偏移：{offset}')
+            offset_result_list.append(select_period_stocks(strategy, offset_df.reset_index(drop=True), name_history))
+        period_df = pd.concat(offset_result_list, ignore_index=True)
+        select_result_df = period_df[[*FACTOR_COLS, '周期偏移', '目标资金占比']].copy()
+    else:
+        period_df = select_period_stocks(strategy, period_df, name_history)
+        select_result_df = period_df[[*FACTOR_COLS, '目标资金占比']].copy()
 
     # 若无选股结果则直接返回
     if select_result_df.empty:
@@ -90,17 +86,53 @@ def select_stocks(conf: BacktestConfig):
     # ====================================================================================================
     # 4. 缓存选股结果
     # ====================================================================================================
+    s = time.time()
     file_path = conf.get_result_folder() / f'{strategy.name}选股结果.pkl'
     select_result_df.to_pickle(file_path)
     select_result_df.to_csv(conf.get_result_folder() / f'{strategy.name}选股结果.csv', encoding='utf-8-sig')
 
     print(f'[{strategy.name}] 选股结果已保存，耗时: {(time.time() - s):.2f}s')
     print(f'💾 选股结果数据大小：{select_result_df.memory_usage(deep=True).sum() / 1024 / 1024:.4f} MB\n')
+    print_memory_report('选股', conf.memory_budget_mb, 选股数据=period_df)
     print(f'✅ 选股完成，总耗时：{time.time() - s_time:.3f}秒\n')
 
     return select_result_df
 
 
+def select_period_stocks(strategy: StrategyConfig, period_df, name_history):
+    """
+    对周期数据进行因子计算和筛选：
+    1. 前置筛选
+    2. 计算选股因子
+    3. 基于选股因子进行选股
+
+    参数:
+    strategy (StrategyConfig): 策略配置
+    period_df (DataFrame): 选股数据
+    name_history (DataFrame): 股票名称变化区间表
+
+    返回:
+    DataFrame: 带目标资金占比的选股结果
+    """
+    # 1. 前置筛选
+    s = time.time()
+    period_df = strategy.filter_before_select(period_df, name_history)
+    print(f'[{strategy.name}] 前置筛选耗时：{time.time() - s:.2f}s')
+
+    # 2. 计算选股因子
+    s = time.time()
+    result_df = strategy.calc_select_factor(period_df)
+    period_df = period_df.join(result_df)
+    print(f'[{strategy.name}] 因子计算耗时：{time.time() - s:.2f}s')
+
+    # 3. 进行选股
+    s = time.time()
+    period_df = select_by_factor(period_df, strategy.select_num, strategy.factor_name)
+    print(f'[{strategy.name}] 选股耗时：{time.time() - s:.2f}s')
+
+    return period_df
+
+
 def select_by_factor(period_df, select_num: float | int, factor_name):
     """
     基于因子选择目标股票并计算资金权重。
@@ -2,11 +2,14 @@
 import time
 import warnings
 
+import numpy as np
 import pandas as pd
 
+from core.data_store import load_market_panel
 from core.equity import calc_equity, show_plot_performance
 from core.model.backtest_config import BacktestConfig, load_config
 from core.model.timing_signal import EquityTiming
+from core.trading_calendar import load_trading_calendar
 from core.utils.path_kit import get_file_path
 
 # ====================================================================================================
@@ -31,7 +34,7 @@ def save_performance_df_csv(conf: BacktestConfig, **kwargs):
 # 2. 进行动态杠杆再择时的回测模拟
 # 3. 保存结果
 # ====================================================================================================
-def simu_equity_timing(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ratio: pd.DataFrame):
+def simu_equity_timing(conf: BacktestConfig, market_panel: dict, df_stock_ratio: pd.DataFrame):
     """
     动态杠杆再择时模拟
     :param conf: 回测配置
@@ -53,7 +56,8 @@ def simu_equity_timing(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ra
     # 将equity_signals的index设置为交易日期
     equity_signal.index = pd.to_datetime(account_df["交易日期"])
     # 对每个换仓日期，找到对应的动态杠杆值并相乘
-    df_stock_ratio = df_stock_ratio.mul(equity_signal.reindex(df_stock_ratio.index), axis=0)
+    # nD持仓周期的每个偏移都使用同一个交易日的动态杠杆
+    df_stock_ratio = df_stock_ratio.mul(equity_signal.reindex(df_stock_ratio.index.get_level_values(-1)).to_numpy(), axis=0)
 
     # 记录时间，用于后续动态杠杆再择时的耗时统计
     s_time = time.time()
@@ -63,7 +67,7 @@ def simu_equity_timing(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ra
     # - 使用动态杠杆调整后的持仓计算资金曲线
     # - 包括现货和合约的比例数据
     # - 计算回测的总体收益、年度收益、季度收益和月度收益
-    account_df, rtn, year_return, month_return, quarter_return = calc_equity(conf, pivot_dict_stock, df_stock_ratio)
+    account_df, rtn, year_return, month_return, quarter_return = calc_equity(conf, market_panel, df_stock_ratio)
 
     # 保存回测结果，包括再择时后的资金曲线和收益评价指标
     save_performance_df_csv(
@@ -81,6 +85,29 @@ def simu_equity_timing(conf: BacktestConfig, pivot_dict_stock: dict, df_stock_ra
     return account_df, rtn, year_return
 
 
+def get_rebalance_dates(conf: BacktestConfig, index_data: pd.DataFrame):
+    """
+    获取换仓日期：每个持仓周期的最后一个交易日
+    :param conf: 回测配置
+    :param index_data: 合并交易日历之后的指数数据
+    :return: 换仓日期，nD持仓周期返回 (周期偏移, 交易日期) 的MultiIndex
+    """
+    strategy = conf.strategy
+    if strategy.period_type != "D":
+        return index_data.groupby(f"{strategy.hold_period_name}起始日")["交易日期"].last()
+
+    # nD持仓周期：根据交易日历计算每个偏移的周期，每个偏移都有自己的换仓日期
+    calendar = load_trading_calendar(get_file_path("data", "交易日历.csv"))
+    ordinals = calendar.get_ordinals(index_data["交易日期"])
+    offset_dates_list = []
+    for offset in strategy.period_offsets:
+        period_ids = calendar.get_period_ids(strategy.hold_period, offset)[ordinals]
+        offset_dates = index_data.groupby(period_ids)["交易日期"].last()
+        offset_dates_list.append(pd.MultiIndex.from_arrays(
+            [np.full(len(offset_dates), offset), offset_dates.values], names=["周期偏移", "交易日期"]))
+    return offset_dates_list[0].append(offset_dates_list[1:])
+
+
 def simulate_performance(conf: BacktestConfig, select_results, show_plot=True):
     """
     模拟投资组合的表现，生成资金曲线以跟踪组合收益变化。
@@ -98,23 +125,27 @@ def simulate_performance(conf: BacktestConfig, select_results, show_plot=True):
     # ====================================================================================================
     s_time = time.time()
     print("🌀 开始权重聚合...")
-    df_stock_ratio = select_results.pivot(index="交易日期", columns="股票代码", values="目标资金占比").fillna(0)
+    # nD持仓周期的选股结果包含周期偏移，每个偏移的权重分别聚合
+    ratio_index = ["周期偏移", "交易日期"] if "周期偏移" in select_results.columns else "交易日期"
+    df_stock_ratio = select_results.pivot(index=ratio_index, columns="股票代码", values="目标资金占比").fillna(0)
     print(f"✅ 权重聚合完成，耗时：{time.time() - s_time:.3f}秒\n")
 
     # ====================================================================================================
     # 2. 对数据进行处理
     # ====================================================================================================
-    pivot_dict_stock = pd.read_pickle(get_file_path("data", "运行缓存", "全部股票行情pivot.pkl"))
+    # 行情面板通过内存映射读取，不需要整体加载到内存
+    market_panel = load_market_panel()
 
     # 确定回测区间
-    data_date_max = f"{df_stock_ratio.index.max().date()}"
-    conf.start_date = max(conf.start_date, f"{df_stock_ratio.index.min().date()}")
+    ratio_dates = df_stock_ratio.index.get_level_values(-1)
+    data_date_max = f"{ratio_dates.max().date()}"
+    conf.start_date = max(conf.start_date, f"{ratio_dates.min().date()}")
     conf.end_date = min(conf.end_date or data_date_max, data_date_max)
     print("🗓️ 回测区间:", conf.start_date, conf.end_date)
 
     # 获取换仓日历
     index_data = conf.read_index_with_trading_date()
-    rebalance_dates = index_data.groupby(f"{conf.strategy.hold_period_name}起始日")["交易日期"].last()
+    rebalance_dates = get_rebalance_dates(conf, index_data)
 
     # 对于交易日可能为空的周期进行重新填充
     df_stock_ratio = df_stock_ratio.reindex(rebalance_dates, fill_value=0)
@@ -125,7 +156,7 @@ def simulate_performance(conf: BacktestConfig, select_results, show_plot=True):
     # ====================================================================================================
     print(f"🌀 开始模拟日线交易，回溯 {len(df_stock_ratio):,} 天...")
     # 计算资金曲线及收益数据
-    account_df, rtn, year_return, month_return, quarter_return = calc_equity(conf, pivot_dict_stock, df_stock_ratio)
+    account_df, rtn, year_return, month_return, quarter_return = calc_equity(conf, market_panel, df_stock_ratio)
 
     # - 保存计算出的资金曲线、策略评价、年度、季度和月度的收益数据
     save_performance_df_csv(
@@ -143,7 +174,7 @@ def simulate_performance(conf: BacktestConfig, select_results, show_plot=True):
     if has_equity_signal:
         print(f"🌀 开始计算资金曲线再择时...")
         # 进行再择时回测，计算动态杠杆后的资金曲线和收益指标
-        account_df2, rtn2, year_return2 = simu_equity_timing(conf, pivot_dict_stock, df_stock_ratio)
+        account_df2, rtn2, year_return2 = simu_equity_timing(conf, market_panel, df_stock_ratio)
 
         # 可选：绘制再择时的资金曲线图表
         if show_plot:
@@ -0,0 +1,92 @@
+"""
+get_last_quarter_and_year_index 和 mark_old_report 的结果必须和原来的逐行循环实现完全一致
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.fin_essentials import (get_last_quarter_and_year_index, get_last_quarter_and_year_index_by_loop,
+                                 mark_old_report)
+
+
+def mark_old_report_by_loop(date_list):
+    """
+    原始实现：之前已经有比当前更新的财报时，当前财报标记为1
+    """
+    date_list = date_list.tolist()
+    res = []
+    for index, date in enumerate(date_list):
+        flag = 0
+        for i in sorted(range(index), reverse=True):
+            if date_list[i] > date:
+                flag = 1
+                break
+        res.append(flag)
+    return res
+
+
+def random_quarter_ends(seed, n=60, shuffle=0.0, nat=0.0) -> pd.Series:
+    """
+    随机的季度末财报日期：有缺失的季度、重复的季度，shuffle 为打乱顺序的比例，nat 为空日期的比例
+    """
+    rng = np.random.default_rng(seed)
+    quarter_ends = pd.date_range('2005-03-31', '2024-12-31', freq='QE')
+    start = rng.integers(0, len(quarter_ends) - n // 2)
+    steps = rng.choice([0, 1, 1, 1, 1, 2, 4], n)  # 0为重复发布，2、4为缺失的季度
+    positions = np.minimum(start + np.cumsum(steps), len(quarter_ends) - 1)
+    dates = pd.Series(quarter_ends[positions])
+    # 打乱一部分行的顺序，模拟先发布季报、后更新年报
+    swap = np.flatnonzero(rng.random(n) < shuffle)
+    dates.iloc[swap] = dates.iloc[rng.permutation(swap)].to_numpy()
+    dates[rng.random(n) < nat] = pd.NaT
+    return dates
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_sorted_quarter_ends(seed):
+    dates = random_quarter_ends(seed)
+    assert get_last_quarter_and_year_index(dates) == get_last_quarter_and_year_index_by_loop(dates)
+    assert mark_old_report(dates) == mark_old_report_by_loop(dates)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_unsorted_quarter_ends(seed):
+    dates = random_quarter_ends(seed, shuffle=0.3)
+    assert get_last_quarter_and_year_index(dates) == get_last_quarter_and_year_index_by_loop(dates)
+    assert mark_old_report(dates) == mark_old_report_by_loop(dates)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_nat_dates(seed):
+    """
+    空日期和任何日期比较都不成立，不会被标记为旧财报，也不会影响之后的财报
+    """
+    dates = random_quarter_ends(seed, shuffle=0.3, nat=0.2)
+    assert mark_old_report(dates) == mark_old_report_by_loop(dates)
+
+
+def test_nat_dates_fall_back_to_loop():
+    """
+    有空日期时不使用按季度编号的查找，和逐行循环的行为一致
+    """
+    dates = random_quarter_ends(0, nat=0.2)
+    with pytest.raises(ValueError):
+        get_last_quarter_and_year_index_by_loop(dates)
+    with pytest.raises(ValueError):
+        get_last_quarter_and_year_index(dates)
+
+
+def test_not_quarter_end():
+    """
+    财报日期不是季度末时逐行查找
+    """
+    dates = pd.Series(pd.to_datetime(['2019-03-31', '2019-06-28', '2019-09-30', '2019-12-31', '2020-03-31',
+                                      '2020-06-30', '2020-07-15']))
+    assert get_last_quarter_and_year_index(dates) == get_last_quarter_and_year_index_by_loop(dates)
+    assert mark_old_report(dates) == mark_old_report_by_loop(dates)
+
+
+def test_single_report():
+    dates = pd.Series(pd.to_datetime(['2020-03-31']))
+    assert get_last_quarter_and_year_index(dates) == get_last_quarter_and_year_index_by_loop(dates)
+    assert mark_old_report(dates) == [0]
@@ -0,0 +1,107 @@
+"""
+merge_with_index_data 的结果必须和 pd.merge 合并的 merge_with_index_data_by_merge 完全一致
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.market_essentials import merge_with_index_data, merge_with_index_data_by_merge
+
+PRICE_COLS = ['开盘价', '最高价', '最低价', '收盘价', '均价', '前收盘价']
+
+
+def make_index_data(n=300) -> pd.DataFrame:
+    dates = pd.bdate_range('2020-01-01', periods=n)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        '交易日期': dates,
+        '指数涨跌幅': rng.normal(0, 0.01, n),
+        '下日_是否交易': np.ones(n, dtype=np.int64),
+    })
+
+
+def make_stock_df(index_data, seed, keep_ratio=0.7, nan_ratio=0.0, outside=0, adjusted=False) -> pd.DataFrame:
+    """
+    从指数的交易日中随机抽取一部分作为股票的交易日，模拟上市前、停牌和退市，outside 为不在指数数据中的日期数量
+    """
+    rng = np.random.default_rng(seed)
+    index_dates = index_data['交易日期'].to_numpy()
+    start, stop = sorted(rng.integers(0, len(index_dates), 2))
+    dates = index_dates[start:stop + 1]
+    dates = dates[rng.random(len(dates)) < keep_ratio]
+    if outside:
+        # 周末以及指数数据范围之外的日期
+        extra = pd.to_datetime(['2019-12-28', '2019-12-29']).append(
+            pd.to_datetime(index_dates[-1]) + pd.to_timedelta(np.arange(1, outside + 1), 'D'))
+        dates = np.sort(np.concatenate([dates, rng.choice(extra.to_numpy(), outside, replace=False)]))
+    n = len(dates)
+
+    close = np.round(rng.uniform(5, 50, n), 2)
+    df = pd.DataFrame({'交易日期': dates, '股票代码': 'sz000001', '股票名称': '平安银行'})
+    for col in PRICE_COLS:
+        df[col] = np.round(close * rng.uniform(0.95, 1.05, n), 2)
+    df['收盘价'] = close
+    for col in ['成交量', '成交额', '涨跌幅', '换手率', '流通市值']:
+        df[col] = rng.uniform(0, 1e6, n)
+    if adjusted:
+        for col in ['开盘价', '最高价', '最低价', '收盘价']:
+            df[f'{col}_复权'] = df[col] * 1.5
+    # 其他类型的列
+    df['上市天数'] = np.arange(n, dtype=np.int64)
+    df['是否ST'] = rng.random(n) < 0.5
+    df['行业'] = pd.Categorical(rng.choice(['银行', '证券', '保险'], n))
+    df['备注'] = rng.choice(['a', 'b'], n).astype(object)
+
+    if nan_ratio:
+        for col in [*PRICE_COLS, '成交额', '流通市值', '备注']:
+            df.loc[rng.random(n) < nan_ratio, col] = np.nan
+    return df
+
+
+def assert_same_as_merge(df, index_data, fill_0_list=('换手率',)):
+    result = merge_with_index_data(df.copy(), index_data.copy(), fill_0_list=list(fill_0_list))
+    expected = merge_with_index_data_by_merge(df.copy(), index_data.copy(), fill_0_list=list(fill_0_list))
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_stock_with_gaps(seed):
+    index_data = make_index_data()
+    assert_same_as_merge(make_stock_df(index_data, seed), index_data)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_stock_with_nan(seed):
+    index_data = make_index_data()
+    assert_same_as_merge(make_stock_df(index_data, seed, nan_ratio=0.2, adjusted=True), index_data)
+
+
+def test_no_gaps():
+    """
+    每天都有交易时，整数列和布尔列保持原来的类型
+    """
+    index_data = make_index_data()
+    df = make_stock_df(index_data, 0, keep_ratio=1.0)
+    assert_same_as_merge(df, index_data)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rows_outside_calendar(seed):
+    """
+    不在指数数据中的日期（周末、指数范围之后）不参与合并
+    """
+    index_data = make_index_data()
+    assert_same_as_merge(make_stock_df(index_data, seed, outside=3, nan_ratio=0.1), index_data)
+
+
+def test_delisted_before_index():
+    """
+    股票的数据全部在指数数据开始之前，合并之后为空
+    """
+    index_data = make_index_data()
+    df = make_stock_df(index_data, 0)
+    df['交易日期'] = pd.to_datetime('2010-01-01') + pd.to_timedelta(np.arange(len(df)), 'D')
+    result = merge_with_index_data(df.copy(), index_data.copy(), fill_0_list=['换手率'])
+    expected = merge_with_index_data_by_merge(df.copy(), index_data.copy(), fill_0_list=['换手率'])
+    assert result.empty and expected.empty
+    assert list(result.columns) == list(expected.columns)
@@ -0,0 +1,50 @@
+"""
+rolling_std_batch 的结果必须和 pandas rolling().std() 完全一致（逐位比较）
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.rolling_window import rolling_std_batch
+
+WINDOWS = [2, 5, 20, 60, 250]
+
+
+def make_amount(seed, n=3000) -> np.ndarray:
+    """
+    模拟成交额：量级随时间变化，包含停牌的0、空值以及连续相同的值
+    """
+    rng = np.random.default_rng(seed)
+    values = np.exp(rng.normal(18, 1.5, n)) * np.linspace(0.1, 10, n)
+    values[rng.random(n) < 0.03] = 0.0
+    values[rng.random(n) < 0.02] = np.nan
+    values[:rng.integers(0, 50)] = np.nan
+    start = rng.integers(0, n - 300)
+    values[start:start + rng.integers(1, 300)] = values[start]
+    return values
+
+
+def assert_same_as_pandas(values, windows, min_periods=None):
+    result = rolling_std_batch(values, windows, min_periods)
+    for window in windows:
+        expected = pd.Series(values).rolling(window, min_periods=min_periods).std().to_numpy()
+        np.testing.assert_array_equal(result[window].view(np.int64), expected.view(np.int64))
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_amount(seed):
+    assert_same_as_pandas(make_amount(seed), WINDOWS)
+
+
+@pytest.mark.parametrize('min_periods', [0, 1, 3])
+def test_min_periods(min_periods):
+    assert_same_as_pandas(make_amount(0), [window for window in WINDOWS if window >= min_periods], min_periods)
+
+
+def test_constant_and_short():
+    """
+    窗口内的有效值全部相同时标准差为0，数据比窗口短时全部为空值
+    """
+    assert_same_as_pandas(np.r_[np.full(30, 3.3), np.nan, np.full(30, 3.3), 1e12, np.full(30, 0.1)], WINDOWS)
+    assert_same_as_pandas(np.array([1.0, np.nan, 2.0]), WINDOWS)
+    assert_same_as_pandas(np.array([], dtype=np.float64), WINDOWS)
@@ -0,0 +1,112 @@
+"""
+cal_zdt_price 的涨跌停价格必须和原来基于 Decimal 逐行舍入的结果完全一致（逐位比较）
+"""
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.market_essentials import cal_zdt_price
+
+# 覆盖各个板块：上交所主板、科创板、深交所主板、中小板、创业板（300、301）、北交所
+CODES = ['sh600000', 'sh688001', 'sz000001', 'sz002001', 'sz300001', 'sz301001', 'bj830001']
+
+# 普通股票和各种特殊名称
+NAMES = ['平安银行', 'ST平安', '*ST平安', 'S深发', 'S*ST退']
+
+# 创业板新规前后
+DATES = pd.to_datetime(['2015-06-01', '2020-08-21', '2020-08-24', '2024-01-02'])
+
+# 创业板涨跌幅新规的前一天
+CHINEXT_REFORM_DATE = pd.to_datetime('2020-08-23')
+
+
+def cal_zdt_price_decimal(code, name, date, pre_close):
+    """
+    原始实现的逐行版本：按照规则计算比例后，用 Decimal 四舍五入到分，北交所向下截断到分
+    """
+    if code.startswith('bj'):
+        up, down = pre_close * 1.3, pre_close * 0.7
+        return (float(Decimal(up).quantize(Decimal('0.00'), rounding=ROUND_DOWN)),
+                float(Decimal(down).quantize(Decimal('0.00'), rounding=ROUND_DOWN)))
+
+    if 'sh68' in code or (date > CHINEXT_REFORM_DATE and 'sz3' in code):
+        up, down = pre_close * 1.2, pre_close * 0.8
+    elif 'ST' in name:
+        up, down = pre_close * 1.05, pre_close * 0.95
+    else:
+        up, down = pre_close * 1.1, pre_close * 0.9
+    return (float(Decimal(up + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP)),
+            float(Decimal(down + 1e-7).quantize(Decimal('1.00'), ROUND_HALF_UP)))
+
+
+def make_candle_df(pre_close, codes, names, dates) -> pd.DataFrame:
+    df = pd.DataFrame({'交易日期': dates, '股票代码': codes, '股票名称': names, '前收盘价': pre_close})
+    for col in ['开盘价', '最高价', '最低价']:
+        df[col] = df['前收盘价']
+    return df
+
+
+def assert_same_as_decimal(df):
+    result = cal_zdt_price(df.copy())
+    expected = np.array([
+        cal_zdt_price_decimal(code, name, date, pre_close)
+        for code, name, date, pre_close in zip(df['股票代码'].tolist(), df['股票名称'].tolist(),
+                                               df['交易日期'].tolist(), df['前收盘价'].tolist())
+    ]).reshape(-1, 2)
+    # 逐位比较，0.1 + 0.2 这类只差最后一位的结果也会被发现
+    np.testing.assert_array_equal(result['涨停价'].to_numpy().view(np.int64), expected[:, 0].view(np.int64))
+    np.testing.assert_array_equal(result['跌停价'].to_numpy().view(np.int64), expected[:, 1].view(np.int64))
+
+
+@pytest.mark.parametrize('code', CODES)
+@pytest.mark.parametrize('name', NAMES)
+@pytest.mark.parametrize('date', DATES)
+def test_every_cent_price(code, name, date):
+    """
+    0.01 ~ 100.00 的每一个前收盘价，乘以涨跌幅比例后会落在所有可能的分以及半分位置上
+    """
+    pre_close = np.arange(1, 10001) / 100
+    n = len(pre_close)
+    assert_same_as_decimal(make_candle_df(pre_close, [code] * n, [name] * n, [date] * n))
+
+
+def test_half_cent_edges():
+    """
+    理论值恰好在半分位置（例如 10.05 * 1.1 = 11.055）的前收盘价，浮点误差可能落在半分的任意一侧
+    """
+    pre_close = []
+    for ratio in [1.1, 0.9, 1.05, 0.95, 1.2, 0.8, 1.3, 0.7]:
+        for cents in range(1, 20001):
+            price = Decimal(cents) / 100
+            if (price * Decimal(str(ratio)) * 1000) % 10 == 5:
+                pre_close.append(float(price))
+    pre_close = np.array(pre_close)
+    n = len(pre_close)
+    rng = np.random.default_rng(0)
+    assert_same_as_decimal(make_candle_df(
+        pre_close, rng.choice(CODES, n), rng.choice(NAMES, n), rng.choice(DATES, n)))
+
+
+def test_random_history():
+    """
+    随机的价格、板块、名称以及2010年以来的日期，价格包含不在分上的数值和空值
+    """
+    rng = np.random.default_rng(1)
+    n = 100000
+    pre_close = np.concatenate([np.round(rng.uniform(0.01, 3000, n // 2), 2), rng.uniform(0, 50, n // 2)])
+    dates = pd.to_datetime('2010-01-01') + pd.to_timedelta(rng.integers(0, 5500, n), 'D')
+    df = make_candle_df(pre_close, rng.choice(CODES, n), rng.choice(NAMES, n), dates)
+    assert_same_as_decimal(df)
+
+
+def test_nan_pre_close():
+    """
+    没有前收盘价时，涨跌停价格为空值
+    """
+    df = make_candle_df(np.array([np.nan, 10.0]), ['sz000001', 'bj830001'], ['平安银行'] * 2, [DATES[0]] * 2)
+    df.loc[1, '前收盘价'] = np.nan
+    result = cal_zdt_price(df)
+    assert result['涨停价'].isna().all()
+    assert result['跌停价'].isna().all()
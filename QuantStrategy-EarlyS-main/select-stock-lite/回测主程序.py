@@ -4,6 +4,7 @@ import pandas as pd
 
 # 导入回测配置和模块
 from core.model.backtest_config import load_config
+from core.pipeline_cache import PipelineCache
 from program.step1_整理数据 import prepare_data
 from program.step2_计算因子 import calculate_factors
 from program.step3_选股 import select_stocks
@@ -38,26 +39,45 @@ if __name__ == "__main__":
     # 加载回测配置
     conf = load_config()
 
+    # 流水线缓存：上游的数据、配置和代码都没有变化时，直接复用上次的结果
+    pipeline_cache = PipelineCache(conf) if conf.use_pipeline_cache else None
+
     # ====================================================================================================
     # 1. 数据准备
     # ====================================================================================================
     # 调用数据准备函数，加载并预处理回测所需的数据
     print("-" * 36, "准备数据", "-" * 36)
-    prepare_data(conf)
+    if pipeline_cache and pipeline_cache.is_fresh(1):
+        print("♻️ 数据没有变化，复用上次准备的数据\n")
+    else:
+        prepare_data(conf)
+        if pipeline_cache:
+            pipeline_cache.mark_done(1)
 
     # ====================================================================================================
     # 2. 因子计算
     # ====================================================================================================
     # 根据配置文件计算策略因子和过滤因子
     print("-" * 36, "因子计算", "-" * 36)
-    calculate_factors(conf)
+    if pipeline_cache and pipeline_cache.is_fresh(2):
+        print("♻️ 数据和因子配置没有变化，复用上次的因子计算结果\n")
+    else:
+        calculate_factors(conf)
+        if pipeline_cache:
+            pipeline_cache.mark_done(2)
 
     # ====================================================================================================
     # 3. 选股
     # ====================================================================================================
     # 根据计算得到的因子进行选股
     print("-" * 36, "条件选股", "-" * 36)
-    select_results = select_stocks(conf)
+    if pipeline_cache and pipeline_cache.is_fresh(3):
+        print("♻️ 因子和选股配置没有变化，复用上次的选股结果\n")
+        select_results = pd.read_pickle(conf.get_result_folder() / f"{conf.strategy.name}选股结果.pkl")
+    else:
+        select_results = select_stocks(conf)
+        if pipeline_cache:
+            pipeline_cache.mark_done(3)
 
     # ====================================================================================================
     # 4. 实盘模拟
@@ -1,9 +1,11 @@
 import pandas as pd
 import talib
 
+input_cols = ['收盘价']  # 因子计算需要的K线数据列，配置后系统只会读取这些列
+
+
 def add_factor(df: pd.DataFrame, param=None, fin_data=None, col_name="macd_hist"):
-    df = df.copy()
     close = df['收盘价'].astype(float)
     macd, signal, hist = talib.MACD(close, fastperiod=12, slowperiod=26, signalperiod=9)
     df[col_name] = hist
-    return df, {col_name: 'last'}
+    return df[[col_name]], {col_name: 'last'}
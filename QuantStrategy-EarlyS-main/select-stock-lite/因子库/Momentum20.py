@@ -1,6 +1,8 @@
 import pandas as pd
 
+input_cols = ['收盘价']  # 因子计算需要的K线数据列，配置后系统只会读取这些列
+
+
 def add_factor(df: pd.DataFrame, param=None, fin_data=None, col_name="momentum"):
-    df = df.copy()
     df[col_name] = df['收盘价'] / df['收盘价'].shift(20) - 1
-    return df, {col_name: 'last'}
+    return df[[col_name]], {col_name: 'last'}
@@ -1,8 +1,29 @@
 
+import numpy as np
 import pandas as pd
 
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = ['R_np_atoopc@xbx_单季', 'B_total_equity_atoopc@xbx', 'R_np_atoopc@xbx_ttm']  # 财务因子列，配置后系统会自动加载对应的财务数据
+input_cols = []  # 因子计算需要的K线数据列，配置后系统只会读取这些列
+
+# 参数 -> 净利润字段，add_factor 和 add_panel_factor 共用
+# - R_np_atoopc@xbx_ttm:利润表的归属于母公司所有者的净利润ttm
+# - R_np_atoopc@xbx_单季:利润表的归属于母公司所有者的净利润单季度
+PROFIT_COLS = {
+    '全年': 'R_np_atoopc@xbx_ttm',
+    '单季': 'R_np_atoopc@xbx_单季'
+}
+
+
+def get_profit_col(param):
+    """
+    根据param选择相应的净利润字段
+    :param param: 因子参数，'全年' 或 '单季'
+    :return: 净利润字段
+    """
+    if param not in PROFIT_COLS:
+        raise ValueError(f"ROE因子不支持的参数值：{param}")
+    return PROFIT_COLS[param]
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -33,19 +54,8 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
     # 从kwargs中提取因子列的名称，这里使用'col_name'来标识因子列名称
     col_name = kwargs['col_name']
 
-    # 净利润相关字段说明
-    # - R_np_atoopc@xbx_ttm:利润表的归属于母公司所有者的净利润ttm
-    # - R_np_atoopc@xbx_单季:利润表的归属于母公司所有者的净利润单季度
-    profit_cols = {
-        '全年': 'R_np_atoopc@xbx_ttm',
-        '单季': 'R_np_atoopc@xbx_单季'
-    }
-
-    # 根据param选择相应的净利润字段
-    if param not in profit_cols:
-        raise ValueError(f"ROE因子不支持的参数值：{param}")
-    else:
-        profit_col = profit_cols[param]
+    # 根据param选择相应的净利润字段，参考 PROFIT_COLS
+    profit_col = get_profit_col(param)
 
     # ======================== 计算因子 ===========================
     # ROE：净资产收益率 = 净利润 / 净资产
@@ -65,3 +75,21 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # 返回新计算的因子列以及因子聚合方式
     return df[[col_name]], agg_rules
+
+
+def add_panel_factor(panel: dict, param=None, **kwargs) -> (np.ndarray, dict):
+    """
+    对面板中的一组股票一次性计算因子，结果和逐只股票的 add_factor 一致。
+
+    :param panel: dict，财务数据的时点面板，每个财务因子列是一个 日期 x 股票 的二维数组，参考 build_fin_panel。
+    :param param: 因子计算所需的参数，和 add_factor 相同。
+    :param kwargs: 其他关键字参数，包括 col_name：新计算的因子列名。
+    :return: tuple
+        - np.ndarray: 日期 x 股票 的因子数据。
+        - dict: 聚合方式字典。
+    """
+    col_name = kwargs['col_name']
+
+    factor_values = panel[get_profit_col(param)] / panel['B_total_equity_atoopc@xbx']
+
+    return factor_values, {col_name: 'last'}
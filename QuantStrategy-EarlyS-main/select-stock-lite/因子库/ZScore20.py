@@ -1,6 +1,8 @@
 import pandas as pd
 
+input_cols = ['收盘价']  # 因子计算需要的K线数据列，配置后系统只会读取这些列
+
+
 def add_factor(df: pd.DataFrame, param=None, fin_data=None, col_name="zscore"):
-    df = df.copy()
     df[col_name] = (df['收盘价'] - df['收盘价'].rolling(20).mean()) / df['收盘价'].rolling(20).std()
-    return df, {col_name: 'last'}  # 'last' 表示对周期转换采用“最后一个”值
+    return df[[col_name]], {col_name: 'last'}  # 'last' 表示对周期转换采用“最后一个”值
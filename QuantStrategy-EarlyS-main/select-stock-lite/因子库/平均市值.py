@@ -1,8 +1,11 @@
 
 import pandas as pd
 
+from core.rolling_window import rolling_mean_batch
+
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = []  # 财务因子列，配置后系统会自动加载对应的财务数据
+input_cols = ['总市值']  # 因子计算需要的K线数据列，配置后系统只会读取这些列
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -51,3 +54,23 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # 返回新计算的因子列以及因子聚合方式
     return df[[col_name]], agg_rules
+
+
+def add_factors(df: pd.DataFrame, params=(), **kwargs) -> (pd.DataFrame, dict):
+    """
+    一次性计算多个参数下的因子，所有窗口共享总市值的前缀和。
+    数值和逐个参数调用 add_factor 一致，差别只在于 pandas 逐行增减数据时累积的浮点误差。
+
+    :param df: pd.DataFrame，包含单只股票的K线数据。
+    :param params: 全部的滚动窗口参数。
+    :param kwargs: 其他关键字参数，包括 col_names：和 params 一一对应的因子列名。
+    :return: tuple
+        - pd.DataFrame: 包含全部因子列。
+        - dict: 聚合方式字典。
+    """
+    col_names = kwargs['col_names']
+    windows = [int(param) for param in params]  # 将参数转换为整数
+    mean_dict = rolling_mean_batch(df['总市值'].to_numpy(), windows, min_periods=1)
+
+    factor_df = pd.DataFrame({col_name: mean_dict[n] for col_name, n in zip(col_names, windows)}, index=df.index)
+    return factor_df, {col_name: 'last' for col_name in col_names}
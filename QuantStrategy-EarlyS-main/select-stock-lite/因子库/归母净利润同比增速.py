@@ -1,8 +1,28 @@
 
+import numpy as np
 import pandas as pd
 
+from core.panel_essentials import shift_axis0
+
 # 财务因子列：此列表用于存储财务因子相关的列名称
 fin_cols = ['R_np_atoopc@xbx_单季同比']  # 财务因子列，配置后系统会自动加载对应的财务数据
+input_cols = []  # 因子计算需要的K线数据列，配置后系统只会读取这些列
+
+# 滚动周期数的下限，add_factor 和 add_panel_factor 共用
+MIN_PERIODS = 60
+
+
+def get_periods(param):
+    """
+    解析滚动周期数，小于 MIN_PERIODS 时重置为 MIN_PERIODS
+    :param param: 因子参数
+    :return: 滚动周期数
+    """
+    n = int(param)
+    if n < MIN_PERIODS:
+        print(f'⚠️ 滚动周期数{n}小于{MIN_PERIODS}，计算结果可能不准确，已经被重置为{MIN_PERIODS}')
+        n = MIN_PERIODS
+    return n
 
 
 def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
@@ -32,10 +52,7 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
     # ======================== 参数处理 ===========================
     # 从kwargs中提取因子列的名称，这里使用'col_name'来标识因子列名称
     col_name = kwargs['col_name']
-    n = int(param)  # 滚动周期数，用于归母净利润同比增速计算
-    if n < 60:
-        print(f'⚠️ 滚动周期数{n}小于60，计算结果可能不准确，已经被重置为60')
-        n = 60
+    n = get_periods(param)  # 滚动周期数，用于归母净利润同比增速计算
 
     # ======================== 计算因子 ===========================
     # 计算归母净利润同比增速
@@ -54,3 +71,24 @@ def add_factor(df: pd.DataFrame, param=None, **kwargs) -> (pd.DataFrame, dict):
 
     # 返回新计算的因子列以及因子聚合方式
     return df[[col_name]], agg_rules
+
+
+def add_panel_factor(panel: dict, param=None, **kwargs) -> (np.ndarray, dict):
+    """
+    对面板中的一组股票一次性计算因子，结果和逐只股票的 add_factor 一致。
+    面板中没有K线的日期为空值，沿日期方向的差分和每只股票单独计算 diff 相同。
+
+    :param panel: dict，财务数据的时点面板，每个财务因子列是一个 日期 x 股票 的二维数组，参考 build_fin_panel。
+    :param param: 因子计算所需的参数，和 add_factor 相同。
+    :param kwargs: 其他关键字参数，包括 col_name：新计算的因子列名。
+    :return: tuple
+        - np.ndarray: 日期 x 股票 的因子数据。
+        - dict: 聚合方式字典。
+    """
+    col_name = kwargs['col_name']
+    n = get_periods(param)  # 滚动周期数，用于归母净利润同比增速计算
+
+    values = panel['R_np_atoopc@xbx_单季同比']
+    factor_values = values - shift_axis0(values, n)
+
+    return factor_values, {col_name: 'last'}